@@ -8,39 +8,164 @@ import django
 
 django.setup()
 
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
 from django.utils import timezone
-from aiogram.filters import Command
-from aiogram.types import Message
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
-from orders.models import Flower, OrderHistory, Report, Order
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, InlineQuery, Message
+from orders.models import OrderHistory, Report, Order
+from orders.routing import plan_routes, format_manifest
+from orders.forecast import forecast_demand, format_forecast
+from orders.status import PENDING, STATUS_LABELS, get_order_status
+from orders.cart import CartError
+from orders.stock import OutOfStock
+from orders.bot_catalog import (ADD_CALLBACK, CHECKOUT_CALLBACK, INLINE_CACHE_SECONDS, add_to_telegram_cart,
+                                checkout_telegram_cart, reorder_to_telegram_cart, telegram_cart_summary)
+from orders.bot_catalog import catalog as catalog_snapshot
+from orders.recommendations import ALSO, TOGETHER, get_recommendations
+from orders.replica import read_from_replica
+from orders.search import search_orders
+from orders.telegram_photos import send_catalog
 from asgiref.sync import sync_to_async
 from datetime import datetime
 import aiofiles
-from asgiref.sync import sync_to_async
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+try:
+    from config import TELEGRAM_BOT_TOKEN
+except ImportError:
+    # Без локального config.py токен берется из переменной окружения TELEGRAM_BOT_TOKEN
+    TELEGRAM_BOT_TOKEN = settings.TELEGRAM_BOT_TOKEN
+
+# Логирование настраивается в settings.LOGGING (фоновая запись, JSON, маскирование адресов и телефонов)
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
+# Букет из снимка каталога в памяти, без запроса к базе; None, если такого нет
+async def get_flower_by_id(id):
+    snapshot = await catalog_snapshot.get(bot.id)
+    return snapshot.by_id.get(id)
+
+def is_staff(message):
+    staff = settings.TELEGRAM_STAFF_IDS
+    return message.from_user.id in staff or message.chat.id in staff
+
+async def staff_only(message):
+    """Команды с адресами и данными заказов — только сотрудникам (settings.TELEGRAM_STAFF_IDS)"""
+    if is_staff(message):
+        return True
+    logger.warning("User %s tried a staff command: %s", message.from_user.id, message.text.split()[0])
+    await message.answer("Команда доступна только сотрудникам.")
+    return False
+
 # Применение sync_to_async для работы с Django ORM
 @sync_to_async
-def get_flower_by_id(id):
-    try:
-        return Flower.objects.get(id=id)
-    except Flower.DoesNotExist:
-        return None
-@sync_to_async
 def get_orders_by_status(status):
-    return Order.objects.filter(status=status)
+    # Список для персонала допускает отставание реплики на минуты
+    with read_from_replica():
+        return list(Order.objects.filter(status=status).values_list('id', flat=True))
+
+@sync_to_async
+def find_orders(query, limit=10):
+    # Поиск для поддержки читает основную базу: только что оформленный заказ должен находиться
+    return list(
+        search_orders(query).order_by('-id').values('id', 'status', 'delivery_date', 'address')[:limit]
+    )
+
+@sync_to_async
+def build_report(start_date, end_date):
+    report = Report.objects.create(start_date=start_date, end_date=end_date)
+    report.calculate_report()  # Показатели считаются по реплике
+    return report
 
-# Стартовый обработчик
+# Стартовый обработчик; /start checkout приходит из кнопки «Оформить заказ» в inline-режиме
 @dp.message(Command('start'))
-async def send_welcome(message: Message):
-    logger.info(f"User {message.from_user.id} sent the /start command")
-    await message.answer("Здравствуйте! Я ваш помощник для получения заказов!")
+async def send_welcome(message: Message, command: CommandObject):
+    logger.info("User %s sent the /start command", message.from_user.id)
+    if command.args == 'checkout':
+        await show_cart(message)
+        return
+    me = await bot.me()
+    await message.answer("Здравствуйте! Я ваш помощник для получения заказов!\n"
+                         f"Чтобы выбрать букет, наберите в любом чате @{me.username} и название.")
+
+def format_cart(summary):
+    lines = [f"{item['name']} × {item['quantity']} — {item['total_price']} ₽" for item in summary['items']]
+    return "Ваша корзина:\n" + "\n".join(lines) + f"\nИтого: {summary['total_price']} ₽"
+
+# Обработчик команд /cart и /order: корзина покупателя, собранная кнопками в inline-режиме
+@dp.message(Command('cart', 'order'))
+async def show_cart(message: Message):
+    summary = await sync_to_async(telegram_cart_summary)(message.from_user.id)
+    if not summary or not summary['items']:
+        me = await bot.me()
+        await message.answer(f"Ваша корзина пуста. Найдите букет: наберите @{me.username} и название.")
+        return
+    await message.answer(
+        format_cart(summary) + "\n\nЧтобы оформить заказ, отправьте дату, время и адрес доставки, например:\n"
+        "/checkout 2025-03-08 12:00 Москва, ул. Тверская, д. 1"
+    )
+
+# Обработчик команды /checkout: заказ по корзине из Telegram
+@dp.message(Command('checkout'))
+async def checkout(message: Message):
+    try:
+        date_str, time_str, address = message.text.split(maxsplit=3)[1:]
+        delivery_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        delivery_time = datetime.strptime(time_str, '%H:%M').time()
+    except ValueError:
+        await message.answer("Пожалуйста, укажите дату, время и адрес, например: "
+                             "/checkout 2025-03-08 12:00 Москва, ул. Тверская, д. 1")
+        return
+    if delivery_date < timezone.localdate():
+        await message.answer("Дата доставки уже прошла.")
+        return
+
+    try:
+        order = await sync_to_async(checkout_telegram_cart)(message.from_user.id, delivery_date, delivery_time,
+                                                            address.strip())
+    except CartError as e:
+        await message.answer(str(e))
+        return
+    except OutOfStock:
+        await message.answer("К сожалению, часть букетов закончилась. Измените корзину.")
+        return
+    except Exception as e:
+        logger.error("Telegram checkout failed: %s", e)
+        await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
+        return
+    await message.answer(f"Заказ {order.id} оформлен на сумму {order.total_price} ₽. "
+                         f"Доставка {delivery_date:%d.%m.%Y} в {delivery_time:%H:%M}, оплата при получении. "
+                         f"Статус: /status_order {order.id}")
+
+# Inline-режим: поиск букетов по названию из снимка каталога, без запросов к базе
+@dp.inline_query()
+async def inline_catalog(query: InlineQuery):
+    snapshot = await catalog_snapshot.get(bot.id)
+    results, next_offset = snapshot.inline_results(query.query, query.offset)
+    await query.answer(results, cache_time=INLINE_CACHE_SECONDS, next_offset=next_offset)
+
+# Кнопка «В корзину» под букетом
+@dp.callback_query(F.data.startswith(ADD_CALLBACK))
+async def add_to_cart_button(callback: CallbackQuery):
+    try:
+        flower_id = int(callback.data[len(ADD_CALLBACK):])
+        summary = await sync_to_async(add_to_telegram_cart)(callback.from_user.id, flower_id)
+    except CartError as e:
+        await callback.answer(str(e), show_alert=True)
+        return
+    except Exception as e:
+        logger.error("Adding to Telegram cart failed: %s", e)
+        await callback.answer("Произошла ошибка, пожалуйста, попробуйте позже.", show_alert=True)
+        return
+    flower = await get_flower_by_id(flower_id)
+    name = flower['name'] if flower else "Букет"
+    await callback.answer(f"«{name}» в корзине. Всего {summary['total_items']} шт. на {summary['total_price']} ₽")
+
+# Кнопка «Оформить заказ»: адрес и время доставки спрашиваются в личном чате с ботом
+@dp.callback_query(F.data == CHECKOUT_CALLBACK)
+async def checkout_button(callback: CallbackQuery):
+    me = await bot.me()
+    await callback.answer(url=f"https://t.me/{me.username}?start=checkout")
 
 # Обработчик команды /help с инструкциями
 @dp.message(Command("help"))
@@ -48,26 +173,45 @@ async def send_help(message: Message):
     help_text = (
         "Доступные команды:\n\n"
         "/start - Начать взаимодействие с ботом\n"
+        "/catalog - Каталог букетов с фото\n"
+        "/cart - Корзина, собранная через поиск @бота\n"
+        "/checkout <YYYY-MM-DD> <HH:MM> <адрес> - Оформить заказ по корзине\n"
         "/repeat_order <order_id> - Повторить заказ по ID\n"
         "/status_order <order_id> - Получить статус заказа\n"
+        "/find <адрес, телефон или ID> - Найти заказы (для сотрудников)\n"
         "/report - Генерация отчета по заказам\n"
+        "/routes [YYYY-MM-DD] - Маршрутные листы курьеров на дату (для сотрудников)\n"
+        "/recommend <flower_id> - Что покупают вместе с букетом\n"
+        "/forecast [YYYY-MM-DD] [дней] - Прогноз спроса для закупки (для сотрудников)\n"
         "/help - Показать доступные команды\n\n"
         "Инструкции:\n"
         "- Для команды /report используйте даты в формате: YYYY-MM-DD, например: /report 2024-01-01 2024-01-31\n"
         "- Если не знаете ID заказа, попробуйте найти его в истории заказов на сайте.\n"
         "- Для получения статуса всех заказов, находящихся на исполнении, используйте команду /status."
     )
-    await message.answer(help_text, parse_mode='Markdown')
+    # Без разметки: подчеркивания в названиях команд (repeat_order) Markdown принял бы за курсив
+    await message.answer(help_text)
+
+# Обработчик команды /catalog: букеты альбомами с фото, загруженные фото отправляются по file_id
+@dp.message(Command('catalog'))
+async def show_catalog(message: Message):
+    try:
+        stats = await send_catalog(bot, message.chat.id)
+        if not stats['albums'] and not stats['without_photo']:
+            await message.answer("Каталог пока пуст.")
+    except Exception as e:
+        logger.error("Catalog sending failed: %s", e)
+        await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
 
 # Обработчик для вывода статусов всех заказов "на исполнении"
 @dp.message(Command('status'))
 async def status_execution(message: Message):
-    orders = Order.objects.filter(status='pending')  # Статус "на исполнении"
-    if not orders:
+    order_ids = await get_orders_by_status(PENDING)  # Статус "на исполнении"
+    if not order_ids:
         await message.answer("На данный момент нет заказов в статусе 'на исполнении'.")
         return
 
-    statuses = "\n".join([f"Заказ ID: {order.id}, Статус: {order.status}" for order in orders])
+    statuses = "\n".join([f"Заказ ID: {order_id}, Статус: {STATUS_LABELS[PENDING]}" for order_id in order_ids])
     await message.answer(f"Заказы на исполнении:\n{statuses}")
 
 # Обработчик команды /status_order для получения статуса заказа по ID
@@ -75,59 +219,76 @@ async def status_execution(message: Message):
 async def status_order(message: Message):
     try:
         order_id = int(message.text.split()[1])
-        order = await get_order_by_id(order_id)
+        status = await sync_to_async(get_order_status)(order_id)
 
-        if not order:
+        if not status:
             await message.answer("Заказ с таким ID не найден.")
             return
 
-        await message.answer(f"Статус заказа {order.id}: {order.status}")
+        await message.answer(f"Статус заказа {order_id}: {STATUS_LABELS.get(status, status)}")
 
     except IndexError:
         await message.answer("Пожалуйста, укажите ID заказа для получения статуса, например: /status_order 3")
     except ValueError:
         await message.answer("ID заказа должно быть числом.")
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
+        await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
+
+# Обработчик команды /find для поиска заказов по части адреса, телефону или началу ID
+@dp.message(Command('find'))
+async def find(message: Message):
+    if not await staff_only(message):
+        return
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.answer("Пожалуйста, укажите, что искать, например: /find Ленина 5")
+        return
+    try:
+        orders = await find_orders(query)
+    except Exception as e:
+        logger.error("Order search failed: %s", e)
         await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
+        return
+
+    if not orders:
+        await message.answer("Заказы не найдены.")
+        return
+    lines = [
+        f"Заказ {order['id']}: {STATUS_LABELS.get(order['status'], order['status'])}, "
+        f"{order['delivery_date']:%d.%m.%Y}, {order['address']}"
+        for order in orders
+    ]
+    await message.answer("Найденные заказы:\n" + "\n".join(lines))
 
 # Обработчик команды /repeat_order для повторного оформления заказа
 @dp.message(Command('repeat_order'))
 async def repeat_order(message: Message):
     try:
-        # Получаем заказ из истории по ID
+        # Повторяем только свой заказ из бота и кладем его в свою корзину
         order_id = int(message.text.split()[1])
-        order_history = await get_order_history_by_id(order_id)
+        summary, added, repriced = await sync_to_async(reorder_to_telegram_cart)(message.from_user.id, order_id)
 
-        if not order_history:
-            await message.answer("Заказ с таким ID не найден.")
+        if not added:
+            await message.answer(f"Заказ {order_id} уже добавлен в вашу корзину.")
             return
 
-        # Создаем новый заказ на основе истории
-        cart, created = Cart.objects.get_or_create(user=message.from_user)
-        CartItem.objects.create(
-            cart=cart,
-            flower=order_history.flower,
-            quantity=order_history.quantity
+        text = (
+            f"Заказ {order_id} добавлен в вашу корзину.\n"
+            f"Товаров: {summary['total_items']}, сумма по текущим ценам: {summary['total_price']} ₽"
         )
-
-        new_order = Order.objects.create(
-            user=message.from_user,
-            cart=cart,
-            flower=order_history.flower,
-            quantity=order_history.quantity,
-            delivery_date=order_history.delivery_date,
-            delivery_time=order_history.delivery_time,
-            address=order_history.delivery_address,
-            comment=order_history.comment
-        )
-
-        await message.answer(f"Ваш заказ {new_order.id} был успешно повторен!")
+        if repriced:
+            text += f"\nИзменились цены: {', '.join(repriced)}"
+        await message.answer(text)
 
     except IndexError:
         await message.answer("Пожалуйста, укажите ID заказа для повторения, например: /repeat_order 3")
+    except ValueError:
+        await message.answer("ID заказа должно быть числом.")
+    except CartError as e:
+        await message.answer(str(e))
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
 
 # Обработчик команды /report для генерации отчета
@@ -145,11 +306,7 @@ async def generate_report(message: types.Message):
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
 
         # Создаем отчет и выполняем расчеты
-        report = Report.objects.create(
-            start_date=start_date,
-            end_date=end_date
-        )
-        report.calculate_report()
+        report = await build_report(start_date, end_date)
 
         # Отправка отчета пользователю
         report_text = (
@@ -164,19 +321,101 @@ async def generate_report(message: types.Message):
         await message.answer(report_text, parse_mode='Markdown')
 
     except Exception as e:
-        logger.error(f"Ошибка при генерации отчета: {e}")
+        logger.error("Ошибка при генерации отчета: %s", e)
         await message.answer("Произошла ошибка при генерации отчета, попробуйте позже.")
 
+# Обработчик команды /recommend с рекомендациями к букету
+@dp.message(Command('recommend'))
+async def recommend(message: Message):
+    try:
+        flower_id = int(message.text.split()[1])
+        flower = await get_flower_by_id(flower_id)
+        if not flower:
+            await message.answer("Букет с таким ID не найден.")
+            return
+        name = flower['name']
+
+        together = await sync_to_async(get_recommendations)(flower_id, kind=TOGETHER)
+        also = await sync_to_async(get_recommendations)(flower_id, kind=ALSO)
+        if not together and not also:
+            await message.answer(f"Для букета «{name}» пока нет рекомендаций.")
+            return
+
+        lines = [f"Рекомендации к букету «{name}»:"]
+        if together:
+            lines.append("Покупают вместе: " + ", ".join(f"{other.name} (ID {other.id})" for other in together))
+        if also:
+            lines.append("Также заказывали: " + ", ".join(f"{other.name} (ID {other.id})" for other in also))
+        await message.answer("\n".join(lines))
+
+    except IndexError:
+        await message.answer("Пожалуйста, укажите ID букета, например: /recommend 3")
+    except ValueError:
+        await message.answer("ID букета должно быть числом.")
+    except Exception as e:
+        logger.error("Ошибка при подборе рекомендаций: %s", e)
+        await message.answer("Произошла ошибка, пожалуйста, попробуйте позже.")
+
+
+# Обработчик команды /routes для маршрутных листов курьеров
+@dp.message(Command('routes'))
+async def routes(message: Message):
+    if not await staff_only(message):
+        return
+    try:
+        args = message.text.split()[1:]
+        delivery_date = datetime.strptime(args[0], '%Y-%m-%d').date() if args else timezone.localdate()
+
+        manifests = await sync_to_async(plan_routes)(delivery_date)
+        if not manifests:
+            await message.answer(f"На {delivery_date} нет подтвержденных заказов.")
+            return
+
+        for manifest in manifests:
+            await message.answer(format_manifest(manifest))
+
+    except ValueError:
+        await message.answer("Пожалуйста, укажите дату в формате YYYY-MM-DD, например: /routes 2024-02-14")
+    except Exception as e:
+        logger.error("Ошибка при построении маршрутов: %s", e)
+        await message.answer("Произошла ошибка при построении маршрутов, попробуйте позже.")
+
+
+# Обработчик команды /forecast с прогнозом спроса для закупки
+@dp.message(Command('forecast'))
+async def forecast(message: Message):
+    if not await staff_only(message):
+        return
+    try:
+        args = message.text.split()[1:]
+        start = datetime.strptime(args[0], '%Y-%m-%d').date() if args else timezone.localdate()
+        days = int(args[1]) if len(args) > 1 else 14
+
+        result = await sync_to_async(forecast_demand)(start=start, days=min(max(days, 1), 60))
+        await message.answer(format_forecast(result))
+
+    except ValueError:
+        await message.answer("Пожалуйста, укажите дату и число дней, например: /forecast 2025-02-10 7")
+    except Exception as e:
+        logger.error("Ошибка при построении прогноза: %s", e)
+        await message.answer("Произошла ошибка при построении прогноза, попробуйте позже.")
+
 
 # Основная функция запуска
 async def main():
+    if settings.TELEGRAM_WEBHOOK_URL:
+        # Обновления принимает сайт (/telegram/webhook/) в том же uvicorn-процессе; здесь только регистрация
+        await bot.set_webhook(settings.TELEGRAM_WEBHOOK_URL, secret_token=settings.TELEGRAM_WEBHOOK_SECRET)
+        await bot.session.close()
+        logger.info("Вебхук бота зарегистрирован: %s", settings.TELEGRAM_WEBHOOK_URL)
+        return
     try:
         logger.info("Бот запущен")
+        await catalog_snapshot.refresh(bot.id)  # Снимок каталога для inline-режима загружается до первых запросов
         await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен")
 
 # Запуск бота
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main())
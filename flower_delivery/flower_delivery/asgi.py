@@ -1,8 +1,12 @@
-""
+"""
 ASGI config for flower_delivery project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Storefront and the Telegram bot webhook are served by the same process pool:
+
+    uvicorn flower_delivery.asgi:application --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
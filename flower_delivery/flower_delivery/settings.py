@@ -1,21 +1,37 @@
 from pathlib import Path
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 import os
+import sys
 
 # Загружаем переменные окружения из файла .env
 load_dotenv()
 
 # Секретный ключ для Django
-SECRET_KEY = os.getenv('DJANGO_SECRET_KEY', 'default_secret_key')
+DEFAULT_SECRET_KEY = 'default_secret_key'
+SECRET_KEY = os.getenv('DJANGO_SECRET_KEY', DEFAULT_SECRET_KEY)
 
 # Режим отладки
 DEBUG = os.getenv('DJANGO_DEBUG', 'True') == 'True'
+# Запуск тестов (manage.py test)
+TESTING = sys.argv[1:2] == ['test']
+
+# Общеизвестным ключом можно подделать подписи Django (сброс пароля, cookie), поэтому без него не запускаемся
+if not DEBUG and SECRET_KEY == DEFAULT_SECRET_KEY:
+    raise ImproperlyConfigured("DJANGO_SECRET_KEY must be set when DJANGO_DEBUG is off")
 
 # Разрешенные хосты
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# Бот в режиме вебхука: адрес https://<домен>/telegram/webhook/ и секрет для проверки запросов Telegram
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+# Сотрудники в боте (ID пользователей или чатов через запятую): поиск заказов, маршруты, прогноз.
+# По умолчанию — чат уведомлений о заказах
+TELEGRAM_STAFF_IDS = [int(staff_id) for staff_id in os.getenv('TELEGRAM_STAFF_IDS', TELEGRAM_CHAT_ID or '').split(',')
+                      if staff_id.strip()]
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'orders.log.RequestIdMiddleware',
+    'orders.replica.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,8 +63,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Шаблоны компилируются один раз на процесс; при DEBUG runserver сбрасывает кэш при их изменении
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -63,9 +87,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Запись сразу берет блокировку: параллельные оформления ждут, а не падают с "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Файловая тестовая БД нужна для тестов с параллельными потоками
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Реплика для отчетов, сводок и списков в админке (orders/replica.py): копия SQLite,
+# которую обновляет manage.py snapshot_replica. Без DJANGO_REPLICA_DB все читается из default.
+REPLICA_DB = os.getenv('DJANGO_REPLICA_DB')
+if REPLICA_DB:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': REPLICA_DB,
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['orders.replica.ReplicaRouter']
+# Сколько секунд после своей записи пользователь читает только из default; больше интервала снимков реплики
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 300))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -79,8 +124,22 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# В продакшене collectstatic добавляет хэш в имена файлов, минифицирует CSS и
+# заранее сжимает gzip/brotli (orders/assets.py); при DEBUG файлы берутся из static/ как есть
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+                    else 'orders.assets.PrecompressedManifestStaticFilesStorage'),
+    },
+}
+# Отдавать STATIC_ROOT самим приложением (со сжатыми вариантами), если перед ним нет nginx или CDN
+SERVE_STATIC = os.getenv('DJANGO_SERVE_STATIC', 'False') == 'True'
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Импорт каталога читает локальные изображения только из этого каталога
+CATALOG_IMPORT_DIR = os.getenv('CATALOG_IMPORT_DIR', os.path.join(BASE_DIR, 'import'))
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -90,3 +149,92 @@ SITE_URL = "http://127.0.0.1:8000"
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Сессии читаются из кэша, в базу пишутся только при изменении: просмотр каталога гостем базу не трогает.
+# В cookie лежит лишь ключ сессии, поэтому выход и смена пароля действительно завершают сессию.
+# Корзина гостя хранится в сессии и попадает в таблицу корзин только при оформлении заказа или входе.
+SESSION_ENGINE = os.getenv('DJANGO_SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+SESSION_COOKIE_AGE = 60 * 60 * 24 * 14
+SESSION_COOKIE_HTTPONLY = True
+
+# Планирование маршрутов курьеров
+DELIVERY_DEPOT = (55.7558, 37.6173)  # Координаты склада (широта, долгота)
+COURIER_CAPACITY = 8  # Заказов на одного курьера в окне доставки
+DELIVERY_WINDOW_HOURS = 2  # Ширина окна доставки в часах
+
+# Оплата (manage.py reconcile_payments сверяет платежи и отменяет неоплаченные заказы)
+# Локальный FakePaymentProvider допускается только в режиме отладки и тестах; в работе провайдер задается явно
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'orders.payments.FakePaymentProvider' if DEBUG or TESTING else None)
+# Ключ подписи вебхуков; без него вебхуки отклоняются
+PAYMENT_WEBHOOK_SECRET = os.getenv('PAYMENT_WEBHOOK_SECRET', 'test-webhook-secret' if TESTING else None)
+PAYMENT_TIMEOUT_MINUTES = 30  # Неоплаченный заказ отменяется через это время
+# Резерв неоплаченного заказа держится дольше окна оплаты и продлевается при начале оплаты
+RESERVATION_MINUTES = PAYMENT_TIMEOUT_MINUTES + 5
+PAYMENT_SUBMIT_ASYNC = True  # Платеж создается у провайдера в фоне, запрос покупателя не ждет
+PAYMENT_FAKE_AUTO_CAPTURE = TESTING  # Локальный провайдер сразу подтверждает оплату только в тестах
+
+# История заказов
+ORDER_HISTORY_RETENTION_DAYS = 365  # Записи старше уходят в архив (manage.py archive_order_history)
+
+# Кэш: локальная память процесса (LRU с ограничением числа записей).
+# Для нескольких процессов укажите общий backend, например Redis или Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', 'flower-delivery'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    }
+}
+CACHE_MAX_ENTRY_BYTES = 256 * 1024  # Записи крупнее не кэшируются
+
+# Ограничение частоты запросов: отдельно по IP, сессии и пользователю ('N/s', 'N/m', 'N/h', 'N/d').
+# Счетчики в памяти процесса; для нескольких процессов укажите алиас общего кэша.
+RATELIMITS = {
+    'add_to_cart': os.getenv('RATELIMIT_ADD_TO_CART', '30/m'),
+    'confirm_order': os.getenv('RATELIMIT_CONFIRM_ORDER', '10/m'),
+    'signup': os.getenv('RATELIMIT_SIGNUP', '5/h'),
+    'login': os.getenv('RATELIMIT_LOGIN', '10/m'),
+}
+RATELIMIT_CACHE_ALIAS = os.getenv('RATELIMIT_CACHE_ALIAS')  # Например 'default' при Redis или Memcached
+RATELIMIT_TRUST_X_FORWARDED_FOR = os.getenv('RATELIMIT_TRUST_X_FORWARDED_FOR', 'False') == 'True'
+
+# Почта для уведомлений покупателей (по умолчанию письма выводятся в консоль)
+EMAIL_BACKEND = os.getenv('DJANGO_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@flower-delivery.local')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')  # Для filebased.EmailBackend
+
+# Утренняя сводка (manage.py send_digest по расписанию): чаты Telegram и адреса через запятую
+DIGEST_TELEGRAM_CHAT_IDS = [chat_id.strip() for chat_id in os.getenv('DIGEST_TELEGRAM_CHAT_IDS', TELEGRAM_CHAT_ID or '').split(',')
+                            if chat_id.strip()]
+DIGEST_EMAIL_RECIPIENTS = [email.strip() for email in os.getenv('DIGEST_EMAIL_RECIPIENTS', '').split(',') if email.strip()]
+
+# Логирование: поток запроса только ставит запись в очередь, форматирует и пишет фоновый поток (orders/log.py).
+# Адреса и телефоны в сообщениях маскируются.
+# В тестах по умолчанию пишутся только ошибки, чтобы не засорять вывод
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'ERROR' if TESTING else 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' или 'text'
+LOG_FILE = os.getenv('LOG_FILE')  # По умолчанию stderr
+# Доля записей ниже WARNING, которые пишутся от шумных логгеров (просмотры страниц, добавления в корзину)
+LOG_SAMPLING = {
+    'orders.access': float(os.getenv('LOG_SAMPLING_ACCESS', '0.1')),
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {'()': 'orders.log.SamplingFilter', 'rates': LOG_SAMPLING},
+    },
+    'handlers': {
+        'background': {
+            'class': 'orders.log.BackgroundHandler',
+            'filename': LOG_FILE,
+            'fmt': LOG_FORMAT,
+            'filters': ['sampling'],
+        },
+    },
+    'root': {'handlers': ['background'], 'level': LOG_LEVEL},
+    'loggers': {
+        'django': {'handlers': ['background'], 'level': LOG_LEVEL if TESTING else 'INFO', 'propagate': False},
+    },
+}
@@ -1,14 +1,66 @@
+import io
+from datetime import datetime
+
 from django.contrib import admin
+from django.shortcuts import render
+from django.urls import path
 from django.utils.timezone import now
-from .models import Order, Flower, CartItem, Report, Review
+from .models import (Order, OrderHistory, OrderStatusEvent, Flower, CartItem, DigestDelivery, Report, Review,
+                     Subscription, SubscriptionItem)
+from .routing import plan_routes
+from .forecast import forecast_demand
+from .catalog_import import CatalogImportError, detect_format, format_report, import_catalog, read_catalog
+from .forms import CatalogImportForm
+from .replica import read_from_replica
+from .search import search_orders, search_reviews
+from .stock import reconcile_stock
+from .cart import CartError
+from .reorder import reorder
+from .caching import bump_flower_versions
+from .subscriptions import SubscriptionError, subscribe_order
+from .status import CANCELED, CONFIRMED, DELIVERED, PENDING, STATUS_LABELS, transition_orders
+
+
+class ReplicaModelAdmin(admin.ModelAdmin):
+    """Списки объектов читаются с реплики; действия над выбранными (POST) — из основной базы"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with read_from_replica():
+            response = super().changelist_view(request, extra_context)
+            # Шаблон ответа рендерится здесь же, пока чтения идут на реплику
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+# Журнал статусов только для чтения
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    fields = ('created_at', 'from_status', 'to_status', 'source', 'actor')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 # Регистрируем модель Order
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ReplicaModelAdmin):
     list_display = ('id', 'user', 'get_flowers', 'get_total_quantity', 'delivery_date', 'status', 'address')
-    list_filter = ('status', 'delivery_date', 'user')  # Фильтры по статусу, дате и пользователю
+    list_filter = ('status', 'payment_method', 'delivery_date', 'user')  # Фильтры по статусу, оплате, дате и пользователю
     search_fields = ('user__username', 'address')  # Поиск по пользователю и адресу
-    actions = ['repeat_order', 'mark_as_confirmed', 'mark_as_delivered', 'mark_as_pending']  # Действия для изменения статуса
+    actions = ['repeat_order', 'subscribe_weekly', 'mark_as_confirmed', 'mark_as_delivered', 'mark_as_pending', 'mark_as_canceled']  # Действия для изменения статуса
+    readonly_fields = ('status',)  # Статус меняется только действиями, чтобы переход попал в журнал
+    inlines = [OrderStatusEventInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу: часть адреса, пользователь, телефон или начало ID заказа
+        if not search_term.strip():
+            return queryset, False
+        return search_orders(search_term, queryset), False
 
     def get_flowers(self, obj):
         if obj.cart:
@@ -24,81 +76,135 @@ class OrderAdmin(admin.ModelAdmin):
 
     get_total_quantity.short_description = "Общее количество"
 
+    def get_urls(self):
+        urls = [
+            path('routes/', self.admin_site.admin_view(self.routes_view), name='orders_order_routes'),
+        ]
+        return urls + super().get_urls()
+
+    def routes_view(self, request):
+        """Маршрутные листы курьеров на выбранную дату"""
+        try:
+            delivery_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            delivery_date = now().date()
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=f"Маршруты курьеров на {delivery_date}",
+            delivery_date=delivery_date,
+            manifests=plan_routes(delivery_date),
+        )
+        return render(request, 'admin/orders/routes.html', context)
+
     def repeat_order(self, request, queryset):
-        """Повторить заказ для выбранных заказов"""
+        """Повтор выбранных заказов через общий сервис: позиции добавляются в корзину покупателя"""
+        # Любая запись истории заказа: сервис сам соберет по ней все позиции
+        history_ids = dict(OrderHistory.objects.filter(order__in=queryset).values_list('order_id', 'id'))
         for order in queryset:
-            if not order.cart.items.exists():
-                self.message_user(request, f"Заказ {order.id} не может быть повторен, так как корзина пуста.")
-                continue  # Если корзина пуста, пропускаем заказ
-
-            # Проверка, что заказ не был доставлен или отменен
-            if order.status in ['delivered', 'canceled']:
-                self.message_user(request,
-                                  f"Заказ {order.id} не может быть повторен, так как он уже был доставлен или отменен.")
+            history_id = history_ids.get(order.id)
+            if history_id is None:
+                self.message_user(request, f"Заказ {order.id} не может быть повторен: нет позиций в истории.",
+                                  level='error')
                 continue
-
-            # Дополнительная проверка: есть ли товары в корзине
-            if order.cart.items.count() == 0:
-                self.message_user(request, f"Корзина для заказа {order.id} пуста, повторный заказ невозможен.")
+            try:
+                summary, added, repriced = reorder(history_id)
+            except CartError as e:
+                self.message_user(request, f"Заказ {order.id}: {e}", level='error')
+                continue
+            if not added:
+                self.message_user(request, f"Заказ {order.id} уже добавлен в корзину покупателя.")
                 continue
+            text = (f"Заказ {order.id} добавлен в корзину покупателя: {summary['total_items']} шт. "
+                    f"на {summary['total_price']} ₽.")
+            if repriced:
+                text += f" Изменились цены: {', '.join(repriced)}."
+            self.message_user(request, text)
 
-            # Создаем новый заказ на основе старого
+    def subscribe_weekly(self, request, queryset):
+        """Еженедельная подписка по образцу выбранных заказов"""
+        for order in queryset:
             try:
-                new_order = Order.objects.create(
-                    user=order.user,
-                    cart=order.cart,
-                    delivery_date=order.delivery_date,
-                    delivery_time=order.delivery_time,
-                    address=order.address,
-                    status='pending',  # Статус нового заказа
-                    comment=order.comment
-                )
-
-                # Логирование успешного создания заказа
-                self.message_user(request, f"Заказ {order.id} успешно повторен как заказ {new_order.id}.")
-
-            except Exception as e:
-                # Логирование ошибки
-                self.message_user(request, f"Ошибка при повторе заказа {order.id}: {str(e)}", level='error')
-                continue  # Пропускаем заказ, если возникла ошибка
+                subscription = subscribe_order(order, interval_days=7)
+            except SubscriptionError as e:
+                self.message_user(request, str(e), level='error')
+                continue
+            self.message_user(request, f"Заказ {order.id}: оформлена подписка {subscription.id}, "
+                                       f"первая доставка {subscription.next_delivery_date}.")
 
     # Действия для изменения статуса
+    def _transition(self, request, queryset, to_status):
+        changed, rejected = transition_orders(queryset.values_list('id', flat=True), to_status,
+                                              source='admin', actor=request.user)
+        if rejected:
+            self.message_user(
+                request,
+                f"Нельзя перевести в «{STATUS_LABELS[to_status]}» заказы: "
+                + ", ".join(f"{order_id} ({STATUS_LABELS.get(status)})" for order_id, status in sorted(rejected.items())),
+                level='warning',
+            )
+        return changed
+
     def mark_as_confirmed(self, request, queryset):
-        updated = queryset.update(status='confirmed')
-        self.message_user(request, f'{updated} заказов отмечено как подтвержденные.')
+        updated = self._transition(request, queryset, CONFIRMED)
+        self.message_user(request, f'{len(updated)} заказов отмечено как подтвержденные.')
 
     def mark_as_delivered(self, request, queryset):
-        updated = queryset.update(status='delivered')
-        self.message_user(request, f'{updated} заказов отмечено как доставленные.')
+        updated = self._transition(request, queryset, DELIVERED)
+        self.message_user(request, f'{len(updated)} заказов отмечено как доставленные.')
 
     def mark_as_pending(self, request, queryset):
-        updated = queryset.update(status='pending')
-        self.message_user(request, f'{updated} заказов возвращено в статус "в ожидании".')
+        updated = self._transition(request, queryset, PENDING)
+        self.message_user(request, f'{len(updated)} заказов возвращено в статус "в ожидании".')
+
+    def mark_as_canceled(self, request, queryset):
+        updated = self._transition(request, queryset, CANCELED)
+        self.message_user(request, f'{len(updated)} заказов отменено, букеты возвращены на склад.')
 
     repeat_order.short_description = "Повторить заказ"
+    subscribe_weekly.short_description = "Оформить еженедельную подписку"
     mark_as_confirmed.short_description = "Отметить как подтвержденные"
     mark_as_delivered.short_description = "Отметить как доставленные"
     mark_as_pending.short_description = "Отметить как в ожидании"
+    mark_as_canceled.short_description = "Отменить и вернуть букеты на склад"
+
+class SubscriptionItemInline(admin.TabularInline):
+    model = SubscriptionItem
+    extra = 1
+
+# Подписки: заказы по ним создает manage.py generate_subscription_orders
+@admin.register(Subscription)
+class SubscriptionAdmin(ReplicaModelAdmin):
+    list_display = ('id', 'user', 'interval_days', 'next_delivery_date', 'delivery_time', 'address', 'is_active')
+    list_filter = ('is_active', 'interval_days')
+    search_fields = ('user__username', 'address')
+    inlines = [SubscriptionItemInline]
 
 # Регистрируем модель Review
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(ReplicaModelAdmin):
     list_display = ('flower', 'user', 'rating', 'comment', 'created_at')  # Поля, которые будут отображаться в списке
     list_filter = ('rating', 'created_at', 'flower')  # Фильтры для сортировки
     search_fields = ('user__username', 'flower__name', 'comment')  # Поиск по имени пользователя, продукту и комментарию
     ordering = ('-created_at',)  # Сортировка по дате создания (по убыванию)
     actions = ['delete_all_reviews']
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_reviews(search_term, queryset), False
+
     def delete_all_reviews(self, request, queryset):
         """Удалить все выбранные отзывы"""
-        count = queryset.count()
-        queryset.delete()
+        flower_ids = list(queryset.values_list('flower_id', flat=True).distinct())
+        count, _ = queryset.delete()
+        bump_flower_versions(flower_ids)
         self.message_user(request, f"{count} review(s) were successfully deleted.")
 
     delete_all_reviews.short_description = "Удалить все выбранные отзывы"
 
 @admin.register(Report)
-class ReportAdmin(admin.ModelAdmin):
+class ReportAdmin(ReplicaModelAdmin):
     list_display = ('start_date', 'end_date', 'total_orders', 'total_sales', 'profit', 'created_at')
     search_fields = ('start_date', 'end_date')
     actions = ['generate_report']
@@ -112,6 +218,74 @@ class ReportAdmin(admin.ModelAdmin):
 
     generate_report.short_description = "Пересчитать и обновить отчет"
 
-admin.site.register(Flower)
+# Журнал рассылки сводок: запись без даты отправки означает, что процесс упал во время отправки
+@admin.register(DigestDelivery)
+class DigestDeliveryAdmin(ReplicaModelAdmin):
+    list_display = ('period', 'period_start', 'channel', 'claimed_at', 'sent_at')
+    list_filter = ('period', 'channel')
+    readonly_fields = ('period', 'period_start', 'channel', 'claimed_at', 'sent_at')
+
+@admin.register(Flower)
+class FlowerAdmin(ReplicaModelAdmin):
+    list_display = ('sku', 'name', 'price', 'stock', 'stock_total')
+    search_fields = ('name', 'sku')
+    actions = ['reconcile_stock']
+
+    def get_urls(self):
+        urls = [
+            path('forecast/', self.admin_site.admin_view(self.forecast_view), name='orders_flower_forecast'),
+            path('import/', self.admin_site.admin_view(self.import_view), name='orders_flower_import'),
+        ]
+        return urls + super().get_urls()
+
+    def forecast_view(self, request):
+        """Прогноз спроса на букеты для закупки"""
+        try:
+            start = datetime.strptime(request.GET.get('start', ''), '%Y-%m-%d').date()
+        except ValueError:
+            start = now().date()
+        try:
+            days = min(max(int(request.GET.get('days', 14)), 1), 60)
+        except ValueError:
+            days = 14
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=f"Прогноз спроса с {start}",
+            days=days,
+            forecast=forecast_demand(start=start, days=days),
+        )
+        return render(request, 'admin/orders/forecast.html', context)
+
+    def import_view(self, request):
+        """Загрузка каталога букетов файлом"""
+        report = None
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+                report = import_catalog(read_catalog(stream, detect_format(upload.name)),
+                                        dry_run=form.cleaned_data['dry_run'])
+            except (CatalogImportError, UnicodeDecodeError) as e:
+                self.message_user(request, f"Не удалось прочитать каталог: {e}", level='error')
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title="Импорт каталога",
+            form=form,
+            report=report,
+            report_text=format_report(report) if report else '',
+        )
+        return render(request, 'admin/orders/catalog_import.html', context)
+
+    def reconcile_stock(self, request, queryset):
+        """Пересчет остатков по поступлениям и резервам"""
+        updated = reconcile_stock()
+        bump_flower_versions(queryset.values_list('id', flat=True))
+        self.message_user(request, f"Остатки пересчитаны для {updated} букетов.")
+
+    reconcile_stock.short_description = "Пересчитать остатки"
+
 admin.site.register(CartItem)
 
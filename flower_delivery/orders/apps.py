@@ -3,10 +3,17 @@ from django.apps import AppConfig
 
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'orders111'
-
-class MyAppConfig(AppConfig):
-    name = 'orders111'  # Укажите имя вашего приложения
+    name = 'orders'
 
     def ready(self):
-        import myapp.signals  # Подключаем сигналы
+        from django.core import checks
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # Подключаем сигналы
+        from .payments import check_payment_settings
+        from .search import create_search_tables
+
+        checks.register(check_payment_settings)
+
+        # Таблицы полнотекстового поиска — не модели, их создает обработчик после migrate
+        post_migrate.connect(create_search_tables, sender=self)
@@ -0,0 +1,172 @@
+"""Статические файлы витрины: сборка и отдача сжатых вариантов.
+
+Сборка — обычный ``manage.py collectstatic`` с хранилищем
+``PrecompressedManifestStaticFilesStorage`` (включается при DEBUG=False):
+файлы получают хэш содержимого в имени (``storefront.3f2a...css``), CSS
+минифицируется, а рядом с каждым текстовым файлом записываются
+``.gz`` и, если установлен пакет ``brotli``, ``.br``.
+
+Представление ``serve`` отдает из ``STATIC_ROOT`` вариант, который
+принимает клиент по ``Accept-Encoding``, без сжатия на лету. Файлы с
+хэшем в имени кэшируются браузером на год. Нужно только там, где перед
+приложением нет nginx или CDN (``DJANGO_SERVE_STATIC=True``).
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Что имеет смысл сжимать заранее; картинки и шрифты уже сжаты
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.map')
+# Файлы меньше этого не сжимаются: выигрыш меньше заголовков
+MIN_COMPRESS_SIZE = 256
+# Суффиксы вариантов в порядке предпочтения
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+DEFAULT_MAX_AGE = 60 * 60
+
+_CSS_TOKEN_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def minify_css(text):
+    """Удаление комментариев и лишних пробелов; строки в кавычках не меняются"""
+    parts = []
+    code = ''
+    # split дает чередование: код, строка в кавычках (None на месте комментария), код, ...
+    for index, chunk in enumerate(_CSS_TOKEN_RE.split(text) + ['']):
+        if index % 2 == 0:
+            code += chunk
+            continue
+        if chunk is None:
+            code += ' '
+            continue
+        parts.extend([_minify_code(code), chunk])
+        code = ''
+    parts.append(_minify_code(code))
+    return ''.join(parts).strip()
+
+
+def _minify_code(code):
+    code = re.sub(r'\s+', ' ', code)
+    # Пробел перед ":" не трогаем: "a :hover" и "a:hover" — разные селекторы
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    return code.replace(';}', '}')
+
+
+def compress(data):
+    """Сжатые варианты содержимого: {кодировка: байты}; только те, что меньше исходника"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хранилище с хэшем в именах, минифицированным CSS и заранее сжатыми вариантами"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            if hashed_name.endswith('.css'):
+                self._minify(hashed_name)
+        for name in paths:
+            self._precompress(name)
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            if hashed_name:
+                self._precompress(hashed_name)
+
+    def _minify(self, name):
+        with self.open(name) as original:
+            text = original.read().decode('utf-8')
+        minified = minify_css(text)
+        if minified != text:
+            self._overwrite(name, minified.encode('utf-8'))
+
+    def _precompress(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS) or not self.exists(name):
+            return
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = compress(data)
+        for encoding, suffix in ENCODINGS:
+            if encoding in variants:
+                self._overwrite(name + suffix, variants[encoding])
+            elif self.exists(name + suffix):
+                # Устаревший вариант от прошлой сборки отдал бы старое содержимое
+                self.delete(name + suffix)
+
+    def _overwrite(self, name, data):
+        with open(self.path(name), 'wb') as target:
+            target.write(data)
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с ненулевым q"""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve(request, path):
+    """Отдача файла из STATIC_ROOT в лучшей принимаемой клиентом кодировке"""
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404("Файл не найден")
+    if not os.path.isfile(fullpath):
+        raise Http404("Файл не найден")
+
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    content_encoding = None
+    for encoding, suffix in ENCODINGS:
+        if (encoding in accepted or '*' in accepted) and os.path.isfile(fullpath + suffix):
+            content_encoding = encoding
+            fullpath += suffix
+            break
+
+    stat = os.stat(fullpath)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type, filename=os.path.basename(path))
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    if HASHED_NAME_RE.search(path):
+        response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={DEFAULT_MAX_AGE}'
+    return response
@@ -0,0 +1,178 @@
+"""Кэш страниц букетов с точной инвалидацией.
+
+Ключ записи содержит версию букета (``flower:<id>:version``) и версию всего
+каталога (``catalog:version``). Сохранение или удаление букета, отзыва или
+оценки увеличивает версию букета, массовый импорт каталога — одну версию
+каталога, и старые записи просто перестают читаться. Одновременные промахи по одному ключу не
+пересчитывают данные параллельно: считает тот, кто взял блокировку, остальные
+ждут его результат.
+"""
+import asyncio
+import logging
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать результата чужого пересчета, прежде чем считать самому
+LOCK_WAIT_SECONDS = 2.0
+LOCK_TIMEOUT_SECONDS = 10
+# Записи крупнее этого размера не кэшируются
+DEFAULT_MAX_ENTRY_BYTES = 256 * 1024
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов кэша в рамках процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+stats = CacheStats()
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _version_key(flower_id):
+    return f"flower:{flower_id}:version"
+
+
+def _get_version(key):
+    # Новый счетчик начинается с текущего времени, чтобы после вытеснения
+    # не совпасть с версией, под которой еще лежат старые записи
+    return cache.get_or_set(key, int(time.time() * 1000), None)
+
+
+async def _aget_version(key):
+    return await cache.aget_or_set(key, int(time.time() * 1000), None)
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+
+def get_flower_version(flower_id):
+    return _get_version(_version_key(flower_id))
+
+
+def bump_flower_version(flower_id):
+    """Инвалидация всех закэшированных страниц букета"""
+    _bump_version(_version_key(flower_id))
+
+
+def bump_flower_versions(flower_ids):
+    for flower_id in set(flower_ids):
+        bump_flower_version(flower_id)
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Инвалидация страниц всех букетов одной операцией (после импорта каталога)"""
+    _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_or_compute(key, compute, timeout=None):
+    """Значение из кэша или результат ``compute()`` с защитой от лавины промахов"""
+    value = cache.get(key)
+    if value is not None:
+        stats.record(hit=True)
+        return value
+    stats.record(hit=False)
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, LOCK_TIMEOUT_SECONDS):
+        try:
+            value = compute()
+            _store(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    # Значение уже считает другой запрос — ждем его результат
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return compute()
+
+
+async def aget_or_compute(key, compute, timeout=None):
+    """Асинхронная версия ``get_or_compute``; ``compute`` — корутинная функция"""
+    value = await cache.aget(key)
+    if value is not None:
+        stats.record(hit=True)
+        return value
+    stats.record(hit=False)
+
+    lock_key = f"{key}:lock"
+    if await cache.aadd(lock_key, 1, LOCK_TIMEOUT_SECONDS):
+        try:
+            value = await compute()
+            if _fits(key, value):
+                await cache.aset(key, value, timeout)
+        finally:
+            await cache.adelete(lock_key)
+        return value
+
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+    return await compute()
+
+
+def _fits(key, value):
+    max_bytes = getattr(settings, 'CACHE_MAX_ENTRY_BYTES', DEFAULT_MAX_ENTRY_BYTES)
+    size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    if size > max_bytes:
+        logger.warning("Cache entry %s is %s bytes, larger than %s; not cached", key, size, max_bytes)
+        return False
+    return True
+
+
+def _store(key, value, timeout):
+    if _fits(key, value):
+        cache.set(key, value, timeout)
+
+
+def flower_detail_key(flower_id):
+    return f"flower_detail:{flower_id}:v{get_catalog_version()}.{get_flower_version(flower_id)}"
+
+
+async def aflower_detail_key(flower_id):
+    catalog_version = await _aget_version(CATALOG_VERSION_KEY)
+    flower_version = await _aget_version(_version_key(flower_id))
+    return f"flower_detail:{flower_id}:v{catalog_version}.{flower_version}"
@@ -0,0 +1,280 @@
+"""Операции с корзиной для страниц и JSON API.
+
+Корзина авторизованного пользователя хранится в таблице ``Cart``, корзина
+гостя — компактно в сессии (``{'v': версия, 'i': {flower_id: количество}}``)
+и превращается в строку ``Cart`` только при оформлении заказа или входе
+на сайт. Так просмотр каталога гостем не пишет в базу.
+
+Каждое изменение корзины увеличивает версию. Клиент передает версию,
+которую видел; если корзину уже изменили (двойной клик, вторая вкладка),
+изменение отклоняется с ``CartConflict`` и ничего не пишется.
+
+Функции с префиксом ``a`` — асинхронные версии для async-представлений.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Cart, CartItem, Flower
+
+logger = logging.getLogger(__name__)
+
+ADD = 'add'
+SET = 'set'
+
+SESSION_CART_KEY = 'cart'
+SESSION_CART_ID_KEY = 'cart_id'
+
+
+class CartError(Exception):
+    """Изменение корзины невозможно; текст исключения показывается покупателю"""
+
+
+class CartConflict(CartError):
+    """Корзина изменилась после того, как клиент получил ее версию"""
+
+
+class SessionCart:
+    """Корзина гостя в сессии"""
+    id = None
+
+    def __init__(self, session, data=None):
+        self.session = session
+        data = (session.get(SESSION_CART_KEY) if data is None else data) or {}
+        self.version = data.get('v', 0)
+        self.quantities = {int(flower_id): quantity for flower_id, quantity in data.get('i', {}).items()}
+
+    def save(self):
+        self.session[SESSION_CART_KEY] = {
+            'v': self.version,
+            'i': {str(flower_id): quantity for flower_id, quantity in self.quantities.items()},
+        }
+
+    def clear(self):
+        self.session.pop(SESSION_CART_KEY, None)
+        self.session.pop(SESSION_CART_ID_KEY, None)
+        self.quantities = {}
+
+
+def user_cart(user):
+    """Открытая корзина пользователя (без заказа); новая, если все корзины уже оформлены"""
+    cart = Cart.objects.filter(user=user, order__isnull=True).order_by('-id').first()
+    if cart is None:
+        cart = Cart.objects.create(user=user)
+    return cart
+
+
+async def auser_cart(user):
+    cart = await Cart.objects.filter(user=user, order__isnull=True).order_by('-id').afirst()
+    if cart is None:
+        cart = await Cart.objects.acreate(user=user)
+    return cart
+
+
+def get_request_cart(request):
+    """Корзина авторизованного пользователя или гостя"""
+    if request.user.is_authenticated:
+        return user_cart(request.user)
+    return SessionCart(request.session)
+
+
+async def aget_request_cart(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return await auser_cart(user)
+    return SessionCart(request.session, await request.session.aget(SESSION_CART_KEY, {}))
+
+
+def cart_lines(cart):
+    """Позиции корзины: (id позиции, букет, количество). У гостя id позиции — id букета"""
+    if isinstance(cart, SessionCart):
+        flowers = Flower.objects.in_bulk(cart.quantities)
+        return [
+            (flower_id, flowers[flower_id], quantity)
+            for flower_id, quantity in sorted(cart.quantities.items())
+            if flower_id in flowers
+        ]
+    return [(item.id, item.flower, item.quantity) for item in cart.items.select_related('flower').order_by('id')]
+
+
+def item_flower_id(cart, item_id):
+    """Букет позиции корзины; None, если такой позиции в этой корзине нет"""
+    if isinstance(cart, SessionCart):
+        return item_id if item_id in cart.quantities else None
+    return cart.items.filter(id=item_id).values_list('flower_id', flat=True).first()
+
+
+async def acart_lines(cart):
+    if isinstance(cart, SessionCart):
+        flowers = await Flower.objects.ain_bulk(cart.quantities)
+        return [
+            (flower_id, flowers[flower_id], quantity)
+            for flower_id, quantity in sorted(cart.quantities.items())
+            if flower_id in flowers
+        ]
+    return [(item.id, item.flower, item.quantity)
+            async for item in cart.items.select_related('flower').order_by('id')]
+
+
+def cart_summary(cart):
+    """Состав корзины и итоги одним запросом"""
+    return _summarize(cart, cart_lines(cart))
+
+
+async def acart_summary(cart):
+    return _summarize(cart, await acart_lines(cart))
+
+
+def _summarize(cart, lines):
+    items = []
+    total_items = 0
+    total_price = Decimal('0')
+    for item_id, flower, quantity in lines:
+        item_total = flower.price * quantity
+        total_items += quantity
+        total_price += item_total
+        items.append({
+            'id': item_id,
+            'flower_id': flower.id,
+            'name': flower.name,
+            'quantity': quantity,
+            'price': str(flower.price),
+            'total_price': str(item_total),
+        })
+    return {
+        'version': cart.version,
+        'total_items': total_items,
+        'total_price': str(total_price),
+        'items': items,
+    }
+
+
+def _merge_ops(quantities, ops, flowers):
+    """Новые количества по букетам после применения операций; проверка каталога и остатков"""
+    quantities = dict(quantities)
+    for op, flower_id, quantity in ops:
+        if flower_id not in flowers:
+            raise CartError("Такого букета нет в каталоге.")
+        if quantity < 0:
+            raise CartError("Количество не может быть отрицательным.")
+        if op == ADD:
+            quantities[flower_id] = quantities.get(flower_id, 0) + quantity
+        else:
+            quantities[flower_id] = quantity
+
+    for flower_id, quantity in quantities.items():
+        flower = flowers.get(flower_id)
+        if flower is not None and flower.stock is not None and quantity > flower.stock:
+            raise CartError(f"Букета «{flower.name}» в наличии только {flower.stock} шт.")
+    return quantities
+
+
+def _apply_session_ops(cart, ops, version):
+    if version is not None and version != cart.version:
+        raise CartConflict("Корзина была изменена в другом окне. Обновите страницу.")
+
+    flowers = Flower.objects.in_bulk({flower_id for _, flower_id, _ in ops})
+    quantities = _merge_ops(cart.quantities, ops, flowers)
+    cart.quantities = {flower_id: quantity for flower_id, quantity in quantities.items() if quantity > 0}
+    cart.version += 1
+    cart.save()
+    return cart_summary(cart)
+
+
+def apply_cart_ops(cart, ops, version=None):
+    """Применение списка операций ``(op, flower_id, quantity)`` к корзине.
+
+    ``ADD`` прибавляет количество, ``SET`` задает его (0 — удалить позицию).
+    Если передана ``version``, изменение выполняется только при совпадении
+    с текущей версией корзины. Все операции применяются атомарно.
+    """
+    if isinstance(cart, SessionCart):
+        return _apply_session_ops(cart, ops, version)
+
+    flower_ids = {flower_id for _, flower_id, _ in ops}
+
+    with transaction.atomic():
+        bump = Cart.objects.filter(id=cart.id)
+        if version is not None:
+            bump = bump.filter(version=version)
+        if not bump.update(version=F('version') + 1):
+            raise CartConflict("Корзина была изменена в другом окне. Обновите страницу.")
+
+        flowers = Flower.objects.in_bulk(flower_ids)
+        items = {item.flower_id: item for item in cart.items.filter(flower_id__in=flower_ids)}
+        quantities = _merge_ops({flower_id: item.quantity for flower_id, item in items.items()}, ops, flowers)
+
+        to_upsert, to_delete = [], []
+        for flower_id, quantity in quantities.items():
+            item = items.get(flower_id)
+            if quantity == 0:
+                if item:
+                    to_delete.append(item.id)
+            elif item is None or item.quantity != quantity:
+                to_upsert.append(CartItem(cart=cart, flower=flowers[flower_id], quantity=quantity))
+
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+        if to_upsert:
+            # Одна команда INSERT ... ON CONFLICT (cart, flower) DO UPDATE на все позиции
+            CartItem.objects.bulk_create(to_upsert, update_conflicts=True,
+                                         unique_fields=['cart', 'flower'], update_fields=['quantity'])
+
+    cart.refresh_from_db(fields=['version'])
+    logger.debug("Cart %s updated to version %s: %s operation(s)", cart.id, cart.version, len(ops))
+    return cart_summary(cart)
+
+
+def promote_session_cart(request):
+    """Перенос корзины гостя из сессии в таблицу ``Cart`` перед оформлением заказа.
+
+    Повторное оформление той же корзины возвращает ранее созданную строку,
+    чтобы по ней нельзя было создать второй заказ. Пустая корзина — None.
+    """
+    cart_id = request.session.get(SESSION_CART_ID_KEY)
+    cart = Cart.objects.filter(id=cart_id, user=None).first() if cart_id else None
+    if cart is not None and hasattr(cart, 'order'):
+        return cart
+
+    session_cart = SessionCart(request.session)
+    if not session_cart.quantities:
+        return None
+
+    flowers = Flower.objects.in_bulk(session_cart.quantities)
+    with transaction.atomic():
+        if cart is None:
+            cart = Cart.objects.create(user=None, version=session_cart.version)
+        else:
+            cart.items.all().delete()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, flower=flowers[flower_id], quantity=quantity)
+            for flower_id, quantity in session_cart.quantities.items()
+            if flower_id in flowers
+        ])
+
+    request.session[SESSION_CART_ID_KEY] = cart.id
+    return cart
+
+
+def merge_session_cart(request, user):
+    """Добавление корзины гостя к корзине пользователя при входе на сайт"""
+    session_cart = SessionCart(request.session)
+    if not session_cart.quantities:
+        return
+
+    cart = user_cart(user)
+    ops = [(ADD, flower_id, quantity) for flower_id, quantity in session_cart.quantities.items()]
+    try:
+        apply_cart_ops(cart, ops)
+    except CartError:
+        # Переносим то, что позволяют остатки, по одной позиции
+        for op in ops:
+            try:
+                apply_cart_ops(cart, [op])
+            except CartError as e:
+                logger.warning("Could not merge flower %s into cart %s: %s", op[1], cart.id, e)
+
+    session_cart.clear()
+    logger.info("Merged guest cart into cart %s of user %s", cart.id, user.id)
@@ -0,0 +1,337 @@
+"""Массовый импорт каталога букетов из CSV, JSON или JSON Lines.
+
+Строки читаются потоком и обрабатываются пачками по ``chunk_size``:
+каждая строка проверяется, букеты сопоставляются по артикулу (``sku``)
+одним запросом на пачку. Изображения скачиваются до записи в базу, а
+букеты записываются в конце одной короткой транзакцией (``bulk_create``
+для новых, ``bulk_update`` для измененных), чтобы не держать блокировку
+SQLite на время загрузок. Если хоть одна строка с ошибкой, ничего не
+сохраняется, а уже скачанные изображения удаляются.
+
+Изображения (URL или путь к файлу внутри ``settings.CATALOG_IMPORT_DIR``)
+загружаются в пуле потоков вместе с уменьшенными копиями ``RENDITIONS``.
+Имя файла зависит от источника, поэтому повторный импорт того же каталога
+ничего не скачивает заново.
+
+Сигналы при массовой записи не срабатывают, поэтому после импорта кэш
+страниц и снимок каталога в боте сбрасываются одним увеличением версии.
+
+В режиме ``dry_run`` ничего не пишется и не скачивается — возвращается
+только отчет о различиях.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from io import BytesIO
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+from PIL import Image
+
+from .bot_catalog import bump_catalog_snapshot
+from .caching import bump_catalog_version
+from .models import Flower
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('name', 'price', 'description')
+FORMATS = ('csv', 'json', 'jsonl')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Уменьшенные копии изображения: название -> максимальный размер (ширина, высота)
+RENDITIONS = {
+    'thumb': (300, 300),
+    'large': (1200, 1200),
+}
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_IMAGE_WORKERS = 4
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_TIMEOUT_SECONDS = 20
+
+
+class CatalogImportError(Exception):
+    """Файл каталога нельзя прочитать"""
+
+
+class RowError(ValueError):
+    """Ошибка в строке каталога"""
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension not in FORMATS:
+        raise CatalogImportError(f"Неизвестный формат файла: {filename}. Поддерживаются CSV, JSON и JSONL.")
+    return extension
+
+
+def read_catalog(fileobj, fmt):
+    """Строки каталога: пары (номер строки, данные). Текстовый поток читается построчно"""
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(fileobj), start=2):
+            yield line, row
+    elif fmt == 'jsonl':
+        for line, text in enumerate(fileobj, start=1):
+            if text.strip():
+                yield line, text
+    elif fmt == 'json':
+        try:
+            data = json.load(fileobj)
+        except ValueError as e:
+            raise CatalogImportError(f"Некорректный JSON: {e}")
+        if not isinstance(data, list):
+            raise CatalogImportError("JSON-каталог должен быть списком букетов.")
+        yield from enumerate(data, start=1)
+    else:
+        raise CatalogImportError(f"Неизвестный формат: {fmt}")
+
+
+def clean_row(raw):
+    """Проверенные поля строки каталога; ошибка — ``RowError``"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raise RowError("некорректный JSON")
+    if not isinstance(raw, dict):
+        raise RowError("строка должна быть объектом с полями букета")
+
+    sku = str(raw.get('sku') or '').strip()
+    if not sku:
+        raise RowError("не указан артикул (sku)")
+    if len(sku) > 64:
+        raise RowError("артикул длиннее 64 символов")
+
+    name = str(raw.get('name') or '').strip()
+    if not name:
+        raise RowError("не указано название")
+    if len(name) > 100:
+        raise RowError("название длиннее 100 символов")
+
+    try:
+        price = Decimal(str(raw.get('price', '')).strip().replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"некорректная цена: {raw.get('price')!r}")
+    if price <= 0 or price >= Decimal('1e8'):
+        raise RowError(f"цена вне допустимого диапазона: {price}")
+
+    image = str(raw.get('image') or '').strip()
+    if image and os.path.splitext(image.split('?')[0])[1].lower() not in IMAGE_EXTENSIONS:
+        raise RowError(f"неподдерживаемый формат изображения: {image}")
+
+    return {
+        'sku': sku,
+        'name': name,
+        'price': price,
+        'description': str(raw.get('description') or '').strip(),
+        'image': image,
+    }
+
+
+def image_name(sku, source):
+    """Имя файла изображения в хранилище: зависит от артикула и источника"""
+    extension = os.path.splitext(source.split('?')[0])[1].lower()
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return f"flowers/{slugify(sku) or 'flower'}-{digest}{extension}"
+
+
+def rendition_name(name, rendition):
+    """Имя уменьшенной копии изображения"""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f"flowers/renditions/{stem}_{rendition}.jpg"
+
+
+def local_image_path(source):
+    """Путь к локальному изображению внутри ``CATALOG_IMPORT_DIR``; вне этого каталога файлы не читаются"""
+    base = getattr(settings, 'CATALOG_IMPORT_DIR', None)
+    if not base:
+        raise RowError("локальные изображения не разрешены: не задан CATALOG_IMPORT_DIR")
+    base = os.path.realpath(base)
+    path = os.path.realpath(os.path.join(base, source))
+    if os.path.commonpath([base, path]) != base:
+        raise RowError(f"файл вне каталога импорта {base}")
+    return path
+
+
+def _fetch_image(source):
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=IMAGE_TIMEOUT_SECONDS) as response:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+    else:
+        with open(local_image_path(source), 'rb') as f:
+            data = f.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise RowError("изображение больше 10 МБ")
+    return data
+
+
+def store_image(source, name):
+    """Загрузка изображения и его уменьшенных копий в хранилище"""
+    data = _fetch_image(source)
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        for rendition, size in RENDITIONS.items():
+            copy = image.convert('RGB')
+            copy.thumbnail(size)
+            buffer = BytesIO()
+            copy.save(buffer, format='JPEG', quality=85)
+            default_storage.delete(rendition_name(name, rendition))
+            default_storage.save(rendition_name(name, rendition), ContentFile(buffer.getvalue()))
+    default_storage.delete(name)
+    default_storage.save(name, ContentFile(data))
+    return name
+
+
+def _store_image_safely(task):
+    line, source, name = task
+    try:
+        store_image(source, name)
+        return None
+    except Exception as e:
+        return line, f"изображение {source}: {e}"
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_catalog(rows, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE, image_workers=DEFAULT_IMAGE_WORKERS):
+    """Импорт строк каталога (из ``read_catalog``); возвращает отчет о различиях.
+
+    Отчет: ``created`` — новые артикулы, ``updated`` — пары (артикул,
+    {поле: (было, стало)}), ``unchanged`` — число строк без изменений,
+    ``images`` — сколько изображений загружено (или будет загружено),
+    ``errors`` — пары (номер строки, ошибка), ``saved`` — записан ли импорт.
+    """
+    report = {'created': [], 'updated': [], 'unchanged': 0, 'images': 0, 'errors': [], 'saved': False,
+              'dry_run': dry_run}
+    seen = set()
+    pending = []  # Пачки (новые, измененные) букетов для записи
+    stored = []  # Изображения, сохраненные этим импортом
+    with ThreadPoolExecutor(max_workers=image_workers) as pool:
+        for chunk in _chunks(rows, chunk_size):
+            cleaned = []
+            for line, raw in chunk:
+                try:
+                    row = clean_row(raw)
+                except RowError as e:
+                    report['errors'].append((line, str(e)))
+                    continue
+                if row['sku'] in seen:
+                    report['errors'].append((line, f"артикул {row['sku']} повторяется в файле"))
+                    continue
+                seen.add(row['sku'])
+                cleaned.append((line, row))
+            pending.append(_prepare_chunk(cleaned, report, dry_run, pool, stored))
+
+    if not dry_run and not report['errors']:
+        try:
+            _write_chunks(pending, chunk_size)
+        except IntegrityError as e:
+            # Те же артикулы успел записать параллельный импорт
+            report['errors'].append((None, f"каталог изменился во время импорта: {e}"))
+        else:
+            report['saved'] = True
+            if report['created'] or report['updated']:
+                bump_catalog_version()
+                bump_catalog_snapshot()
+    if not report['saved']:
+        _discard_images(stored)
+
+    logger.info("Catalog import%s: %s created, %s updated, %s unchanged, %s error(s)",
+                ' (dry run)' if dry_run else '', len(report['created']), len(report['updated']),
+                report['unchanged'], len(report['errors']))
+    return report
+
+
+def _prepare_chunk(cleaned, report, dry_run, pool, stored):
+    """Сравнение пачки с базой и загрузка изображений; в базу ничего не пишется"""
+    existing = Flower.objects.in_bulk([row['sku'] for _, row in cleaned], field_name='sku')
+    to_create, to_update, images = [], [], []
+
+    for line, row in cleaned:
+        flower = existing.get(row['sku'])
+        new_image = image_name(row['sku'], row['image']) if row['image'] else None
+
+        if flower is None:
+            flower = Flower(sku=row['sku'], name=row['name'], price=row['price'], description=row['description'],
+                            image=new_image or '')
+            to_create.append(flower)
+            report['created'].append(row['sku'])
+        else:
+            changes = {
+                field: (getattr(flower, field), row[field])
+                for field in FIELDS
+                if getattr(flower, field) != row[field]
+            }
+            if new_image and flower.image.name != new_image:
+                changes['image'] = (flower.image.name, new_image)
+            if not changes:
+                report['unchanged'] += 1
+                continue
+            for field, (old, new) in changes.items():
+                setattr(flower, field, new)
+            to_update.append(flower)
+            report['updated'].append((row['sku'], changes))
+
+        if new_image and (dry_run or not default_storage.exists(new_image)):
+            images.append((line, row['image'], new_image))
+
+    report['images'] += len(images)
+    # После первой ошибки импорт все равно отменится — больше ничего не скачиваем
+    if dry_run or report['errors']:
+        return to_create, to_update
+
+    stored.extend(name for _, _, name in images)
+    for error in pool.map(_store_image_safely, images):
+        if error:
+            report['errors'].append(error)
+    return to_create, to_update
+
+
+def _write_chunks(pending, batch_size):
+    """Запись подготовленных пачек одной короткой транзакцией"""
+    with transaction.atomic():
+        for to_create, to_update in pending:
+            if to_create:
+                Flower.objects.bulk_create(to_create, batch_size=batch_size)
+            if to_update:
+                Flower.objects.bulk_update(to_update, FIELDS + ('image',), batch_size=batch_size)
+
+
+def _discard_images(names):
+    """Удаление изображений и копий отмененного импорта"""
+    for name in names:
+        for rendition in RENDITIONS:
+            default_storage.delete(rendition_name(name, rendition))
+        default_storage.delete(name)
+
+
+def format_report(report, limit=50):
+    """Текстовый отчет об импорте"""
+    mode = "Пробный импорт (ничего не сохранено)" if report['dry_run'] else (
+        "Импорт сохранен" if report['saved'] else "Импорт отменен из-за ошибок, ничего не сохранено")
+    lines = [
+        mode,
+        f"Новых: {len(report['created'])}, изменено: {len(report['updated'])}, "
+        f"без изменений: {report['unchanged']}, изображений: {report['images']}, ошибок: {len(report['errors'])}",
+    ]
+    for sku in report['created'][:limit]:
+        lines.append(f"+ {sku}")
+    for sku, changes in report['updated'][:limit]:
+        lines.append(f"~ {sku}: " + ", ".join(f"{field}: {old} -> {new}" for field, (old, new) in changes.items()))
+    for line, error in report['errors'][:limit]:
+        lines.append(f"! строка {line}: {error}" if line is not None else f"! {error}")
+    return "\n".join(lines)
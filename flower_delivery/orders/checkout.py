@@ -0,0 +1,50 @@
+"""Оформление заказа по корзине: общее для сайта и бота.
+
+Заказ создается и букеты резервируются в одной транзакции; если чего-то
+не хватает, поднимается ``OutOfStock`` и ничего не сохраняется. Затем
+позиции записываются в историю заказов, а уведомление магазина уходит
+в Telegram после фиксации транзакции.
+"""
+import logging
+
+from django.db import transaction
+
+from .models import Order, OrderHistory, StockReservation
+from .notifications import notify_new_order
+from .stock import reserve_cart
+
+logger = logging.getLogger(__name__)
+
+
+def place_order(cart, user=None, guest_token='', **fields):
+    """Заказ по непустой корзине; ``fields`` — дата, время и адрес доставки, контакты гостя, способ оплаты"""
+    flower = cart.items.first().flower  # Предполагается, что корзина не пуста
+
+    with transaction.atomic():
+        order = Order.objects.create(user=user, cart=cart, flower=flower, total_price=cart.total_price(), **fields)
+        # Без онлайн-оплаты резерв сразу становится списанием: истекать ему нечему
+        reserve_cart(order, cart, status=StockReservation.COMMITTED
+                     if order.payment_method == Order.ON_DELIVERY else StockReservation.ACTIVE)
+
+    logger.info("Order %s created for cart %s", order.id, cart.id, extra={'order_id': order.id})
+
+    # Гостевые заказы привязываются к токену: из сессии на сайте, из ID пользователя в боте
+    OrderHistory.objects.bulk_create([
+        OrderHistory(
+            user=order.user,
+            guest_token='' if order.user else guest_token,
+            order=order,
+            flower=item.flower,
+            quantity=item.quantity,
+            delivery_date=order.delivery_date,
+            delivery_time=order.delivery_time,
+            delivery_address=order.address,
+            comment=order.comment,
+            cost=item.total_price()
+        )
+        for item in cart.items.select_related('flower')
+    ])
+
+    # Уведомление магазина в Telegram уходит в фоне, оформление его не ждет
+    notify_new_order(order)
+    return order
@@ -0,0 +1,205 @@
+"""Утренняя сводка для руководства: вчерашний день и прошлая неделя.
+
+Команда ``manage.py send_digest`` запускается по расписанию (cron) каждое
+утро. Показатели обоих периодов считаются одним агрегирующим запросом по
+диапазону ``created_at`` (по индексу), текст собирается один раз и
+рассылается во все каналы: чаты Telegram из ``DIGEST_TELEGRAM_CHAT_IDS`` и
+почту ``DIGEST_EMAIL_RECIPIENTS`` (console- или file-backend в разработке).
+
+Каждая отправка сначала записывает ``DigestDelivery``; уникальность
+(период, начало, канал) гарантирует, что сводка за период уйдет в канал
+не больше одного раза, даже при повторном или параллельном запуске. Если
+отправка не удалась, запись удаляется и следующий запуск повторит ее.
+Запись без ``sent_at`` после падения процесса не повторяется
+автоматически — о ней пишется предупреждение в лог.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DigestDelivery, Order, Report
+from .notifications import asend_shop_message
+from .replica import replica_reads
+from .status import CANCELED, STATUS_LABELS
+
+logger = logging.getLogger(__name__)
+
+DAY = DigestDelivery.DAY
+WEEK = DigestDelivery.WEEK
+DAILY_EXPENSES = Decimal('1000')  # Примерные расходы на доставку за день, как в Report.calculate_report
+PERIOD_TITLES = {DAY: "Вчера", WEEK: "Прошлая неделя"}
+# Запись без отметки об отправке старше этого считается зависшей
+STALE_CLAIM_MINUTES = 30
+
+
+def digest_periods(today):
+    """Периоды сводки: вчерашний день и последняя полная неделя (пн–вс)"""
+    yesterday = today - timedelta(days=1)
+    week_end = today - timedelta(days=today.weekday() + 1)
+    return {
+        DAY: (yesterday, yesterday),
+        WEEK: (week_end - timedelta(days=6), week_end),
+    }
+
+
+def digest_channels():
+    channels = [f"telegram:{chat_id}" for chat_id in getattr(settings, 'DIGEST_TELEGRAM_CHAT_IDS', [])]
+    if getattr(settings, 'DIGEST_EMAIL_RECIPIENTS', []):
+        channels.append('email')
+    return channels
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+@replica_reads
+def collect_totals(periods):
+    """Показатели всех периодов одним запросом: группировка по дню и статусу"""
+    start = min(first for first, _ in periods.values())
+    end = max(last for _, last in periods.values())
+    rows = (
+        Order.objects.filter(created_at__gte=_midnight(start), created_at__lt=_midnight(end + timedelta(days=1)))
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'status')
+        .annotate(orders=Count('id'), sales=Sum('total_price'))
+        .order_by()
+    )
+
+    totals = {period: {'orders': 0, 'sales': Decimal('0'), 'by_status': Counter()} for period in periods}
+    for row in rows:
+        for period, (first, last) in periods.items():
+            if first <= row['day'] <= last:
+                period_totals = totals[period]
+                period_totals['by_status'][row['status']] += row['orders']
+                period_totals['orders'] += row['orders']
+                if row['status'] != CANCELED:
+                    period_totals['sales'] += row['sales'] or 0
+
+    for period, (first, last) in periods.items():
+        period_totals = totals[period]
+        period_totals['expenses'] = DAILY_EXPENSES * ((last - first).days + 1)
+        period_totals['profit'] = period_totals['sales'] - period_totals['expenses']
+    return totals
+
+
+def render_section(period, first, last, period_totals):
+    dates = f"{first:%d.%m.%Y}" if first == last else f"{first:%d.%m.%Y} – {last:%d.%m.%Y}"
+    lines = [
+        f"{PERIOD_TITLES[period]} ({dates}):",
+        f"Заказов: {period_totals['orders']}",
+        f"Продажи: {period_totals['sales']} ₽",
+        f"Расходы: {period_totals['expenses']} ₽",
+        f"Прибыль: {period_totals['profit']} ₽",
+    ]
+    for status, count in sorted(period_totals['by_status'].items()):
+        lines.append(f"  {STATUS_LABELS.get(status, status)}: {count}")
+    return "\n".join(lines)
+
+
+def _save_report(first, last, period_totals):
+    # Отчет за период обновляется на месте, а не добавляется при каждом запуске
+    report = (Report.objects.filter(start_date=first, end_date=last).order_by('-created_at').first()
+              or Report(start_date=first, end_date=last))
+    report.total_orders = period_totals['orders']
+    report.total_sales = report.total_revenue = period_totals['sales']
+    report.total_expenses = period_totals['expenses']
+    report.profit = period_totals['profit']
+    report.save()
+
+
+def _claim(period, first, channel):
+    try:
+        with transaction.atomic():
+            return DigestDelivery.objects.create(period=period, period_start=first, channel=channel)
+    except IntegrityError:
+        return None
+
+
+def _send(channel, subject, text):
+    if channel == 'email':
+        return send_mail(subject, text, settings.DEFAULT_FROM_EMAIL, settings.DIGEST_EMAIL_RECIPIENTS) > 0
+    chat_id = channel.split(':', 1)[1]
+    return asyncio.run(asend_shop_message(text, chat_id=chat_id))
+
+
+def _warn_stale(periods, now):
+    stale = DigestDelivery.objects.filter(
+        sent_at=None, claimed_at__lt=now - timedelta(minutes=STALE_CLAIM_MINUTES),
+        period_start__in=[first for first, _ in periods.values()],
+    )
+    for delivery in stale:
+        logger.warning("Digest %s %s to %s was claimed at %s but never confirmed; check the channel manually",
+                       delivery.period, delivery.period_start, delivery.channel, delivery.claimed_at)
+
+
+def send_digests(today=None, dry_run=False):
+    """Рассылка сводок, еще не отправленных за текущие периоды.
+
+    Возвращает {'sent': число отправок, 'failed': число ошибок, 'text': текст
+    сводки или None, если отправлять нечего}. ``dry_run`` только собирает текст.
+    """
+    now = timezone.now()
+    today = today or timezone.localdate(now)
+    periods = digest_periods(today)
+    channels = digest_channels()
+    result = {'sent': 0, 'failed': 0, 'text': None}
+
+    done = set(
+        DigestDelivery.objects.filter(channel__in=channels, period__in=periods,
+                                      period_start__in=[first for first, _ in periods.values()])
+        .values_list('period', 'period_start', 'channel')
+    )
+    pending = {
+        period: [channel for channel in channels if (period, first, channel) not in done]
+        for period, (first, _) in periods.items()
+    }
+    pending = {period: period_channels for period, period_channels in pending.items()
+               if period_channels or dry_run}
+    if not pending:
+        logger.info("Digest for %s has already been sent to all channels", today)
+        return result
+
+    totals = collect_totals({period: periods[period] for period in pending})
+    sections = {period: render_section(period, *periods[period], totals[period]) for period in pending}
+    result['text'] = "\n\n".join(sections.values())
+    if dry_run:
+        return result
+
+    for period in pending:
+        _save_report(*periods[period], totals[period])
+    _warn_stale(periods, now)
+
+    subject = f"Сводка по заказам на {today:%d.%m.%Y}"
+    for channel in channels:
+        claims = [claim for claim in (_claim(period, periods[period][0], channel)
+                                      for period in pending if channel in pending[period]) if claim]
+        if not claims:
+            continue
+        text = "\n\n".join(sections[claim.period] for claim in claims)
+        try:
+            delivered = _send(channel, subject, text)
+        except Exception as e:
+            logger.error("Digest to %s failed: %s", channel, e)
+            delivered = False
+
+        ids = [claim.id for claim in claims]
+        if delivered:
+            DigestDelivery.objects.filter(id__in=ids).update(sent_at=timezone.now())
+            result['sent'] += 1
+        else:
+            # Сообщение не ушло — снимаем блокировку, следующий запуск повторит отправку
+            DigestDelivery.objects.filter(id__in=ids).delete()
+            result['failed'] += 1
+
+    logger.info("Digest for %s: %s sent, %s failed", today, result['sent'], result['failed'])
+    return result
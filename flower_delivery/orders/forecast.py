@@ -0,0 +1,234 @@
+"""Прогноз спроса на букеты по датам доставки для закупки цветов.
+
+Модель мультипликативная: ``уровень букета × день недели × месяц × праздник``.
+
+* Дневной спрос собирается одним GROUP BY по ``OrderHistory`` и архиву,
+  дальше все считается по разреженным словарям за один проход по дням.
+* Коэффициенты дня недели и месяца общие для каталога (по отдельному букету
+  данных мало) и притягиваются к 1, пока наблюдений немного.
+* Уровень букета — средний спрос за последние недели без сезонности.
+* Для праздников (14 февраля, 8 марта) и нескольких дней перед ними
+  коэффициент считается по прошлым годам относительно обычного спроса
+  перед праздником: сначала по всему каталогу, затем по каждому букету
+  со сдвигом к общему значению.
+"""
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Flower, OrderHistory, OrderHistoryArchive
+from .replica import replica_reads
+
+logger = logging.getLogger(__name__)
+
+# Праздники с пиковым спросом: (месяц, день) -> название
+HOLIDAYS = {
+    (2, 14): "14 февраля",
+    (3, 8): "8 марта",
+}
+# Сколько дней перед праздником спрос тоже повышен
+HOLIDAY_LEAD_DAYS = 2
+# За сколько последних дней считается уровень спроса букета
+LEVEL_DAYS = 56
+# База для праздничного коэффициента: столько обычных дней перед праздником
+HOLIDAY_BASELINE_DAYS = 28
+# Вес априорного значения: сколько «наблюдений» тянут коэффициент к общему
+SEASON_PRIOR_DAYS = 14
+HOLIDAY_PRIOR_STEMS = 5.0
+
+
+def holiday_offset(day):
+    """(месяц, день) праздника и сколько дней до него осталось; None для обычного дня"""
+    for offset in range(HOLIDAY_LEAD_DAYS + 1):
+        target = day + timedelta(days=offset)
+        if (target.month, target.day) in HOLIDAYS:
+            return (target.month, target.day), offset
+    return None
+
+
+@replica_reads
+def load_daily_demand(until):
+    """Спрос по букетам и датам доставки до ``until`` (не включая): {flower_id: {дата: штук}}"""
+    demand = defaultdict(Counter)
+    history = (
+        OrderHistory.objects.filter(delivery_date__lt=until)
+        .values_list('flower_id', 'delivery_date')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+    archive = (
+        OrderHistoryArchive.objects.filter(delivery_date__lt=until)
+        .values_list('flower_id', 'delivery_date')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+    for queryset in (history, archive):
+        for flower_id, delivery_date, total in queryset:
+            demand[flower_id][delivery_date] += total
+    return demand
+
+
+def _shrink(total, count, mean, prior=SEASON_PRIOR_DAYS):
+    """Коэффициент ``среднее группы / общее среднее`` с притяжением к 1 при малом числе дней"""
+    if not mean:
+        return 1.0
+    return (total + prior * mean) / ((count + prior) * mean)
+
+
+class DemandModel:
+    """Обученная модель спроса; ``predict`` возвращает ожидаемое число штук"""
+
+    def __init__(self):
+        self.weekday = [1.0] * 7
+        self.month = [1.0] * 13
+        self.levels = {}
+        self.holiday = {}
+        self.flower_holiday = {}
+
+    def seasonal(self, day):
+        return self.weekday[day.weekday()] * self.month[day.month]
+
+    def holiday_factor(self, flower_id, day):
+        holiday = holiday_offset(day)
+        if holiday is None:
+            return 1.0
+        return self.flower_holiday.get((flower_id, holiday), self.holiday.get(holiday, 1.0))
+
+    def predict(self, flower_id, day):
+        return self.levels.get(flower_id, 0.0) * self.seasonal(day) * self.holiday_factor(flower_id, day)
+
+    def fit(self, demand, as_of):
+        """Обучение на дневном спросе до ``as_of``"""
+        first = min((day for series in demand.values() for day in series), default=as_of)
+        days = [first + timedelta(days=i) for i in range((as_of - first).days)]
+        if not days:
+            return self
+
+        totals = Counter()
+        for series in demand.values():
+            totals.update(series)
+        regular = [day for day in days if holiday_offset(day) is None]
+        mean = sum(totals[day] for day in regular) / len(regular) if regular else 0.0
+
+        by_weekday = defaultdict(lambda: [0, 0])
+        for day in regular:
+            by_weekday[day.weekday()][0] += totals[day]
+            by_weekday[day.weekday()][1] += 1
+        for weekday, (total, count) in by_weekday.items():
+            self.weekday[weekday] = _shrink(total, count, mean)
+
+        by_month = defaultdict(lambda: [0.0, 0])
+        for day in regular:
+            by_month[day.month][0] += totals[day] / self.weekday[day.weekday()]
+            by_month[day.month][1] += 1
+        for month, (total, count) in by_month.items():
+            self.month[month] = _shrink(total, count, mean)
+
+        self._fit_levels(demand, as_of, first)
+        self._fit_holidays(demand, totals, days)
+        logger.info("Demand model trained on %s days and %s flowers", len(days), len(demand))
+        return self
+
+    def _baseline(self, series, start, end):
+        """Средний спрос без сезонности по обычным дням ``[start, end)``"""
+        total, count = 0.0, 0
+        day = start
+        while day < end:
+            if holiday_offset(day) is None:
+                total += series.get(day, 0) / self.seasonal(day)
+                count += 1
+            day += timedelta(days=1)
+        return total / count if count else 0.0
+
+    def _fit_levels(self, demand, as_of, first):
+        window_start = max(first, as_of - timedelta(days=LEVEL_DAYS))
+        for flower_id, series in demand.items():
+            self.levels[flower_id] = self._baseline(series, max(window_start, min(series)), as_of)
+
+    def _fit_holidays(self, demand, totals, days):
+        occurrences = defaultdict(list)
+        for day in days:
+            holiday = holiday_offset(day)
+            if holiday is not None:
+                occurrences[holiday].append(day)
+
+        first_sale = {flower_id: min(series) for flower_id, series in demand.items()}
+        for holiday, holiday_days in occurrences.items():
+            pooled_actual = pooled_expected = 0.0
+            per_flower = defaultdict(lambda: [0.0, 0.0])
+            for day in holiday_days:
+                baseline_end = day - timedelta(days=HOLIDAY_LEAD_DAYS - holiday[1])
+                baseline_start = baseline_end - timedelta(days=HOLIDAY_BASELINE_DAYS)
+                if baseline_start < days[0]:
+                    continue
+                pooled_actual += totals[day]
+                pooled_expected += self._baseline(totals, baseline_start, baseline_end) * self.seasonal(day)
+                for flower_id, series in demand.items():
+                    if first_sale[flower_id] > baseline_start:
+                        continue
+                    expected = self._baseline(series, baseline_start, baseline_end) * self.seasonal(day)
+                    per_flower[flower_id][0] += series.get(day, 0)
+                    per_flower[flower_id][1] += expected
+
+            if not pooled_expected:
+                continue
+            pooled = pooled_actual / pooled_expected
+            self.holiday[holiday] = pooled
+            for flower_id, (actual, expected) in per_flower.items():
+                self.flower_holiday[flower_id, holiday] = (
+                    (actual + HOLIDAY_PRIOR_STEMS * pooled) / (expected + HOLIDAY_PRIOR_STEMS)
+                )
+
+
+def train_demand_model(as_of=None):
+    as_of = as_of or timezone.localdate()
+    return DemandModel().fit(load_daily_demand(as_of), as_of)
+
+
+def forecast_demand(start=None, days=14, as_of=None):
+    """Прогноз спроса по букетам на ``days`` дней начиная со ``start``.
+
+    Возвращает даты, праздники среди них и строки по букетам
+    (``flower``, ``daily`` — штук по дням, ``total``), самые востребованные первыми.
+    """
+    as_of = as_of or timezone.localdate()
+    start = start or as_of
+    model = train_demand_model(as_of)
+    dates = [start + timedelta(days=i) for i in range(days)]
+
+    rows = []
+    for flower in Flower.objects.filter(id__in=model.levels).order_by('name'):
+        expected = [model.predict(flower.id, day) for day in dates]
+        total = math.ceil(sum(expected))
+        if total:
+            rows.append({
+                'flower': flower,
+                'daily': [round(value) for value in expected],
+                'total': total,
+            })
+    rows.sort(key=lambda row: row['total'], reverse=True)
+
+    holidays = {}
+    for day in dates:
+        holiday = holiday_offset(day)
+        if holiday is not None and holiday[1] == 0:
+            holidays[day] = HOLIDAYS[holiday[0]]
+    return {'start': start, 'dates': dates, 'holidays': holidays, 'rows': rows}
+
+
+def format_forecast(forecast, limit=10):
+    """Текст прогноза для Telegram"""
+    end = forecast['dates'][-1] if forecast['dates'] else forecast['start']
+    lines = [f"Прогноз спроса с {forecast['start']:%d.%m} по {end:%d.%m}:"]
+    for day, name in forecast['holidays'].items():
+        lines.append(f"Пик: {name} ({day:%d.%m})")
+    for row in forecast['rows'][:limit]:
+        peak = max(row['daily'])
+        lines.append(f"{row['flower'].name}: {row['total']} шт., до {peak} шт. в день")
+    if not forecast['rows']:
+        lines.append("Недостаточно истории заказов для прогноза.")
+    return "\n".join(lines)
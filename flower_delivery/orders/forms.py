@@ -37,3 +37,7 @@ class ReportForm(forms.ModelForm):
             'start_date': 'Дата начала периода',
             'end_date': 'Дата окончания периода',
         }
+
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(label='Файл каталога (CSV, JSON или JSONL)')
+    dry_run = forms.BooleanField(label='Только показать различия', required=False, initial=True)
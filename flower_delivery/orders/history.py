@@ -0,0 +1,104 @@
+"""История заказов: постраничный вывод по ключу и архивация старых записей.
+
+Страницы строятся по курсору ``(completed_at, id)`` последней показанной
+записи, поэтому стоимость запроса не зависит от номера страницы. Старые
+записи переносятся в компактную таблицу ``OrderHistoryArchive`` без адреса
+и комментария.
+"""
+import logging
+import secrets
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OrderHistory, OrderHistoryArchive
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+# Через сколько дней записи истории уходят в архив
+DEFAULT_RETENTION_DAYS = 365
+
+GUEST_TOKEN_SESSION_KEY = 'guest_token'
+
+
+def get_guest_token(request, create=False):
+    """Токен гостя из сессии; при ``create=True`` выдается новый"""
+    token = request.session.get(GUEST_TOKEN_SESSION_KEY)
+    if not token and create:
+        token = secrets.token_hex(16)
+        request.session[GUEST_TOKEN_SESSION_KEY] = token
+    return token
+
+
+async def aget_guest_token(request):
+    return await request.session.aget(GUEST_TOKEN_SESSION_KEY)
+
+
+def encode_cursor(row):
+    return f"{row.completed_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """Разбор курсора ``<completed_at>_<id>``; некорректный курсор — первая страница"""
+    try:
+        completed_at, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(completed_at), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _page_queryset(queryset, cursor, page_size):
+    queryset = queryset.select_related('flower').order_by('-completed_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        completed_at, row_id = position
+        queryset = queryset.filter(Q(completed_at__lt=completed_at) | Q(completed_at=completed_at, id__lt=row_id))
+    return queryset[:page_size + 1]
+
+
+def history_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Страница истории, начиная после курсора. Возвращает (записи, курсор следующей страницы)"""
+    return _split_page(list(_page_queryset(queryset, cursor, page_size)), page_size)
+
+
+async def ahistory_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    return _split_page([row async for row in _page_queryset(queryset, cursor, page_size)], page_size)
+
+
+def _split_page(rows, page_size):
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def archive_order_history(older_than=None, batch_size=1000):
+    """Перенос записей старше ``older_than`` в архив пачками; возвращает число перенесенных"""
+    if older_than is None:
+        days = getattr(settings, 'ORDER_HISTORY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+        older_than = timezone.now() - timedelta(days=days)
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                OrderHistory.objects.filter(completed_at__lt=older_than)
+                .order_by('id')
+                .values('id', 'user_id', 'guest_token', 'order_id', 'flower_id', 'quantity', 'delivery_date', 'cost',
+                        'completed_at')
+                [:batch_size]
+            )
+            if not batch:
+                break
+            OrderHistoryArchive.objects.bulk_create([
+                OrderHistoryArchive(**{key: value for key, value in row.items() if key != 'id'})
+                for row in batch
+            ])
+            OrderHistory.objects.filter(id__in=[row['id'] for row in batch]).delete()
+        moved += len(batch)
+
+    if moved:
+        logger.info("Archived %s order history row(s) older than %s", moved, older_than)
+    return moved
@@ -0,0 +1,207 @@
+"""Логирование без задержек в потоке запроса.
+
+``BackgroundHandler`` только кладет запись в очередь; форматирование,
+маскирование и запись в поток или файл выполняет ``QueueListener`` в
+фоновом потоке. Если очередь переполнена, запись отбрасывается, а не
+блокирует запрос.
+
+Записи выводятся в JSON (``JsonFormatter``) с ID запроса из
+``RequestIdMiddleware`` и ID заказа, если он передан через
+``extra={'order_id': ...}``. Адреса и телефоны маскируются в тексте,
+строковых полях ``extra`` и тексте исключения.
+
+``SamplingFilter`` пропускает только долю записей уровня ниже WARNING от
+шумных логгеров (``settings.LOG_SAMPLING``), например просмотров страниц.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+DEFAULT_QUEUE_SIZE = 10000
+
+PHONE_RE = re.compile(r'(?<![\w])\+?[78]?[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)')
+ADDRESS_RE = re.compile(
+    r'(?i)(?<![\w])(?:ул\.?|улица|пр-т|просп\.?|проспект|пер\.?|переулок|ш\.|шоссе|б-р|бульвар|наб\.?|'
+    r'набережная|пл\.?|площадь|мкр\.?|микрорайон)\s[^;\n]*'
+)
+# Типы аргументов, которые можно передать в фоновый поток без копирования
+_IMMUTABLE = (str, int, float, bool, type(None), Decimal, date, datetime, time, uuid.UUID)
+# Стандартные атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+def redact(text):
+    """Маскирование телефонов и адресов в тексте записи"""
+    return ADDRESS_RE.sub('[адрес скрыт]', PHONE_RE.sub('[телефон скрыт]', text))
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей ниже WARNING от указанных логгеров.
+
+    ``rates`` — {имя логгера: доля от 0 до 1}; правило логгера действует и
+    на его потомков. Выборка детерминированная: при доле 0.1 проходит
+    первая и затем каждая десятая запись.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = {name: max(0.0, min(1.0, float(rate))) for name, rate in (rates or {}).items()}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition('.')[0]
+        return None, 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name, rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        with self._lock:
+            counter = self._counters.setdefault(name, itertools.count())
+            index = next(counter)
+        return index % round(1 / rate) == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись в одну строку JSON; дополнительные поля из ``extra`` сохраняются (строки — маскированными)"""
+
+    def __init__(self, redact_text=True):
+        super().__init__()
+        self.redact_text = redact_text
+
+    def format(self, record):
+        clean = redact if self.redact_text else str
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': clean(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = clean(value) if isinstance(value, str) else value
+        if record.exc_info:
+            data['exc'] = clean(self.formatException(record.exc_info))
+        elif record.exc_text:
+            data['exc'] = clean(record.exc_text)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Обычный текстовый формат с маскированием адресов и телефонов"""
+
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # При остановке ждем места в очереди, а не теряем метку конца
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Обработчик, который пишет записи из фонового потока.
+
+    В потоке запроса запись только ставится в очередь: аргументы и поля
+    ``extra`` неизменяемых типов передаются как есть, остальные приводятся к строке,
+    чтобы фоновый поток не читал объекты, которые запрос успеет изменить.
+    """
+
+    def __init__(self, filename=None, fmt='json', queue_size=DEFAULT_QUEUE_SIZE, redact_text=True, target=None):
+        super().__init__(queue.Queue(queue_size))
+        if target is None:
+            target = logging.FileHandler(filename, encoding='utf-8') if filename else logging.StreamHandler(sys.stderr)
+        if fmt == 'json':
+            target.setFormatter(JsonFormatter(redact_text=redact_text))
+        else:
+            target.setFormatter(RedactingFormatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+        self.dropped = 0
+        self.listener = _Listener(self.queue, target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple):
+            record.args = tuple(arg if isinstance(arg, _IMMUTABLE) else str(arg) for arg in record.args)
+        elif isinstance(record.args, dict):
+            record.args = {key: value if isinstance(value, _IMMUTABLE) else str(value)
+                           for key, value in record.args.items()}
+        extra = {key: str(value) for key, value in vars(record).items()
+                 if key not in _RECORD_ATTRS and not isinstance(value, _IMMUTABLE)}
+        record.__dict__.update(extra)
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None:
+            # stop() дожидается записи всего, что осталось в очереди
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+class RequestIdMiddleware:
+    """ID запроса для логов: из заголовка X-Request-ID или новый; возвращается в ответе"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex
+        request.request_id = request_id
+        return request_id, request_id_var.set(request_id)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.history import archive_order_history
+
+
+class Command(BaseCommand):
+    help = "Переносит старые записи истории заказов в компактный архив"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Архивировать записи старше указанного числа дней")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки переноса")
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options['days'] is not None:
+            older_than = timezone.now() - timedelta(days=options['days'])
+        moved = archive_order_history(older_than=older_than, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Перенесено в архив записей: {moved}"))
@@ -0,0 +1,119 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from orders.models import Flower
+
+
+def _summary(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+    return {
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p99_ms': p99 * 1000,
+        'errors': errors,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает пропускную способность и p99 задержки страниц витрины "
+            "под WSGI (пул потоков) и ASGI (цикл событий) без внешнего сервера")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Всего запросов на каждый режим")
+        parser.add_argument('--concurrency', type=int, default=200, help="Одновременных запросов")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Путь для запросов (можно несколько); по умолчанию главная и страница букета")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self._default_paths()
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        if settings.DEBUG:
+            self.stdout.write(self.style.WARNING("DEBUG=True: результаты занижены записью SQL-запросов"))
+
+        total, concurrency = options['requests'], options['concurrency']
+        results = {
+            'WSGI': self._run_wsgi(paths, host, total, concurrency),
+            'ASGI': asyncio.run(self._run_asgi(paths, host, total, concurrency)),
+        }
+
+        self.stdout.write(f"{total} запросов, {concurrency} одновременно, пути: {', '.join(paths)}")
+        self.stdout.write(f"{'режим':<6}{'запр/с':>10}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<6}{result['rps']:>10.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['errors']:>8}"
+            )
+
+    def _default_paths(self):
+        flower_id = Flower.objects.values_list('id', flat=True).first()
+        if flower_id is None:
+            raise CommandError("Каталог пуст: добавьте букеты или передайте --path")
+        return ['/', f'/flower/{flower_id}/']
+
+    def _run_wsgi(self, paths, host, total, concurrency):
+        handler = WSGIHandler()
+
+        def request(index):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': paths[index % len(paths)], 'QUERY_STRING': '',
+                'SERVER_NAME': host, 'SERVER_PORT': '80', 'HTTP_HOST': host, 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.input': BytesIO(), 'wsgi.errors': BytesIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            statuses = []
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            b''.join(response)
+            response.close()
+            latency = time.perf_counter() - started
+            connections.close_all()
+            return latency, statuses[0].startswith('200')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(request, range(total)))
+        elapsed = time.perf_counter() - started
+        return _summary([latency for latency, _ in outcomes], elapsed, sum(not ok for _, ok in outcomes))
+
+    async def _run_asgi(self, paths, host, total, concurrency):
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(index):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': paths[index % len(paths)], 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', host.encode())], 'server': (host, 80), 'client': ('127.0.0.1', 0),
+            }
+            statuses = []
+            body_sent = asyncio.Event()
+
+            async def receive():
+                if not body_sent.is_set():
+                    body_sent.set()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # Клиент не отключается: Django отменит ожидание после ответа
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, receive, send)
+                return time.perf_counter() - started, statuses[0] == 200
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(request(index) for index in range(total)))
+        elapsed = time.perf_counter() - started
+        return _summary([latency for latency, _ in outcomes], elapsed, sum(not ok for _, ok in outcomes))
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count
+
+from orders.bot_catalog import INLINE_RESULTS_LIMIT, CatalogSnapshotStore
+from orders.models import Flower
+
+
+def _orm_answer(query):
+    # Так ответ строился бы без снимка: запрос к базе на каждое нажатие клавиши
+    return list(
+        Flower.objects.filter(name__icontains=query).order_by('name', 'id')
+        .annotate(rating=Avg('reviews__rating'), review_count=Count('reviews'))
+        .values('id', 'name', 'price', 'rating', 'review_count')[:INLINE_RESULTS_LIMIT]
+    )
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время ответа на inline-запрос из снимка каталога в памяти и запросом к базе"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Запросов в каждом режиме")
+        parser.add_argument('--bot-id', type=int, default=0, help="ID бота для file_id фото")
+
+    def handle(self, *args, **options):
+        names = list(Flower.objects.values_list('name', flat=True)[:50])
+        if not names:
+            raise CommandError("Каталог пуст: добавьте букеты")
+        # Набор названия по буквам, как приходят inline-запросы
+        queries = [''] + [name[:length] for name in names for length in range(1, min(len(name), 8) + 1)]
+
+        started = time.perf_counter()
+        snapshot = async_to_sync(CatalogSnapshotStore().refresh)(options['bot_id'])
+        load_time = time.perf_counter() - started
+
+        requests = options['requests']
+        snapshot_latencies = self._measure(lambda query: snapshot.inline_results(query), queries, requests)
+        orm_latencies = self._measure(_orm_answer, queries, requests)
+
+        self.stdout.write(f"Букетов в снимке: {len(snapshot.flowers)}, загрузка снимка: {load_time * 1000:.1f} мс")
+        self.stdout.write(f"{'режим':<20}{'p50, мс':>10}{'p99, мс':>10}")
+        for mode, latencies in (('снимок в памяти', snapshot_latencies), ('запрос к базе', orm_latencies)):
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f"{mode:<20}{statistics.median(latencies) * 1000:>10.3f}{p99 * 1000:>10.3f}")
+
+    def _measure(self, answer, queries, requests):
+        latencies = []
+        for i in range(requests):
+            query = queries[i % len(queries)]
+            started = time.perf_counter()
+            answer(query)
+            latencies.append(time.perf_counter() - started)
+        return sorted(latencies)
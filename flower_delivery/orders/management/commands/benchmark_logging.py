@@ -0,0 +1,94 @@
+import logging
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.log import BackgroundHandler, SamplingFilter
+
+
+class _SlowSinkHandler(logging.FileHandler):
+    """Файл с задержкой записи: так ведет себя stderr, когда сборщик логов не успевает читать"""
+
+    def __init__(self, filename, latency):
+        super().__init__(filename, encoding='utf-8')
+        self.latency = latency
+
+    def emit(self, record):
+        super().emit(record)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _Order:
+    """Заказ для примера аргументов: __str__ стоит как у модели"""
+
+    def __init__(self, order_id):
+        self.id = order_id
+        self.address = "Москва, ул. Тверская, д. 1"
+
+    def __str__(self):
+        return f"Заказ {self.id}"
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает время, которое логирование отнимает у потока запроса: синхронный обработчик "
+            "с f-строками против фоновой записи с ленивыми аргументами и выборкой")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help="Сколько запросов имитировать")
+        parser.add_argument('--sink-latency-us', type=int, default=100,
+                            help="Задержка записи в приемник логов, мкс (0 — быстрый локальный файл)")
+        parser.add_argument('--sampling', type=float, default=0.1,
+                            help="Доля записей о просмотрах страниц, которые пишутся")
+
+    def handle(self, *args, **options):
+        requests, latency = options['requests'], options['sink_latency_us'] / 1e6
+        with tempfile.TemporaryDirectory() as directory:
+            sync_handler = _SlowSinkHandler(os.path.join(directory, 'sync.log'), latency)
+            sync_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+            before = self._run('benchmark.sync', sync_handler, requests, eager=True)
+            sync_handler.close()
+
+            background = BackgroundHandler(target=_SlowSinkHandler(os.path.join(directory, 'async.log'), latency))
+            background.addFilter(SamplingFilter({'benchmark.background.access': options['sampling']}))
+            after = self._run('benchmark.background', background, requests, eager=False)
+            started = time.perf_counter()
+            background.close()
+            drain = time.perf_counter() - started
+
+        self.stdout.write(f"{requests} запросов по 3 записи (просмотр страницы, заказ, отладка ниже уровня), "
+                          f"задержка приемника {options['sink_latency_us']} мкс")
+        self.stdout.write(f"{'режим':<22}{'всего, мс':>12}{'на запрос, мкс':>16}")
+        self.stdout.write(f"{'синхронно, f-строки':<22}{before * 1000:>12.1f}{before / requests * 1e6:>16.1f}")
+        self.stdout.write(f"{'фоновый поток':<22}{after * 1000:>12.1f}{after / requests * 1e6:>16.1f}")
+        self.stdout.write(f"Фоновый поток дописал очередь за {drain * 1000:.1f} мс после последнего запроса; "
+                          f"отброшено записей: {background.dropped}")
+
+    def _run(self, name, handler, requests, eager):
+        logger = logging.getLogger(name)
+        access_logger = logging.getLogger(f"{name}.access")
+        for item in (logger, access_logger):
+            item.handlers = [handler]
+            item.propagate = False
+            item.setLevel(logging.INFO)
+
+        form = {'address': "Москва, ул. Тверская, д. 1", 'guest_phone': '+7 999 123-45-67', 'delivery_time': '12:00'}
+        started = time.perf_counter()
+        for index in range(requests):
+            order = _Order(index)
+            if eager:
+                access_logger.info(f"User {index} accessed the index page. Cart total items: 3, total price: 1500")
+                logger.debug(f"Form data: {form}")
+                logger.info(f"Order {order} created for cart {index}")
+            else:
+                access_logger.info("User %s accessed the index page. Cart total items: %s, total price: %s",
+                                   index, 3, 1500)
+                logger.debug("Form data: %s", form)
+                logger.info("Order %s created for cart %s", order.id, index, extra={'order_id': order.id})
+        elapsed = time.perf_counter() - started
+
+        for item in (logger, access_logger):
+            item.handlers = []
+        return elapsed
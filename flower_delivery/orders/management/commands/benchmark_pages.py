@@ -0,0 +1,116 @@
+import gzip
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from orders.assets import brotli, compress, minify_css
+from orders.models import Flower
+
+STYLESHEET_RE = re.compile(r'<link rel="stylesheet" href="([^"]+)">')
+
+
+def _gzip_size(data):
+    return len(gzip.compress(data, compresslevel=6))
+
+
+def _uncached_templates():
+    templates = [dict(engine, OPTIONS=dict(engine['OPTIONS'])) for engine in settings.TEMPLATES]
+    for engine in templates:
+        loaders = engine['OPTIONS'].get('loaders', [])
+        engine['OPTIONS']['loaders'] = [
+            loader for entry in loaders
+            for loader in (entry[1] if isinstance(entry, tuple) and entry[0].endswith('cached.Loader') else [entry])
+        ]
+    return templates
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает размер HTML страниц витрины со встроенными стилями и с вынесенными в "
+            "статический файл, а также время ответа с кэшированным загрузчиком шаблонов и без него")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Запросов на каждую страницу и режим")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Путь страницы (можно несколько); по умолчанию главная, букет и вход")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self._default_paths()
+        self.host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        client = self._client()
+        stylesheets = {}
+
+        self.stdout.write("Размер HTML, байт (со сжатием gzip в скобках):")
+        self.stdout.write(f"{'страница':<24}{'стили внутри':>20}{'стили в файле':>20}")
+        for path in paths:
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"{path}: ответ {response.status_code}")
+            html = response.content
+            inlined = html
+            for url in STYLESHEET_RE.findall(html.decode('utf-8')):
+                css = self._stylesheet(url, stylesheets)
+                if css is not None:
+                    # Так страница отдавалась раньше: те же стили в <style> в каждом ответе
+                    inlined = inlined.replace(f'<link rel="stylesheet" href="{url}">'.encode(),
+                                              b'<style>' + css + b'</style>')
+            self.stdout.write(
+                f"{path:<24}{f'{len(inlined)} ({_gzip_size(inlined)})':>20}{f'{len(html)} ({_gzip_size(html)})':>20}"
+            )
+
+        self.stdout.write("\nСтили, байт (загружаются один раз и кэшируются браузером):")
+        self.stdout.write(f"{'файл':<24}{'исходный':>10}{'минифиц.':>10}{'gzip':>8}{'brotli':>8}")
+        for url, css in stylesheets.items():
+            minified = minify_css(css.decode('utf-8')).encode('utf-8')
+            variants = compress(minified)
+            br = len(variants['br']) if 'br' in variants else ('—' if brotli is not None else 'нет')
+            self.stdout.write(f"{url.rsplit('/', 1)[-1]:<24}{len(css):>10}{len(minified):>10}"
+                              f"{len(variants.get('gzip', minified)):>8}{br:>8}")
+
+        self.stdout.write("\nВремя ответа, мс (p50 / p99):")
+        self.stdout.write(f"{'страница':<24}{'без кэша шаблонов':>20}{'с кэшем шаблонов':>20}")
+        with override_settings(TEMPLATES=_uncached_templates()):
+            uncached = {path: self._latencies(self._client(), path, options['requests']) for path in paths}
+        cached = {path: self._latencies(self._client(), path, options['requests']) for path in paths}
+        for path in paths:
+            self.stdout.write(f"{path:<24}{self._format(uncached[path]):>20}{self._format(cached[path]):>20}")
+
+    def _client(self):
+        return Client(SERVER_NAME=self.host)
+
+    def _default_paths(self):
+        flower_id = Flower.objects.values_list('id', flat=True).first()
+        if flower_id is None:
+            raise CommandError("Каталог пуст: добавьте букеты или передайте --path")
+        return ['/', f'/flower/{flower_id}/', settings.LOGIN_URL]
+
+    def _stylesheet(self, url, stylesheets):
+        if url not in stylesheets:
+            if not url.startswith(settings.STATIC_URL):
+                return None
+            # Исходный файл из static/, без хэша в имени и без минификации
+            name = re.sub(r'\.[0-9a-f]{12}(\.\w+)$', r'\1', url[len(settings.STATIC_URL):])
+            found = finders.find(name)
+            if not found:
+                return None
+            with open(found, 'rb') as source:
+                stylesheets[url] = source.read()
+        return stylesheets[url]
+
+    def _latencies(self, client, path, requests):
+        client.get(path)  # Первый запрос прогревает кэши
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - started)
+        return sorted(latencies)
+
+    def _format(self, latencies):
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return f"{statistics.median(latencies) * 1000:.2f} / {p99 * 1000:.2f}"
@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from orders.models import Flower, Order
+from orders.replica import REPLICA, snapshot_replica
+
+
+def _report(alias):
+    # Тот же запрос, что у сводки: группировка всех заказов по дню и статусу
+    return list(
+        Order.objects.using(alias)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'status')
+        .annotate(orders=Count('id'), sales=Sum('total_price'))
+        .order_by()
+    )
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает задержку записи при оформлении заказа, пока параллельно строятся отчеты: "
+            "без отчетов, с отчетами по основной базе и с отчетами по реплике")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writes', type=int, default=300, help="Сколько записей измерить в каждом режиме")
+        parser.add_argument('--readers', type=int, default=2, help="Сколько потоков строят отчеты")
+
+    def handle(self, *args, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError("Реплика не настроена: задайте DJANGO_REPLICA_DB")
+        flower_id = Flower.objects.values_list('id', flat=True).first()
+        if flower_id is None:
+            raise CommandError("Каталог пуст: добавьте букеты")
+        snapshot_replica()
+
+        writes, readers = options['writes'], options['readers']
+        results = [
+            ('без отчетов', self._run(flower_id, writes, 0, None)),
+            ('отчеты по default', self._run(flower_id, writes, readers, DEFAULT_DB_ALIAS)),
+            ('отчеты по реплике', self._run(flower_id, writes, readers, REPLICA)),
+        ]
+        self.stdout.write(f"Заказов в базе: {Order.objects.count()}, записей: {writes}, потоков отчетов: {readers}")
+        self.stdout.write(f"{'режим':<20}{'p50, мс':>10}{'p99, мс':>10}{'отчетов':>10}")
+        for mode, (latencies, reports) in results:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f"{mode:<20}{statistics.median(latencies) * 1000:>10.2f}{p99 * 1000:>10.2f}{reports:>10}")
+
+    def _run(self, flower_id, writes, readers, alias):
+        stop = threading.Event()
+        reports = []
+
+        def read():
+            count = 0
+            try:
+                while not stop.is_set():
+                    _report(alias)
+                    count += 1
+            finally:
+                reports.append(count)
+                connections.close_all()
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        latencies = []
+        try:
+            for _ in range(writes):
+                started = time.perf_counter()
+                # Запись без изменения данных, но с настоящей фиксацией транзакции
+                with transaction.atomic():
+                    Flower.objects.filter(id=flower_id).update(stock=F('stock'))
+                latencies.append(time.perf_counter() - started)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        return sorted(latencies), sum(reports)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.recommendations import DEFAULT_TOP_K, build_recommendations, update_recommendations
+
+
+class Command(BaseCommand):
+    help = "Строит рекомендации «покупают вместе» и «покупатели также заказывали» по истории заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Учесть только заказы, появившиеся после последнего запуска")
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help="Сколько рекомендаций хранить на букет")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['incremental']:
+            updated = update_recommendations(top_k=options['top_k'])
+        else:
+            updated = build_recommendations(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Рекомендации обновлены для {updated} букетов за {time.monotonic() - started:.2f} с"
+        ))
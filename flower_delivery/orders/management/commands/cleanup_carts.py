@@ -0,0 +1,30 @@
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Удаляет просроченные сессии и брошенные гостевые корзины без заказа"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки удаления")
+
+    def handle(self, *args, **options):
+        import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+
+        cutoff = timezone.now() - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        abandoned = Cart.objects.filter(user=None, order__isnull=True, created_at__lt=cutoff)
+        deleted = 0
+        while True:
+            batch = list(abandoned.values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            Cart.objects.filter(id__in=batch).delete()
+            deleted += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Удалено гостевых корзин: {deleted}"))
@@ -0,0 +1,35 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.forecast import forecast_demand
+
+
+class Command(BaseCommand):
+    help = "Прогнозирует спрос на букеты по датам доставки для закупки цветов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="Первая дата прогноза в формате YYYY-MM-DD (по умолчанию сегодня)")
+        parser.add_argument('--days', type=int, default=14, help="На сколько дней строить прогноз")
+
+    def handle(self, *args, **options):
+        start = None
+        if options['start']:
+            try:
+                start = datetime.strptime(options['start'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Дата должна быть в формате YYYY-MM-DD")
+
+        started = time.monotonic()
+        forecast = forecast_demand(start=start, days=options['days'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write("Букет;" + ";".join(f"{day:%d.%m}" for day in forecast['dates']) + ";Итого")
+        for row in forecast['rows']:
+            self.stdout.write(
+                f"{row['flower'].name};" + ";".join(str(value) for value in row['daily']) + f";{row['total']}"
+            )
+        for day, name in forecast['holidays'].items():
+            self.stdout.write(self.style.WARNING(f"Пик спроса: {name} ({day:%d.%m})"))
+        self.stdout.write(self.style.SUCCESS(f"Прогноз для {len(forecast['rows'])} букетов построен за {elapsed:.2f} с"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.subscriptions import DEFAULT_BATCH_SIZE, DEFAULT_WINDOW_DAYS, generate_subscription_orders
+
+
+class Command(BaseCommand):
+    help = ("Создает заказы по подпискам на ближайшее окно доставок; "
+            "запускайте по расписанию, повторный запуск не создает дублей")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=DEFAULT_WINDOW_DAYS,
+                            help="На сколько дней вперед создавать заказы")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Сколько подписок обрабатывать за одну транзакцию")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = generate_subscription_orders(window_days=options['window_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано заказов по подпискам: {result['created']} за {time.perf_counter() - started:.1f} с"))
+        for subscription_id, day in result['unfulfilled']:
+            self.stdout.write(self.style.WARNING(
+                f"Подписка {subscription_id}: доставка {day:%d.%m.%Y} не создана — не хватает букетов на складе"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.catalog_import import (DEFAULT_CHUNK_SIZE, DEFAULT_IMAGE_WORKERS, FORMATS, CatalogImportError,
+                                   detect_format, format_report, import_catalog, read_catalog)
+
+
+class Command(BaseCommand):
+    help = "Импортирует каталог букетов из CSV, JSON или JSON Lines (сопоставление по артикулу)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл каталога")
+        parser.add_argument('--format', choices=FORMATS, help="Формат файла (по умолчанию по расширению)")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать различия, ничего не сохранять")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Строк в одной пачке записи")
+        parser.add_argument('--image-workers', type=int, default=DEFAULT_IMAGE_WORKERS,
+                            help="Потоков для загрузки изображений")
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options['format'] or detect_format(options['path'])
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                report = import_catalog(read_catalog(f, fmt), dry_run=options['dry_run'],
+                                        chunk_size=options['chunk_size'], image_workers=options['image_workers'])
+        except (OSError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(format_report(report))
+        if report['errors']:
+            raise CommandError("В каталоге есть ошибки, импорт не сохранен.")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from orders.search import INDEXES
+
+
+class Command(BaseCommand):
+    help = "Перестраивает индексы поиска заказов и отзывов (таблицы SQLite FTS5) по текущим данным"
+
+    def handle(self, *args, **options):
+        for index in INDEXES:
+            count = index.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"{index.table}: проиндексировано {count}"))
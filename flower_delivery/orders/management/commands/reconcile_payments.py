@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from orders.payments import RECONCILE_BATCH_SIZE, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = "Сверяет ожидающие платежи с провайдером и отменяет неоплаченные вовремя заказы"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE,
+                            help="Сколько платежей проверять за один запрос к провайдеру")
+
+    def handle(self, *args, **options):
+        result = reconcile_payments(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Отправлено провайдеру: {result['submitted']}, подтверждено: {result['settled']}, "
+            f"отменено заказов: {result['expired']}"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders.stock import reconcile_stock, release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Снимает просроченные резервы и пересчитывает доступные остатки букетов"
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        reconciled = reconcile_stock()
+        self.stdout.write(self.style.SUCCESS(
+            f"Снято резервов: {released}, пересчитано букетов: {reconciled}"
+        ))
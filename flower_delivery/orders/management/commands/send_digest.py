@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.digest import send_digests
+
+
+class Command(BaseCommand):
+    help = ("Рассылает сводку по заказам за вчера и прошлую неделю в Telegram и на почту; "
+            "запускайте по расписанию каждое утро, повторный запуск ничего не отправит повторно")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Дата запуска в формате YYYY-MM-DD (по умолчанию сегодня)")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать текст сводки")
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Дата должна быть в формате YYYY-MM-DD")
+
+        result = send_digests(today=today, dry_run=options['dry_run'])
+        if result['text'] is None:
+            self.stdout.write("Сводка за эти периоды уже отправлена во все каналы.")
+            return
+        if options['dry_run']:
+            self.stdout.write(result['text'])
+            return
+        self.stdout.write(self.style.SUCCESS(f"Отправлено: {result['sent']}, ошибок: {result['failed']}"))
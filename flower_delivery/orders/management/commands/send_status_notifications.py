@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from orders.status import NOTIFICATION_BATCH_SIZE, send_status_notifications
+
+
+class Command(BaseCommand):
+    help = "Отправляет покупателям накопленные уведомления о смене статуса заказа"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=NOTIFICATION_BATCH_SIZE,
+                            help="Сколько уведомлений отправлять за одно соединение")
+
+    def handle(self, *args, **options):
+        sent = send_status_notifications(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Отправлено уведомлений: {sent}"))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.replica import REPLICA, snapshot_replica
+
+
+class Command(BaseCommand):
+    help = ("Обновляет копию базы для отчетов (реплику) через backup API SQLite; "
+            "запускайте по cron или с --interval")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Повторять каждые N секунд (по умолчанию один раз)")
+
+    def handle(self, *args, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError("Реплика не настроена: задайте DJANGO_REPLICA_DB")
+        try:
+            while True:
+                try:
+                    elapsed = snapshot_replica()
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(self.style.SUCCESS(f"Реплика обновлена за {elapsed * 1000:.0f} мс"))
+                if not options['interval']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from orders.stock import untrack_empty_stock
+
+
+class Command(BaseCommand):
+    help = ("Снимает учет остатков с букетов, по которым не было ни поступлений, ни резервов "
+            "(однократно после обновления: раньше остаток по умолчанию был 0)")
+
+    def handle(self, *args, **options):
+        updated = untrack_empty_stock()
+        self.stdout.write(self.style.SUCCESS(f"Букетов без учета остатков: {updated}"))
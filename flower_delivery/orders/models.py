@@ -1,39 +1,542 @@
-from .models import Order, Flower, Review, Rating, Report
-from django import forms
-
-# Форма для оформления заказа
-class OrderForm(forms.ModelForm):
-    class Meta:
-        model = Order
-        fields = ['quantity', 'flower', 'address', 'delivery_time', 'delivery_date']
-        labels = {
-            'quantity': 'Количество',
-            'flower': 'Букет',
-            'address': 'Адрес',
-            'delivery_time': 'Время доставки',
-            'delivery_date': 'Дата доставки'
-        }
-
-    flower = forms.ModelChoiceField(queryset=Flower.objects.all(), empty_label="Выберите букет", required=False)
-    quantity = forms.IntegerField(min_value=1, required=False)
-    address = forms.CharField(max_length=255, required=True)
-    delivery_date = forms.DateField(widget=forms.SelectDateWidget(), required=True)
-    delivery_time = forms.TimeField(widget=forms.TimeInput(attrs={'type': 'time'}), required=True)
-
-class ReviewForm(forms.ModelForm):
-    class Meta:
-        model = Review
-        fields = ['comment']
-class RatingForm(forms.ModelForm):
-    class Meta:
-        model = Rating
-        fields = ['rating']  # Поле для выставления рейтинга (например, от 1 до 5)
-
-class ReportForm(forms.ModelForm):
-    class Meta:
-        model = Report
-        fields = ['start_date', 'end_date']
-        labels = {
-            'start_date': 'Дата начала периода',
-            'end_date': 'Дата окончания периода',
-        }
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Sum
+from django.utils import timezone
+
+from .replica import read_from_replica
+
+logger = logging.getLogger(__name__)
+
+
+class Flower(models.Model):
+    """Букет из каталога"""
+    id = models.BigAutoField(primary_key=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name='Артикул')
+    name = models.CharField(max_length=100, verbose_name='Название цветка')
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
+    description = models.TextField(verbose_name='Описание')
+    image = models.ImageField(upload_to='flowers/', verbose_name='Изображение')
+    # Пустые остатки — склад по букету не ведется и заказывать можно без ограничений
+    stock_total = models.PositiveIntegerField(null=True, blank=True, verbose_name='Поступило на склад')
+    stock = models.PositiveIntegerField(null=True, blank=True, verbose_name='Доступно к заказу')
+
+    class Meta:
+        verbose_name = 'Цветок'
+        verbose_name_plural = 'Цветы'
+
+    def __str__(self):
+        return self.name
+
+
+class Cart(models.Model):
+    """Корзина авторизованного пользователя или гостя (по ключу сессии)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Пользователь')
+    session_key = models.CharField(max_length=40, null=True, blank=True, verbose_name='Ключ сессии')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+    is_completed = models.BooleanField(default=False, verbose_name='Завершена')
+    version = models.PositiveIntegerField(default=0, verbose_name='Версия')
+
+    def __str__(self):
+        return f"Корзина {self.id} ({self.user or self.session_key})"
+
+    def total_price(self):
+        return sum((item.total_price() for item in self.items.select_related('flower')), Decimal('0'))
+
+    def total_items(self):
+        return self.items.aggregate(total=Sum('quantity'))['total'] or 0
+
+
+class CartItem(models.Model):
+    """Позиция корзины"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'flower'], name='unique_cart_flower'),
+        ]
+
+    def __str__(self):
+        return f"{self.flower.name} x {self.quantity}"
+
+    def total_price(self):
+        return self.flower.price * self.quantity
+
+
+class Order(models.Model):
+    """Заказ на доставку"""
+    STATUS_CHOICES = [
+        ('pending', 'В ожидании'),
+        ('confirmed', 'Подтвержден'),
+        ('delivered', 'Доставлен'),
+        ('canceled', 'Отменен'),
+    ]
+    ONLINE = 'online'
+    ON_DELIVERY = 'on_delivery'
+    PAYMENT_METHOD_CHOICES = [
+        (ONLINE, 'Онлайн'),
+        (ON_DELIVERY, 'При получении'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Пользователь')
+    cart = models.OneToOneField(Cart, on_delete=models.CASCADE, null=True, blank=True)
+    flower = models.ForeignKey(Flower, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Букет')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    delivery_date = models.DateField(verbose_name='Дата доставки')
+    delivery_time = models.TimeField(verbose_name='Время доставки')
+    address = models.CharField(max_length=255, verbose_name='Адрес доставки')
+    comment = models.TextField(blank=True, null=True, verbose_name='Комментарий')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус')
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    # Заказы с оплатой при получении не ждут онлайн-платежа и не отменяются по его таймауту
+    payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, default=ONLINE,
+                                      verbose_name='Способ оплаты')
+    guest_email = models.EmailField(blank=True, null=True, verbose_name='Email гостя')
+    guest_phone = models.CharField(max_length=20, blank=True, null=True, verbose_name='Телефон гостя')
+    created_at = models.DateTimeField(default=timezone.now)
+    subscription = models.ForeignKey('Subscription', on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='orders', verbose_name='Подписка')
+    subscription_period = models.DateField(null=True, blank=True, verbose_name='Период подписки')
+
+    class Meta:
+        verbose_name = 'Заказ'
+        verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['status', 'delivery_date']),
+            models.Index(fields=['created_at']),
+        ]
+        constraints = [
+            # Один заказ на подписку за период: повторный запуск планировщика не создаст дубль
+            models.UniqueConstraint(fields=['subscription', 'subscription_period'], name='unique_subscription_period'),
+        ]
+
+    def __str__(self):
+        return f"Заказ {self.id}"
+
+    def telegram_text(self):
+        """Текст уведомления о заказе для чата магазина; None, если данных не хватает"""
+        if not self.delivery_date or not self.delivery_time or not self.address:
+            logger.error("Order %s is missing required data: delivery date, time, or address", self.id)
+            return None
+
+        items = [
+            f"- {item.flower.name}: {item.quantity} шт."
+            for item in (self.cart.items.select_related('flower') if self.cart else [])
+        ]
+        if not items:
+            logger.error("Order %s has no items in the cart", self.id)
+            return None
+
+        return (
+            f"Новый заказ №{self.id}\n"
+            f"Дата доставки: {self.delivery_date} {self.delivery_time}\n"
+            f"Адрес: {self.address}\n"
+            f"Состав:\n" + "\n".join(items)
+        )
+
+    def send_to_telegram(self):
+        """Отправка информации о заказе в Telegram-чат магазина"""
+        import requests
+
+        text = self.telegram_text()
+        if text is None:
+            return False
+        try:
+            response = requests.post(
+                f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage",
+                data={"chat_id": settings.TELEGRAM_CHAT_ID, "text": text},
+                timeout=10,
+            )
+            response.raise_for_status()
+            logger.info("Order %s successfully sent to Telegram.", self.id)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.error("Error sending order %s to Telegram: %s", self.id, e)
+            return False
+
+
+class Subscription(models.Model):
+    """Регулярный заказ: одинаковый набор букетов доставляется с заданным интервалом"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Пользователь')
+    address = models.CharField(max_length=255, verbose_name='Адрес доставки')
+    delivery_time = models.TimeField(verbose_name='Время доставки')
+    comment = models.TextField(blank=True, null=True, verbose_name='Комментарий')
+    interval_days = models.PositiveIntegerField(default=7, verbose_name='Интервал, дней')
+    next_delivery_date = models.DateField(verbose_name='Следующая доставка')
+    is_active = models.BooleanField(default=True, verbose_name='Активна')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Подписка'
+        verbose_name_plural = 'Подписки'
+        indexes = [models.Index(fields=['is_active', 'next_delivery_date', 'id'])]
+
+    def __str__(self):
+        return f"Подписка {self.id} ({self.user}, каждые {self.interval_days} дн.)"
+
+
+class SubscriptionItem(models.Model):
+    """Позиция регулярного заказа"""
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='items',
+                                     verbose_name='Подписка')
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, verbose_name='Букет')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Позиция подписки'
+        verbose_name_plural = 'Позиции подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['subscription', 'flower'], name='unique_subscription_flower'),
+        ]
+
+    def __str__(self):
+        return f"{self.flower} x {self.quantity}"
+
+
+class OrderStatusEvent(models.Model):
+    """Запись журнала смены статусов заказа; журнал только пополняется"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events', verbose_name='Заказ')
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Был статус')
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Новый статус')
+    source = models.CharField(max_length=20, verbose_name='Источник')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Кто изменил')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Смена статуса'
+        verbose_name_plural = 'Журнал статусов'
+        indexes = [models.Index(fields=['order', 'created_at'])]
+
+    def __str__(self):
+        return f"Заказ {self.order_id}: {self.from_status} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Записи журнала статусов не изменяются")
+        super().save(*args, **kwargs)
+
+
+class StatusNotification(models.Model):
+    """Уведомление покупателя о смене статуса в очереди на отправку"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_notifications')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Статус')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата отправки')
+
+    class Meta:
+        verbose_name = 'Уведомление о статусе'
+        verbose_name_plural = 'Уведомления о статусе'
+        indexes = [models.Index(fields=['sent_at', 'id'])]
+
+
+class Payment(models.Model):
+    """Попытка оплаты заказа у платежного провайдера"""
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает подтверждения'),
+        (SUCCEEDED, 'Оплачен'),
+        (FAILED, 'Отклонен'),
+        (EXPIRED, 'Истек'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments', verbose_name='Заказ')
+    idempotency_key = models.CharField(max_length=64, unique=True, verbose_name='Ключ идемпотентности')
+    provider = models.CharField(max_length=50, verbose_name='Провайдер')
+    provider_payment_id = models.CharField(max_length=100, blank=True, default='', db_index=True,
+                                           verbose_name='ID платежа у провайдера')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Платеж'
+        verbose_name_plural = 'Платежи'
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"Платеж {self.id} заказа {self.order_id} ({self.status})"
+
+
+class StockReservation(models.Model):
+    """Резерв букетов под заказ до оплаты (active) или после нее (committed)"""
+    ACTIVE = 'active'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Зарезервировано'),
+        (COMMITTED, 'Оплачено'),
+        (RELEASED, 'Снято'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE, verbose_name='Статус')
+    expires_at = models.DateTimeField(verbose_name='Истекает')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Резерв'
+        verbose_name_plural = 'Резервы'
+        indexes = [models.Index(fields=['status', 'expires_at'])]
+
+    def __str__(self):
+        return f"{self.flower} x {self.quantity} для заказа {self.order_id} ({self.status})"
+
+
+class OrderHistory(models.Model):
+    """Запись истории заказов (по одной на позицию корзины)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Пользователь')
+    guest_token = models.CharField(max_length=32, blank=True, default='', verbose_name='Токен гостя')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='history',
+                              verbose_name='Заказ')
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, verbose_name='Букет')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    delivery_date = models.DateField(verbose_name='Дата доставки')
+    delivery_time = models.TimeField(verbose_name='Время доставки')
+    delivery_address = models.CharField(max_length=255, verbose_name='Адрес доставки')
+    comment = models.TextField(blank=True, null=True, verbose_name='Комментарий')
+    cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Стоимость')
+    completed_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата оформления')
+
+    class Meta:
+        verbose_name = 'История заказа'
+        verbose_name_plural = 'История заказов'
+        indexes = [
+            models.Index(fields=['user', '-completed_at', '-id']),
+            models.Index(fields=['guest_token', '-completed_at', '-id']),
+            models.Index(fields=['completed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user or 'гость'} - {self.flower} ({self.completed_at:%Y-%m-%d})"
+
+
+class CartReorder(models.Model):
+    """Отметка о том, что заказ из истории уже добавлен в корзину (повтор идемпотентен)"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reorders')
+    source = models.CharField(max_length=40, verbose_name='Исходный заказ')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'source'], name='unique_cart_reorder'),
+        ]
+
+
+class OrderHistoryArchive(models.Model):
+    """Архив старой истории заказов: только то, что нужно для отчетов и аналитики"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Пользователь')
+    guest_token = models.CharField(max_length=32, blank=True, default='', verbose_name='Токен гостя')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_history',
+                              verbose_name='Заказ')
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, verbose_name='Букет')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    delivery_date = models.DateField(verbose_name='Дата доставки')
+    cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Стоимость')
+    completed_at = models.DateTimeField(verbose_name='Дата оформления')
+
+    class Meta:
+        verbose_name = 'Архивная запись истории'
+        verbose_name_plural = 'Архив истории заказов'
+        indexes = [models.Index(fields=['user', '-completed_at'])]
+
+
+class Review(models.Model):
+    """Отзыв о букете"""
+    RATING_CHOICES = [(i, i) for i in range(1, 6)]
+
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='reviews')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    rating = models.PositiveIntegerField(choices=RATING_CHOICES, verbose_name='Рейтинг (1-5)')
+    comment = models.TextField(blank=True, null=True, verbose_name='Комментарий')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Отзыв'
+        verbose_name_plural = 'Отзывы'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user} - {self.flower} ({self.rating})"
+
+
+class Rating(models.Model):
+    """Оценка букета"""
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='ratings')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    rating = models.PositiveIntegerField(choices=Review.RATING_CHOICES, verbose_name='Оценка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Оценка'
+        verbose_name_plural = 'Оценки'
+
+    def __str__(self):
+        return f"{self.user} - {self.flower}: {self.rating}"
+
+
+class Report(models.Model):
+    """Отчет по заказам за период"""
+    date = models.DateField(auto_now_add=True, verbose_name='Дата')
+    start_date = models.DateField(null=True, blank=True, verbose_name='Дата начала периода')
+    end_date = models.DateField(null=True, blank=True, verbose_name='Дата окончания периода')
+    total_orders = models.IntegerField(default=0, verbose_name='Общее количество заказов')
+    total_sales = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Общий объем продаж')
+    total_revenue = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Общий доход')
+    total_expenses = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Общие расходы')
+    profit = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Прибыль')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Отчет'
+        verbose_name_plural = 'Отчеты'
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Отчет за {self.start_date} - {self.end_date}"
+
+    def calculate_report(self):
+        """Пересчет показателей отчета по заказам за период"""
+        orders = Order.objects.all()
+        if self.start_date:
+            orders = orders.filter(created_at__date__gte=self.start_date)
+        if self.end_date:
+            orders = orders.filter(created_at__date__lte=self.end_date)
+
+        with read_from_replica():
+            self.total_orders = orders.count()
+            self.total_sales = orders.aggregate(total=Sum('total_price'))['total'] or 0
+        self.total_revenue = self.total_sales
+        self.total_expenses = Decimal('1000')  # Примерные расходы на доставку
+        self.profit = self.total_revenue - self.total_expenses
+        self.save()
+
+
+class DigestDelivery(models.Model):
+    """Отправка сводки за период в один канал (чат Telegram или почта).
+
+    Запись создается до отправки и служит блокировкой: уникальность
+    (период, начало периода, канал) не дает отправить сводку дважды.
+    """
+    DAY = 'day'
+    WEEK = 'week'
+    PERIOD_CHOICES = [
+        (DAY, 'День'),
+        (WEEK, 'Неделя'),
+    ]
+
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, verbose_name='Период')
+    period_start = models.DateField(verbose_name='Начало периода')
+    channel = models.CharField(max_length=100, verbose_name='Канал')
+    claimed_at = models.DateTimeField(default=timezone.now, verbose_name='Начало отправки')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Отправлено')
+
+    class Meta:
+        verbose_name = 'Отправка сводки'
+        verbose_name_plural = 'Отправки сводок'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'channel'], name='unique_digest_delivery'),
+        ]
+
+    def __str__(self):
+        return f"Сводка {self.period} с {self.period_start} -> {self.channel}"
+
+
+class GeocodeCache(models.Model):
+    """Локальный кэш геокодирования адресов доставки"""
+    address = models.CharField(max_length=255, unique=True, verbose_name='Нормализованный адрес')
+    latitude = models.FloatField(verbose_name='Широта')
+    longitude = models.FloatField(verbose_name='Долгота')
+    source = models.CharField(max_length=20, default='offline', verbose_name='Источник')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Геокод адреса'
+        verbose_name_plural = 'Геокоды адресов'
+
+    def __str__(self):
+        return f"{self.address} ({self.latitude:.5f}, {self.longitude:.5f})"
+
+
+class FlowerPairCount(models.Model):
+    """Счетчик совместных покупок пары букетов; строка flower == other хранит число покупок букета"""
+    TOGETHER = 'together'
+    ALSO = 'also'
+    KIND_CHOICES = [
+        (TOGETHER, 'Покупают вместе'),
+        (ALSO, 'Покупатели также заказывали'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'flower', 'other'], name='unique_flower_pair_count'),
+        ]
+
+
+class FlowerRecommendation(models.Model):
+    """Готовый топ рекомендаций для букета; читается одним индексным запросом"""
+    kind = models.CharField(max_length=10, choices=FlowerPairCount.KIND_CHOICES)
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        indexes = [models.Index(fields=['flower', 'kind', 'rank'])]
+
+
+class RecommendationBuild(models.Model):
+    """Запуск построения рекомендаций: до какой записи истории учтены покупки"""
+    last_history_id = models.BigIntegerField(default=0)
+    incremental = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class TelegramPhoto(models.Model):
+    """Загруженное в Telegram фото букета: file_id для повторной отправки без загрузки файла"""
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE, related_name='telegram_photos', verbose_name='Цветок')
+    # file_id действителен только для бота, который загрузил файл
+    bot_id = models.BigIntegerField(verbose_name='ID бота')
+    image_hash = models.CharField(max_length=40, verbose_name='Хэш изображения')
+    file_id = models.CharField(max_length=255, verbose_name='file_id в Telegram')
+    uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
+
+    class Meta:
+        verbose_name = 'Фото в Telegram'
+        verbose_name_plural = 'Фото в Telegram'
+        constraints = [
+            models.UniqueConstraint(fields=['flower', 'bot_id', 'image_hash'], name='unique_telegram_photo'),
+        ]
+
+    def __str__(self):
+        return f"{self.flower_id}: {self.file_id}"
+
+
+class CatalogVersion(models.Model):
+    """Счетчик изменений каталога (одна строка): по нему бот обновляет снимок каталога в памяти"""
+    version = models.PositiveBigIntegerField(default=0, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталога'
+
+    def __str__(self):
+        return f"Каталог v{self.version}"
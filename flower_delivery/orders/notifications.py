@@ -0,0 +1,58 @@
+"""Уведомление магазина о новых заказах в Telegram без ожидания в запросе.
+
+Текст собирается в запросе (позиции корзины уже под рукой), а отправка
+через Bot API идет корутиной после фиксации транзакции: в фоновом потоке
+для синхронных представлений или задачей в цикле событий, если вызов
+пришел из асинхронного кода.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notifications')
+_tasks = set()
+
+
+async def asend_shop_message(text, chat_id=None):
+    """Отправка сообщения в чат магазина (или в ``chat_id``); True при успехе"""
+    chat_id = chat_id or settings.TELEGRAM_CHAT_ID
+    if not settings.TELEGRAM_BOT_TOKEN or not chat_id:
+        logger.warning("Telegram bot token or chat id is not configured; notification skipped")
+        return False
+
+    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+    try:
+        await bot.send_message(chat_id=chat_id, text=text)
+        return True
+    except Exception as e:
+        logger.error("Error sending Telegram notification: %s", e)
+        return False
+    finally:
+        await bot.session.close()
+
+
+def _deliver(text):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _executor.submit(asyncio.run, asend_shop_message(text))
+    else:
+        task = loop.create_task(asend_shop_message(text))
+        _tasks.add(task)  # Ссылка на задачу, чтобы ее не собрал сборщик мусора
+        task.add_done_callback(_tasks.discard)
+
+
+def notify_new_order(order):
+    """Уведомление о заказе после фиксации транзакции; запрос не ждет ответа Telegram"""
+    text = order.telegram_text()
+    if text is None:
+        return False
+    transaction.on_commit(lambda: _deliver(text))
+    logger.debug("Order %s notification queued", order.id)
+    return True
@@ -0,0 +1,366 @@
+"""Оплата заказов через подключаемого платежного провайдера.
+
+Оформление оплаты только записывает ``Payment`` с ключом идемпотентности и
+сразу отвечает покупателю; платеж у провайдера создается в фоне после
+фиксации транзакции. Результат приходит вебхуком (``handle_callback``) или
+находится сверкой (``reconcile_payments``). Повторный запрос с тем же
+ключом возвращает тот же платеж, а повторный вебхук ничего не меняет:
+статус платежа меняется условным UPDATE только из «ожидает».
+
+Неоплаченные вовремя заказы отменяются: резерв букетов возвращается на
+склад, а корзина отвязывается от заказа и снова доступна для оформления.
+
+Провайдер задается в ``settings.PAYMENT_PROVIDER``; ``FakePaymentProvider``
+работает локально и используется только в разработке (DEBUG) и тестах.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cart, CartItem, CartReorder, Order, Payment
+from .status import CANCELED, CONFIRMED, PENDING, InvalidTransition, transition_order, transition_orders
+from .stock import OutOfStock, commit_order_stock, extend_order_reservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_MINUTES = 30
+RECONCILE_BATCH_SIZE = 100
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='payments')
+
+
+class PaymentError(Exception):
+    """Оплата невозможна; текст исключения показывается покупателю"""
+
+
+class PaymentProvider:
+    """Интерфейс платежного провайдера"""
+    name = None
+
+    def create_payment(self, payment):
+        """Создание платежа у провайдера; возвращает его ID у провайдера"""
+        raise NotImplementedError
+
+    def get_status(self, provider_payment_id):
+        """Текущий статус платежа: одно из значений ``Payment.STATUS_CHOICES``"""
+        raise NotImplementedError
+
+    def get_statuses(self, provider_payment_ids):
+        """Статусы нескольких платежей; провайдеры с пакетным API переопределяют метод"""
+        return {provider_payment_id: self.get_status(provider_payment_id)
+                for provider_payment_id in provider_payment_ids}
+
+    def parse_callback(self, request):
+        """(ID платежа у провайдера, статус) из вебхука; неподлинный запрос — ``PaymentError``"""
+        raise NotImplementedError
+
+
+class FakePaymentProvider(PaymentProvider):
+    """Локальный провайдер без внешнего сервиса; работает только при DEBUG и в тестах.
+
+    Состояние платежей хранится в кэше. При ``PAYMENT_FAKE_AUTO_CAPTURE``
+    платеж сразу считается оплаченным, иначе его результат задается
+    через ``settle``. Вебхук подписывается HMAC-SHA256 от тела запроса
+    ключом ``PAYMENT_WEBHOOK_SECRET``.
+    """
+    name = 'fake'
+
+    def __init__(self):
+        if not (settings.DEBUG or getattr(settings, 'TESTING', False)):
+            raise ImproperlyConfigured("FakePaymentProvider не принимает деньги: задайте PAYMENT_PROVIDER.")
+
+    def _key(self, provider_payment_id):
+        return f"fake_payment:{provider_payment_id}"
+
+    def create_payment(self, payment):
+        # ID не выводится из ключа идемпотентности, который знает клиент
+        provider_payment_id = f"fake-{secrets.token_hex(16)}"
+        auto_capture = getattr(settings, 'PAYMENT_FAKE_AUTO_CAPTURE', False)
+        cache.add(self._key(provider_payment_id), Payment.SUCCEEDED if auto_capture else Payment.PENDING, None)
+        return provider_payment_id
+
+    def settle(self, provider_payment_id, status):
+        cache.set(self._key(provider_payment_id), status, None)
+
+    def get_status(self, provider_payment_id):
+        return cache.get(self._key(provider_payment_id), Payment.PENDING)
+
+    def get_statuses(self, provider_payment_ids):
+        keys = {self._key(provider_payment_id): provider_payment_id for provider_payment_id in provider_payment_ids}
+        found = cache.get_many(keys)
+        return {provider_payment_id: found.get(key, Payment.PENDING) for key, provider_payment_id in keys.items()}
+
+    @staticmethod
+    def sign(body):
+        secret = getattr(settings, 'PAYMENT_WEBHOOK_SECRET', None)
+        if not secret:
+            raise PaymentError("Не задан PAYMENT_WEBHOOK_SECRET, вебхуки не принимаются.")
+        return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def parse_callback(self, request):
+        signature = request.headers.get('X-Payment-Signature', '')
+        if not hmac.compare_digest(signature, self.sign(request.body)):
+            raise PaymentError("Неверная подпись вебхука.")
+        try:
+            data = json.loads(request.body)
+            return data['payment_id'], data['status']
+        except (ValueError, KeyError, TypeError):
+            raise PaymentError("Некорректное тело вебхука.")
+
+
+@lru_cache(maxsize=None)
+def _load_provider(path):
+    return import_string(path)()
+
+
+def get_provider():
+    path = getattr(settings, 'PAYMENT_PROVIDER', None)
+    if not path:
+        raise ImproperlyConfigured("Не задан платежный провайдер (PAYMENT_PROVIDER).")
+    return _load_provider(path)
+
+
+def check_payment_settings(app_configs=None, **kwargs):
+    """Проверка Django при запуске: без настоящего провайдера и ключа вебхуков сайт не стартует"""
+    errors = []
+    path = getattr(settings, 'PAYMENT_PROVIDER', None)
+    if not path:
+        errors.append(checks.Error("Не задан платежный провайдер.", hint="Укажите PAYMENT_PROVIDER.",
+                                   id='orders.E001'))
+    elif (import_string(path) is FakePaymentProvider
+          and not (settings.DEBUG or getattr(settings, 'TESTING', False))):
+        errors.append(checks.Error("FakePaymentProvider подтверждает оплату без списания денег.",
+                                   hint="Укажите настоящий PAYMENT_PROVIDER.", id='orders.E002'))
+    if not getattr(settings, 'PAYMENT_WEBHOOK_SECRET', None):
+        # При отладке сайт запускается, но вебхуки отклоняются
+        level, check_id = (checks.Warning, 'orders.W003') if settings.DEBUG else (checks.Error, 'orders.E003')
+        errors.append(level("Не задан ключ подписи вебхуков оплаты.", hint="Укажите PAYMENT_WEBHOOK_SECRET.",
+                            id=check_id))
+    return errors
+
+
+def start_payment(order, idempotency_key):
+    """Платеж по заказу для ключа идемпотентности: существующий или новый.
+
+    Провайдер вызывается после фиксации транзакции в фоновом потоке,
+    поэтому запрос покупателя не ждет ответа провайдера.
+    """
+    if not idempotency_key or len(idempotency_key) > 64:
+        raise PaymentError("Некорректный запрос оплаты. Обновите страницу.")
+
+    existing = Payment.objects.filter(idempotency_key=idempotency_key).first()
+    if existing is not None:
+        if existing.order_id != order.id:
+            raise PaymentError("Некорректный запрос оплаты. Обновите страницу.")
+        return existing
+
+    order.refresh_from_db(fields=['status'])
+    if order.status != PENDING:
+        raise PaymentError("Заказ уже оплачен или отменен.")
+    in_progress = order.payments.filter(status__in=[Payment.PENDING, Payment.SUCCEEDED]).first()
+    if in_progress is not None:
+        return in_progress
+
+    provider = get_provider()
+    try:
+        with transaction.atomic():
+            # Резерв должен дожить до результата оплаты, иначе оплаченных букетов может не остаться
+            extend_order_reservation(order)
+            payment = Payment.objects.create(order=order, idempotency_key=idempotency_key,
+                                             provider=provider.name, amount=order.total_price)
+            _schedule_submit(payment.id)
+    except IntegrityError:
+        # Параллельный запрос с тем же ключом успел создать платеж
+        payment = Payment.objects.filter(idempotency_key=idempotency_key, order=order).first()
+        if payment is None:
+            raise PaymentError("Некорректный запрос оплаты. Обновите страницу.")
+        return payment
+    except OutOfStock:
+        raise PaymentError("Резерв букетов истек, а часть из них уже закончилась. Оформите заказ заново.")
+
+    logger.info("Payment %s started for order %s", payment.id, order.id)
+    return payment
+
+
+def _schedule_submit(payment_id):
+    if getattr(settings, 'PAYMENT_SUBMIT_ASYNC', True):
+        transaction.on_commit(lambda: _executor.submit(_submit_in_thread, payment_id))
+    else:
+        transaction.on_commit(lambda: submit_payment(payment_id))
+
+
+def _submit_in_thread(payment_id):
+    try:
+        submit_payment(payment_id)
+    finally:
+        connection.close()
+
+
+def submit_payment(payment_id):
+    """Создание платежа у провайдера; при ошибке платеж повторит ``reconcile_payments``"""
+    payment = Payment.objects.filter(id=payment_id, status=Payment.PENDING, provider_payment_id='').first()
+    if payment is None:
+        return False
+    try:
+        provider_payment_id = get_provider().create_payment(payment)
+    except Exception as e:
+        logger.error("Could not submit payment %s to provider: %s", payment_id, e)
+        return False
+    Payment.objects.filter(id=payment_id, provider_payment_id='').update(provider_payment_id=provider_payment_id)
+    return True
+
+
+def complete_order_cart(order):
+    """Корзина оплаченного заказа закрывается: позиции удаляются одним запросом"""
+    if order.cart_id:
+        CartItem.objects.filter(cart_id=order.cart_id).delete()
+        CartReorder.objects.filter(cart_id=order.cart_id).delete()
+        Cart.objects.filter(id=order.cart_id).update(is_completed=True)
+
+
+def apply_payment_result(payment, status):
+    """Применение результата платежа ровно один раз; True, если статус изменился"""
+    if status == Payment.PENDING:
+        return False
+
+    # Поздняя успешная оплата истекшего платежа тоже фиксируется — деньги уже списаны
+    allowed = [Payment.PENDING, Payment.EXPIRED] if status == Payment.SUCCEEDED else [Payment.PENDING]
+    with transaction.atomic():
+        if not Payment.objects.filter(id=payment.id, status__in=allowed).update(status=status):
+            return False
+        payment.status = status
+        if status == Payment.SUCCEEDED:
+            _confirm_paid_order(payment)
+
+    logger.info("Payment %s of order %s is %s", payment.id, payment.order_id, status)
+    return True
+
+
+def _confirm_paid_order(payment):
+    order = payment.order
+    try:
+        with transaction.atomic():
+            commit_order_stock(order)
+            transition_order(order, CONFIRMED, source='payment')
+            complete_order_cart(order)
+    except (OutOfStock, InvalidTransition) as e:
+        logger.error("Payment %s succeeded but order %s cannot be confirmed (%s); refund required",
+                     payment.id, order.id, e)
+
+
+def handle_callback(request):
+    """Обработка вебхука провайдера"""
+    provider = get_provider()
+    provider_payment_id, status = provider.parse_callback(request)
+    if status not in dict(Payment.STATUS_CHOICES):
+        raise PaymentError(f"Неизвестный статус платежа: {status}")
+
+    payment = (
+        Payment.objects.select_related('order')
+        .filter(provider=provider.name, provider_payment_id=provider_payment_id)
+        .first()
+    )
+    if payment is None:
+        raise PaymentError("Платеж не найден.")
+    return apply_payment_result(payment, status)
+
+
+def refresh_payment(payment):
+    """Запрос статуса платежа у провайдера (для страницы ожидания оплаты)"""
+    if payment.status != Payment.PENDING or not payment.provider_payment_id:
+        return False
+    return apply_payment_result(payment, get_provider().get_status(payment.provider_payment_id))
+
+
+def reopen_order_carts(order_ids):
+    """Корзины отмененных заказов отвязываются, чтобы их можно было оформить заново.
+
+    Если покупатель уже начал новую корзину, старая остается за заказом:
+    открытая корзина у покупателя одна.
+    """
+    reopen = []
+    for order_id, user_id, session_key in (
+        Order.objects.filter(id__in=order_ids, cart__isnull=False)
+        .values_list('id', 'cart__user_id', 'cart__session_key')
+    ):
+        if user_id:
+            owner = Q(user_id=user_id)
+        elif session_key:
+            owner = Q(user=None, session_key=session_key)
+        else:
+            # Корзина гостя с сайта найдется по ID из сессии
+            owner = None
+        if owner is not None and Cart.objects.filter(owner, order__isnull=True).exists():
+            continue
+        reopen.append(order_id)
+    Order.objects.filter(id__in=reopen).update(cart=None)
+
+
+def expire_unpaid_orders(now=None, batch_size=RECONCILE_BATCH_SIZE):
+    """Отмена заказов с онлайн-оплатой, не оплаченных за ``PAYMENT_TIMEOUT_MINUTES``"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(minutes=getattr(settings, 'PAYMENT_TIMEOUT_MINUTES', DEFAULT_TIMEOUT_MINUTES))
+    expired = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Order.objects.filter(status=PENDING, payment_method=Order.ONLINE, created_at__lt=cutoff, id__gt=last_id)
+            .exclude(payments__status=Payment.SUCCEEDED)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        changed, rejected = transition_orders(ids, CANCELED, source='payment-timeout')
+        with transaction.atomic():
+            Payment.objects.filter(order_id__in=changed, status=Payment.PENDING).update(status=Payment.EXPIRED)
+            reopen_order_carts(changed)
+        expired += len(changed)
+
+    if expired:
+        logger.info("Expired %s unpaid order(s)", expired)
+    return expired
+
+
+def reconcile_payments(batch_size=RECONCILE_BATCH_SIZE, now=None):
+    """Сверка ожидающих платежей с провайдером пачками, затем отмена просроченных заказов"""
+    provider = get_provider()
+    submitted = settled = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Payment.objects.filter(status=Payment.PENDING, provider=provider.name, id__gt=last_id)
+            .select_related('order').order_by('id')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        for payment in batch:
+            if not payment.provider_payment_id:
+                submitted += submit_payment(payment.id)
+
+        known = [payment for payment in batch if payment.provider_payment_id]
+        statuses = provider.get_statuses([payment.provider_payment_id for payment in known])
+        for payment in known:
+            settled += apply_payment_result(payment, statuses.get(payment.provider_payment_id, Payment.PENDING))
+
+    expired = expire_unpaid_orders(now=now, batch_size=batch_size)
+    logger.info("Reconciled payments: %s submitted, %s settled, %s order(s) expired", submitted, settled, expired)
+    return {'submitted': submitted, 'settled': settled, 'expired': expired}
@@ -0,0 +1,183 @@
+"""Ограничение частоты запросов к корзине, оформлению заказа и входу.
+
+Каждый клиент получает «ведро» жетонов (token bucket) отдельно по IP,
+по сессии и по пользователю: ведро вмещает N жетонов и пополняется со
+скоростью N за период, каждый запрос забирает по жетону из всех своих
+ведер. Запрос отклоняется ответом 429, если пусто хотя бы одно из них;
+отклоненный запрос жетонов не тратит.
+
+Проверка идет до вызова представления: пользователь определяется по ID
+из сессии (при ``cached_db`` по умолчанию она читается из кэша), без
+загрузки ``request.user`` из базы.
+
+Ведра хранятся в памяти процесса. Если задан ``RATELIMIT_CACHE_ALIAS``,
+они хранятся в общем кэше, и лимит действует на все процессы сразу;
+чтение и запись в кэш не атомарны, поэтому при одновременных запросах
+лимит соблюдается приблизительно.
+"""
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+# Сколько ведер держать в памяти; самые давние вытесняются
+MAX_MEMORY_BUCKETS = 10000
+SESSION_ID_KEY = '_ratelimit_id'
+
+
+def parse_rate(rate):
+    """'30/m' -> (емкость ведра, жетонов в секунду)"""
+    try:
+        count, period = rate.split('/')
+        count = int(count)
+        seconds = PERIODS[period]
+    except (ValueError, KeyError):
+        raise ValueError(f"Некорректный лимит: {rate!r}. Ожидается вида '30/m'.")
+    if count <= 0:
+        raise ValueError(f"Некорректный лимит: {rate!r}.")
+    return count, count / seconds
+
+
+class MemoryBuckets:
+    """Ведра в памяти процесса"""
+
+    def __init__(self, max_buckets=MAX_MEMORY_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.max_buckets = max_buckets
+
+    def take(self, keys, capacity, refill, now):
+        """Забрать по жетону из каждого ведра; возвращает (отклонившие ведра, секунд до повтора).
+
+        Если пусто хоть одно ведро, жетоны не забираются ни из одного.
+        """
+        with self._lock:
+            states = {key: self._buckets.get(key, (capacity, now)) for key in keys}
+            denied, retry_after, taken = _take_all(states, capacity, refill, now)
+            if not denied:
+                for key, tokens in taken.items():
+                    self._buckets.pop(key, None)
+                    self._buckets[key] = (tokens, now)
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+        return denied, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """Ведра в общем кэше Django"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, keys, capacity, refill, now):
+        cache = caches[self.alias]
+        stored = cache.get_many([f"ratelimit:{key}" for key in keys])
+        states = {key: stored.get(f"ratelimit:{key}", (capacity, now)) for key in keys}
+        denied, retry_after, taken = _take_all(states, capacity, refill, now)
+        if not denied:
+            for key, tokens in taken.items():
+                # Полное ведро можно забыть: ключ живет, пока ведро не пополнится
+                cache.set(f"ratelimit:{key}", (tokens, now), int((capacity - tokens) / refill) + 1)
+        return denied, retry_after
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+def _take_all(states, capacity, refill, now):
+    """Проверка ведер {ключ: (жетоны, время)}: (отклонившие, секунд до повтора, {ключ: жетонов после})"""
+    denied, retry_after, taken = [], 0, {}
+    for key, (tokens, updated) in states.items():
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        if tokens >= 1:
+            taken[key] = tokens - 1
+        else:
+            denied.append(key)
+            retry_after = max(retry_after, (1 - tokens) / refill)
+    return denied, retry_after, taken
+
+
+_memory = MemoryBuckets()
+
+
+def get_buckets():
+    alias = getattr(settings, 'RATELIMIT_CACHE_ALIAS', None)
+    return CacheBuckets(alias) if alias else _memory
+
+
+def reset():
+    """Сброс всех ведер (для тестов и ручной разблокировки)"""
+    get_buckets().clear()
+
+
+def client_ip(request):
+    """IP клиента; за прокси берется адрес, добавленный нашим прокси в X-Forwarded-For"""
+    if getattr(settings, 'RATELIMIT_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _identities(request):
+    identities = [f"ip:{client_ip(request)}"]
+    if request.COOKIES.get(settings.SESSION_COOKIE_NAME):
+        # Ключ сессии меняется при входе (а cookie подписанной сессии — при каждой записи),
+        # поэтому ведро сессии привязано к случайному ID, который хранится в самой сессии
+        session_id = request.session.get(SESSION_ID_KEY)
+        if not session_id:
+            session_id = request.session[SESSION_ID_KEY] = secrets.token_hex(8)
+        identities.append(f"session:{session_id}")
+        # ID пользователя читается из сессии без запроса к базе
+        user_id = request.session.get(SESSION_KEY)
+        if user_id:
+            identities.append(f"user:{user_id}")
+    return identities
+
+
+def check(request, scope, rate):
+    """Разрешен ли запрос; возвращает (разрешено, секунд до повтора)"""
+    capacity, refill = parse_rate(rate)
+    buckets = get_buckets()
+    denied, retry_after = buckets.take([f"{scope}:{identity}" for identity in _identities(request)],
+                                       capacity, refill, time.time())
+    if denied:
+        logger.warning("Rate limit %s (%s) exceeded by %s", scope, rate, ", ".join(denied))
+        return False, retry_after
+    return True, 0
+
+
+def ratelimit(scope, methods=None):
+    """Декоратор представления: лимит берется из ``settings.RATELIMITS[scope]``.
+
+    ``methods`` — какие методы ограничивать (по умолчанию все), например
+    только POST для форм входа и регистрации.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            rate = getattr(settings, 'RATELIMITS', {}).get(scope)
+            if rate and (methods is None or request.method in methods):
+                allowed, retry_after = check(request, scope, rate)
+                if not allowed:
+                    response = HttpResponse("Слишком много запросов. Попробуйте позже.", status=429,
+                                            content_type='text/plain; charset=utf-8')
+                    response['Retry-After'] = str(int(retry_after) + 1)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+"""Рекомендации «покупают вместе» и «покупатели также заказывали».
+
+По истории заказов считается разреженная матрица совместных покупок:
+для «вместе» корзиной считается заказ, для «также» — все букеты одного
+покупателя. Сходство пары — косинусная мера ``c(a, b) / sqrt(n(a) * n(b))``.
+Для каждого букета заранее сохраняется топ-K, так что на странице нужен
+один индексный запрос к ``FlowerRecommendation``.
+
+Полная пересборка проходит историю одним потоком; инкрементальная берет
+только записи после последнего запуска и пересчитывает топ для
+затронутых букетов.
+"""
+import heapq
+import logging
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .caching import bump_flower_versions
+from .models import (FlowerPairCount, FlowerRecommendation, OrderHistory, OrderHistoryArchive,
+                     RecommendationBuild)
+
+logger = logging.getLogger(__name__)
+
+TOGETHER = FlowerPairCount.TOGETHER
+ALSO = FlowerPairCount.ALSO
+KINDS = (TOGETHER, ALSO)
+
+DEFAULT_TOP_K = 6
+BATCH_SIZE = 5000
+
+
+def _customer(user_id, guest_token):
+    return f"u{user_id}" if user_id else (f"g{guest_token}" if guest_token else None)
+
+
+def _count_sets(flower_sets):
+    """Счетчики по набору множеств: {(a, b): c}, включая диагональ (a, a) — число множеств с a"""
+    counts = Counter()
+    for flowers in flower_sets:
+        for flower_id in flowers:
+            counts[flower_id, flower_id] += 1
+        for a, b in combinations(sorted(flowers), 2):
+            counts[a, b] += 1
+            counts[b, a] += 1
+    return counts
+
+
+def _rank(counts, flower_ids, top_k):
+    """Топ-K рекомендаций для указанных букетов по счетчикам пар"""
+    neighbours = defaultdict(list)
+    for (a, b), count in counts.items():
+        if a != b and a in flower_ids:
+            neighbours[a].append((b, count))
+
+    rows = []
+    for flower_id, pairs in neighbours.items():
+        n_a = counts.get((flower_id, flower_id), 0)
+        scored = (
+            (count / math.sqrt(n_a * counts[b, b]), b)
+            for b, count in pairs
+            if n_a and counts.get((b, b))
+        )
+        for rank, (score, other_id) in enumerate(heapq.nlargest(top_k, scored), start=1):
+            rows.append((flower_id, other_id, rank, round(score, 6)))
+    return rows
+
+
+def _write_recommendations(kind, rows, flower_ids=None):
+    queryset = FlowerRecommendation.objects.filter(kind=kind)
+    if flower_ids is not None:
+        queryset = queryset.filter(flower_id__in=flower_ids)
+    queryset.delete()
+    FlowerRecommendation.objects.bulk_create([
+        FlowerRecommendation(kind=kind, flower_id=flower_id, recommended_id=other_id, rank=rank, score=score)
+        for flower_id, other_id, rank, score in rows
+    ], batch_size=BATCH_SIZE)
+
+
+def build_recommendations(top_k=DEFAULT_TOP_K):
+    """Полная пересборка счетчиков и топов по всей истории заказов"""
+    baskets = defaultdict(set)
+    customers = defaultdict(set)
+    last_id = 0
+
+    history = OrderHistory.objects.values_list('id', 'order_id', 'user_id', 'guest_token', 'flower_id')
+    for history_id, order_id, user_id, guest_token, flower_id in history.iterator(chunk_size=BATCH_SIZE):
+        last_id = max(last_id, history_id)
+        baskets[order_id or f"h{history_id}"].add(flower_id)
+        customer = _customer(user_id, guest_token)
+        if customer:
+            customers[customer].add(flower_id)
+
+    archive = OrderHistoryArchive.objects.values_list('user_id', 'guest_token', 'flower_id')
+    for user_id, guest_token, flower_id in archive.iterator(chunk_size=BATCH_SIZE):
+        customer = _customer(user_id, guest_token)
+        if customer:
+            customers[customer].add(flower_id)
+
+    counts = {TOGETHER: _count_sets(baskets.values()), ALSO: _count_sets(customers.values())}
+
+    with transaction.atomic():
+        FlowerPairCount.objects.all().delete()
+        for kind in KINDS:
+            FlowerPairCount.objects.bulk_create([
+                FlowerPairCount(kind=kind, flower_id=a, other_id=b, count=count)
+                for (a, b), count in counts[kind].items()
+            ], batch_size=BATCH_SIZE)
+            flower_ids = {a for a, _ in counts[kind]}
+            _write_recommendations(kind, _rank(counts[kind], flower_ids, top_k))
+        RecommendationBuild.objects.create(last_history_id=last_id)
+
+    affected = {a for kind in KINDS for a, _ in counts[kind]}
+    bump_flower_versions(affected)
+    logger.info("Built recommendations from %s orders and %s customers", len(baskets), len(customers))
+    return len(affected)
+
+
+def _customer_filter(customers):
+    user_ids = [key[1:] for key in customers if key.startswith('u')]
+    tokens = [key[1:] for key in customers if key.startswith('g')]
+    return Q(user_id__in=user_ids) | Q(user=None, guest_token__in=tokens)
+
+
+def update_recommendations(top_k=DEFAULT_TOP_K):
+    """Учет заказов, появившихся после последнего запуска; без предыдущего запуска — полная сборка"""
+    last_build = RecommendationBuild.objects.order_by('-id').first()
+    if last_build is None:
+        return build_recommendations(top_k)
+    watermark = last_build.last_history_id
+
+    new_rows = list(
+        OrderHistory.objects.filter(id__gt=watermark)
+        .values_list('id', 'order_id', 'user_id', 'guest_token', 'flower_id')
+    )
+    if not new_rows:
+        return 0
+
+    baskets = defaultdict(set)
+    new_items = defaultdict(set)
+    for history_id, order_id, user_id, guest_token, flower_id in new_rows:
+        baskets[order_id or f"h{history_id}"].add(flower_id)
+        customer = _customer(user_id, guest_token)
+        if customer:
+            new_items[customer].add(flower_id)
+
+    # Что эти покупатели заказывали раньше: «также» считает каждого покупателя один раз
+    known = defaultdict(set)
+    if new_items:
+        customer_filter = _customer_filter(new_items)
+        for queryset in (OrderHistory.objects.filter(id__lte=watermark), OrderHistoryArchive.objects.all()):
+            for user_id, guest_token, flower_id in queryset.filter(customer_filter).values_list(
+                    'user_id', 'guest_token', 'flower_id'):
+                known[_customer(user_id, guest_token)].add(flower_id)
+
+    deltas = {TOGETHER: _count_sets(baskets.values()), ALSO: Counter()}
+    for customer, flowers in new_items.items():
+        before = known[customer]
+        added = flowers - before
+        for flower_id in added:
+            deltas[ALSO][flower_id, flower_id] += 1
+            for other_id in (before | flowers) - {flower_id}:
+                deltas[ALSO][flower_id, other_id] += 1
+                if other_id not in added:
+                    deltas[ALSO][other_id, flower_id] += 1
+
+    affected = set()
+    with transaction.atomic():
+        for kind in KINDS:
+            if not deltas[kind]:
+                continue
+            changed = {a for a, _ in deltas[kind]}
+            existing = Counter({
+                (row.flower_id, row.other_id): row.count
+                for row in FlowerPairCount.objects.filter(kind=kind, flower_id__in=changed)
+            })
+            existing.update(deltas[kind])
+            FlowerPairCount.objects.bulk_create([
+                FlowerPairCount(kind=kind, flower_id=a, other_id=b, count=existing[a, b])
+                for a, b in deltas[kind]
+            ], update_conflicts=True, unique_fields=['kind', 'flower', 'other'], update_fields=['count'],
+                batch_size=BATCH_SIZE)
+
+            # Изменение числа покупок букета меняет оценки и у его соседей
+            neighbours = set(
+                FlowerPairCount.objects.filter(kind=kind, flower_id__in=changed).values_list('other_id', flat=True)
+            )
+            to_rank = changed | neighbours
+            counts = Counter({
+                (row.flower_id, row.other_id): row.count
+                for row in FlowerPairCount.objects.filter(
+                    Q(flower_id__in=to_rank) | Q(flower_id=F('other_id')), kind=kind)
+            })
+            _write_recommendations(kind, _rank(counts, to_rank, top_k), flower_ids=to_rank)
+            affected |= to_rank
+
+        RecommendationBuild.objects.create(last_history_id=max(row[0] for row in new_rows), incremental=True)
+
+    bump_flower_versions(affected)
+    logger.info("Updated recommendations with %s new history row(s)", len(new_rows))
+    return len(affected)
+
+
+def _recommendation_rows(flower_ids, kind):
+    if isinstance(flower_ids, int):
+        flower_ids = [flower_ids]
+    return (
+        FlowerRecommendation.objects.filter(flower_id__in=flower_ids, kind=kind)
+        .exclude(recommended_id__in=flower_ids)
+        .select_related('recommended')
+        .order_by('-score', 'rank')
+    )
+
+
+def get_recommendations(flower_ids, kind=TOGETHER, limit=DEFAULT_TOP_K):
+    """Рекомендованные букеты для одного или нескольких букетов (без них самих)"""
+    return _pick_recommended(_recommendation_rows(flower_ids, kind), limit)
+
+
+async def aget_recommendations(flower_ids, kind=TOGETHER, limit=DEFAULT_TOP_K):
+    rows = [row async for row in _recommendation_rows(flower_ids, kind)]
+    return _pick_recommended(rows, limit)
+
+
+def _pick_recommended(rows, limit):
+    result = {}
+    for row in rows:
+        if row.recommended_id not in result:
+            result[row.recommended_id] = row.recommended
+            if len(result) == limit:
+                break
+    return list(result.values())
@@ -0,0 +1,76 @@
+"""Повтор заказа из истории: общий сервис для сайта и Telegram-бота.
+
+Исходная корзина восстанавливается одним запросом по всем записям истории
+того же заказа и добавляется к текущей корзине покупателя. Цены берутся
+текущие из каталога, а повтор одного и того же заказа в ту же корзину
+выполняется только один раз.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Subquery
+
+from .cart import ADD, CartError, apply_cart_ops, cart_summary, user_cart
+from .models import CartReorder, OrderHistory
+
+logger = logging.getLogger(__name__)
+
+
+class ReorderError(CartError):
+    """Заказ нельзя повторить; текст исключения показывается покупателю"""
+
+
+def load_basket(history_id, user=None, guest_token=None):
+    """Все позиции заказа, к которому относится запись истории, одним запросом.
+
+    ``user`` или ``guest_token`` ограничивают поиск заказами этого покупателя.
+    """
+    owner = Q()
+    if user is not None:
+        owner &= Q(user=user)
+    if guest_token is not None:
+        owner &= Q(user=None, guest_token=guest_token)
+    source = OrderHistory.objects.filter(owner, id=history_id)
+
+    # Записи без ссылки на заказ (до появления поля order) повторяются поштучно
+    rows = OrderHistory.objects.filter(
+        Q(id=history_id, order__isnull=True) | Q(order_id=Subquery(source.values('order_id')[:1]))
+    ).select_related('flower').filter(owner)
+    return list(rows.order_by('id'))
+
+
+def reorder(history_id, user=None, cart=None, guest_token=None):
+    """Добавление позиций заказа из истории в корзину.
+
+    ``user`` ограничивает поиск историей этого пользователя (сайт),
+    ``guest_token`` — гостевыми заказами с этим токеном (покупатель в боте);
+    без них заказ повторяется в корзину его владельца (админка). Возвращает
+    ``(summary, added, repriced)``: сводку корзины, признак того, что позиции
+    были добавлены сейчас, и названия букетов, чья цена изменилась.
+    """
+    basket = load_basket(history_id, user=user, guest_token=guest_token)
+    if not basket:
+        raise ReorderError("Заказ с таким ID не найден.")
+
+    owner = basket[0].user
+    if cart is None:
+        if owner is None:
+            raise ReorderError("Гостевой заказ можно повторить только на сайте.")
+        cart = user_cart(owner)
+
+    source = f"order:{basket[0].order_id}" if basket[0].order_id else f"history:{basket[0].id}"
+    repriced = sorted({
+        row.flower.name for row in basket
+        if row.quantity and row.cost != row.flower.price * row.quantity
+    })
+
+    try:
+        with transaction.atomic():
+            CartReorder.objects.create(cart=cart, source=source)
+            summary = apply_cart_ops(cart, [(ADD, row.flower_id, row.quantity) for row in basket])
+    except IntegrityError:
+        # Этот заказ уже был добавлен в корзину — повторный запрос ничего не меняет
+        return cart_summary(cart), False, repriced
+
+    logger.debug("Reordered %s into cart %s: %s position(s)", source, cart.id, len(basket))
+    return summary, True, repriced
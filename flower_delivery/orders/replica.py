@@ -0,0 +1,194 @@
+"""Чтение тяжелых отчетов с реплики базы.
+
+Отчеты, сводки, прогноз, списки в админке и команды бота /status и /report
+читают много строк и допускают отставание данных на минуты. Такие места
+оборачиваются в ``read_from_replica()`` (или декоратор ``replica_reads``), и
+``ReplicaRouter`` отправляет их чтения на базу ``replica``; все записи и
+остальные чтения идут в ``default``. Так отчеты не держат блокировки основной
+базы, пока оформляются заказы.
+
+Чтобы пользователь видел свои изменения (read-your-writes):
+
+* модель, в которую уже писали в текущем запросе или блоке, дальше читается
+  из ``default``;
+* после запроса с записью ``ReplicaMiddleware`` ставит cookie, и следующие
+  ``REPLICA_STICKY_SECONDS`` секунд все чтения пользователя идут в ``default``.
+  Окно должно быть больше интервала обновления реплики.
+
+Локально реплика — копия SQLite, которую ``manage.py snapshot_replica``
+обновляет через backup API (по cron или с ``--interval``). Пока реплика не
+настроена (``DJANGO_REPLICA_DB``) или копия еще не сделана, все читается из
+``default``.
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+PIN_COOKIE = 'db_pin'
+DEFAULT_STICKY_SECONDS = 300
+
+
+class _State:
+    """Маршрутизация в рамках одного запроса или блока read_from_replica"""
+    __slots__ = ('enabled', 'pinned', 'written')
+
+    def __init__(self, enabled=False, pinned=False):
+        self.enabled = enabled
+        self.pinned = pinned
+        self.written = set()
+
+
+_state = contextvars.ContextVar('replica_state', default=None)
+
+
+def replica_available():
+    """Настроена ли реплика и сделана ли уже ее копия"""
+    if REPLICA not in settings.DATABASES:
+        return False
+    settings_dict = connections[REPLICA].settings_dict
+    # В тестах реплика — зеркало default (TEST MIRROR): та же база, читать ее через второе соединение незачем
+    if settings_dict['NAME'] == connections[DEFAULT_DB_ALIAS].settings_dict['NAME']:
+        return False
+    if settings_dict['ENGINE'] == 'django.db.backends.sqlite3':
+        return os.path.exists(settings_dict['NAME'])
+    return True
+
+
+@contextmanager
+def read_from_replica():
+    """Чтения внутри блока идут на реплику, кроме моделей, в которые здесь уже писали"""
+    state = _state.get()
+    if state is None:
+        token = _state.set(_State(enabled=True))
+        try:
+            yield
+        finally:
+            _state.reset(token)
+        return
+    enabled, state.enabled = state.enabled, True
+    try:
+        yield
+    finally:
+        state.enabled = enabled
+
+
+def replica_reads(func):
+    """Декоратор функции или представления (в том числе async) для read_from_replica"""
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with read_from_replica():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with read_from_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Чтения из read_from_replica() — на реплику, все остальное — в default"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is None or not state.enabled or state.pinned
+                or model._meta.label in state.written or not replica_available()):
+            # Явно default: иначе Django взял бы базу объекта, загруженного с реплики
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.written.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика — копия default, своих миграций у нее нет
+        return False if db == REPLICA else None
+
+
+class ReplicaMiddleware:
+    """Состояние маршрутизации на время запроса и cookie после записи"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        return _state.set(_State(pinned=PIN_COOKIE in request.COOKIES))
+
+    def _finish(self, token, response):
+        state = _state.get()
+        _state.reset(token)
+        if state.written:
+            sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+            response.set_cookie(PIN_COOKIE, '1', max_age=sticky, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _state.reset(token)
+            raise
+        return self._finish(token, response)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _state.reset(token)
+            raise
+        return self._finish(token, response)
+
+
+def snapshot_replica():
+    """Копия default в файл реплики через backup API SQLite; возвращает время копирования в секундах.
+
+    Копирование идет одним шагом: основная база читается одной транзакцией и
+    запись в нее ждет только это время, а читающие реплику видят либо
+    старую, либо новую копию целиком.
+    """
+    source_settings = connections[DEFAULT_DB_ALIAS].settings_dict
+    replica_settings = settings.DATABASES[REPLICA]
+    if source_settings['ENGINE'] != 'django.db.backends.sqlite3' or \
+            replica_settings['ENGINE'] != 'django.db.backends.sqlite3':
+        raise ValueError("Снимок реплики делается только для SQLite; другие базы реплицируются средствами СУБД.")
+
+    started = time.perf_counter()
+    source = sqlite3.connect(source_settings['NAME'], timeout=source_settings.get('OPTIONS', {}).get('timeout', 5))
+    target = sqlite3.connect(replica_settings['NAME'], timeout=replica_settings.get('OPTIONS', {}).get('timeout', 5))
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    elapsed = time.perf_counter() - started
+    logger.info("Replica snapshot of %s took %.3fs", source_settings['NAME'], elapsed)
+    return elapsed
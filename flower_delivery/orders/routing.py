@@ -0,0 +1,195 @@
+"""Планирование маршрутов курьеров на день доставки.
+
+Подтвержденные заказы дня делятся на временные окна по ``delivery_time``,
+внутри окна заказы распределяются между курьерами методом «заметания»
+(sweep) вокруг склада, а порядок объезда каждого курьера строится
+эвристикой ближайшего соседа с улучшением 2-opt.
+"""
+import hashlib
+import logging
+import math
+import re
+
+from django.conf import settings
+
+from .models import GeocodeCache, Order
+
+logger = logging.getLogger(__name__)
+
+# Склад, из которого выезжают курьеры (центр Москвы по умолчанию)
+DEFAULT_DEPOT = (55.7558, 37.6173)
+# Сколько заказов курьер берет в один рейс
+DEFAULT_COURIER_CAPACITY = 8
+# Ширина временного окна доставки в часах
+DEFAULT_WINDOW_HOURS = 2
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def normalize_address(address):
+    """Приведение адреса к ключу кэша: нижний регистр, без лишней пунктуации и пробелов"""
+    address = address.lower().replace('ё', 'е')
+    address = re.sub(r'[^\w\s/-]', ' ', address)
+    return re.sub(r'\s+', ' ', address).strip()
+
+
+class OfflineGeocoder:
+    """Офлайн-заглушка геокодера.
+
+    Детерминированно отображает адрес в точку внутри рабочей зоны доставки,
+    чтобы планирование работало без внешнего сервиса.
+    """
+    source = 'offline'
+
+    def __init__(self, center=DEFAULT_DEPOT, radius_km=25.0):
+        self.center = center
+        self.radius_km = radius_km
+
+    def geocode(self, address):
+        digest = hashlib.sha1(address.encode('utf-8')).digest()
+        angle = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF * 2 * math.pi
+        distance = math.sqrt(int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF) * self.radius_km
+        lat0, lon0 = self.center
+        lat = lat0 + (distance * math.cos(angle)) / 111.32
+        lon = lon0 + (distance * math.sin(angle)) / (111.32 * math.cos(math.radians(lat0)))
+        return lat, lon
+
+
+def geocode_addresses(addresses, geocoder=None):
+    """Координаты для набора адресов: один запрос к кэшу, недостающие — через геокодер"""
+    geocoder = geocoder or OfflineGeocoder(center=get_depot())
+    keys = {address: normalize_address(address) for address in addresses}
+
+    cached = {
+        row.address: (row.latitude, row.longitude)
+        for row in GeocodeCache.objects.filter(address__in=set(keys.values()))
+    }
+
+    missing = [key for key in set(keys.values()) if key not in cached]
+    new_rows = []
+    for key in missing:
+        lat, lon = geocoder.geocode(key)
+        cached[key] = (lat, lon)
+        new_rows.append(GeocodeCache(address=key, latitude=lat, longitude=lon, source=geocoder.source))
+    if new_rows:
+        GeocodeCache.objects.bulk_create(new_rows, ignore_conflicts=True)
+        logger.info("Geocoded %s new addresses", len(new_rows))
+
+    return {address: cached[key] for address, key in keys.items()}
+
+
+def distance_matrix(points):
+    """Матрица расстояний (км) по формуле гаверсинусов для списка точек (lat, lon)"""
+    lats = [math.radians(lat) for lat, _ in points]
+    lons = [math.radians(lon) for _, lon in points]
+    cos_lats = [math.cos(lat) for lat in lats]
+    size = len(points)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        row = matrix[i]
+        for j in range(i + 1, size):
+            a = (math.sin((lats[j] - lats[i]) / 2) ** 2
+                 + cos_lats[i] * cos_lats[j] * math.sin((lons[j] - lons[i]) / 2) ** 2)
+            row[j] = matrix[j][i] = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+    return matrix
+
+
+def route_length(route, matrix):
+    """Длина маршрута склад -> точки -> склад; склад имеет индекс 0"""
+    path = [0] + route + [0]
+    return sum(matrix[a][b] for a, b in zip(path, path[1:]))
+
+
+def solve_tsp(nodes, matrix):
+    """Порядок объезда точек: ближайший сосед от склада, затем 2-opt"""
+    route = []
+    remaining = set(nodes)
+    current = 0
+    while remaining:
+        current = min(remaining, key=lambda node: matrix[current][node])
+        route.append(current)
+        remaining.remove(current)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(route) - 1):
+            for j in range(i + 1, len(route)):
+                before = route[i - 1] if i > 0 else 0
+                after = route[j + 1] if j + 1 < len(route) else 0
+                delta = (matrix[before][route[j]] + matrix[route[i]][after]
+                         - matrix[before][route[i]] - matrix[route[j]][after])
+                if delta < -1e-9:
+                    route[i:j + 1] = reversed(route[i:j + 1])
+                    improved = True
+    return route
+
+
+def sweep_clusters(nodes, coords, depot, capacity):
+    """Разбиение точек на рейсы по полярному углу вокруг склада"""
+    lat0, lon0 = depot
+    ordered = sorted(nodes, key=lambda node: math.atan2(coords[node][0] - lat0, coords[node][1] - lon0))
+    return [ordered[i:i + capacity] for i in range(0, len(ordered), capacity)]
+
+
+def get_depot():
+    return tuple(getattr(settings, 'DELIVERY_DEPOT', DEFAULT_DEPOT))
+
+
+def time_window(delivery_time, window_hours):
+    """Начало и конец временного окна, в которое попадает время доставки"""
+    start = delivery_time.hour - delivery_time.hour % window_hours
+    return f"{start:02d}:00-{min(start + window_hours, 24):02d}:00"
+
+
+def plan_routes(delivery_date, capacity=None, window_hours=None, geocoder=None):
+    """Маршрутные листы курьеров на дату доставки.
+
+    Возвращает список словарей ``{'courier', 'window', 'stops', 'distance_km'}``,
+    где ``stops`` — заказы в порядке объезда.
+    """
+    capacity = capacity or getattr(settings, 'COURIER_CAPACITY', DEFAULT_COURIER_CAPACITY)
+    window_hours = window_hours or getattr(settings, 'DELIVERY_WINDOW_HOURS', DEFAULT_WINDOW_HOURS)
+    depot = get_depot()
+
+    orders = list(
+        Order.objects.filter(delivery_date=delivery_date, status='confirmed')
+        .select_related('user')
+        .order_by('delivery_time', 'id')
+    )
+    if not orders:
+        return []
+
+    locations = geocode_addresses({order.address for order in orders}, geocoder=geocoder)
+
+    windows = {}
+    for order in orders:
+        windows.setdefault(time_window(order.delivery_time, window_hours), []).append(order)
+
+    manifests = []
+    for window, window_orders in windows.items():
+        coords = [depot] + [locations[order.address] for order in window_orders]
+        matrix = distance_matrix(coords)
+        nodes = list(range(1, len(coords)))
+        for cluster in sweep_clusters(nodes, coords, depot, capacity):
+            route = solve_tsp(cluster, matrix)
+            manifests.append({
+                'courier': len(manifests) + 1,
+                'window': window,
+                'stops': [window_orders[node - 1] for node in route],
+                'distance_km': round(route_length(route, matrix), 1),
+            })
+
+    logger.info("Planned %s courier routes for %s orders on %s", len(manifests), len(orders), delivery_date)
+    return manifests
+
+
+def format_manifest(manifest):
+    """Текст маршрутного листа для Telegram"""
+    lines = [
+        f"Курьер {manifest['courier']}, окно {manifest['window']}, "
+        f"~{manifest['distance_km']} км:"
+    ]
+    for number, order in enumerate(manifest['stops'], start=1):
+        lines.append(f"{number}. Заказ {order.id}, {order.delivery_time:%H:%M}, {order.address}")
+    return "\n".join(lines)
@@ -0,0 +1,241 @@
+"""Индексированный поиск заказов и отзывов для админки и бота.
+
+``LIKE '%текст%'`` по адресу через JOIN с пользователями просматривает всю
+таблицу заказов. Вместо этого каждый заказ и отзыв хранится в таблице
+SQLite FTS5 с токенизатором trigram (``orders_order_search``,
+``orders_review_search``, rowid = ID объекта), и поиск подстроки идет по
+индексу триграмм.
+
+Текст в индексе и в запросе нормализуется одинаково: регистр, «ё»,
+знаки препинания и сокращения («улица» = «ул.», «дом» = «д.»), телефоны —
+только цифры с 7 вместо 8 в начале. Слова запроса короче трех букв
+(номер дома, корпус) ищутся как отдельные слова среди найденного.
+Запрос из одних цифр ищет также заказы, ID которых начинается с этих
+цифр (по диапазонам первичного ключа).
+
+Индекс обновляется сигналами сохранения и удаления, массовые операции
+(``bulk_create``) вызывают ``index_orders`` сами. Таблицы создаются после
+``migrate``; ``manage.py rebuild_search_index`` перестраивает их целиком.
+На других СУБД поиск откатывается к обычному ``icontains``.
+"""
+import logging
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Order, Review
+
+logger = logging.getLogger(__name__)
+
+# Сколько цифр может быть в ID заказа: префикс ищется по диапазонам до этой длины
+MAX_ID_DIGITS = 12
+MIN_TRIGRAM_LENGTH = 3
+REBUILD_BATCH_SIZE = 2000
+
+ABBREVIATIONS = {
+    'улица': 'ул', 'проспект': 'пр', 'просп': 'пр', 'пр-т': 'пр', 'переулок': 'пер', 'шоссе': 'ш',
+    'бульвар': 'б-р', 'бул': 'б-р', 'набережная': 'наб', 'площадь': 'пл', 'проезд': 'пр-д',
+    'микрорайон': 'мкр', 'город': 'г', 'дом': 'д', 'корпус': 'к', 'корп': 'к', 'строение': 'стр',
+    'квартира': 'кв', 'подъезд': 'под', 'этаж': 'эт',
+}
+_PUNCTUATION_RE = re.compile(r'[^\w@+-]+')
+_PHONE_QUERY_RE = re.compile(r'^\+?[\d\s()-]+$')
+_WORD_RE = re.compile(r'[^\W_]')
+
+
+def normalize_text(text):
+    """Нижний регистр, «е» вместо «ё», без знаков препинания, сокращения адресов в одном виде"""
+    words = _PUNCTUATION_RE.sub(' ', (text or '').lower().replace('ё', 'е')).split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words if _WORD_RE.search(word))
+
+
+def normalize_phone(text):
+    """Только цифры; российский номер в виде 7XXXXXXXXXX"""
+    digits = re.sub(r'\D', '', text or '')
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10 and digits[0] == '9':
+        digits = '7' + digits
+    return digits
+
+
+class SearchIndex:
+    """Таблица FTS5 с документами одной модели; rowid совпадает с ID объекта"""
+
+    def __init__(self, model, table, fields, build_document, fallback_fields):
+        self.model = model
+        self.table = table
+        self.fields = fields
+        self.build_document = build_document
+        self.fallback_fields = fallback_fields
+
+    def _connection(self, write=False):
+        alias = router.db_for_write(self.model) if write else router.db_for_read(self.model)
+        return connections[alias]
+
+    def create_table(self, connection):
+        """Создать таблицу, если ее нет; True, если она создана сейчас"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+            if cursor.fetchone():
+                return False
+            cursor.execute(f"CREATE VIRTUAL TABLE {self.table} USING fts5(body, tokenize='trigram')")
+        return True
+
+    def update(self, ids):
+        """Переиндексировать объекты по ID (удаленные просто пропадают из индекса)"""
+        ids = list(ids)
+        connection = self._connection(write=True)
+        if not ids or connection.vendor != 'sqlite':
+            return
+        rows = self.model._base_manager.using(connection.alias).filter(id__in=ids).values('id', *self.fields)
+        documents = [(row['id'], f" {self.build_document(row)} ") for row in rows]
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids)
+            cursor.executemany(f"INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)", documents)
+
+    def remove(self, ids):
+        ids = list(ids)
+        connection = self._connection(write=True)
+        if not ids or connection.vendor != 'sqlite':
+            return
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids)
+
+    def rebuild(self, using=None, batch_size=REBUILD_BATCH_SIZE):
+        """Полная перестройка индекса; возвращает число документов"""
+        connection = connections[using] if using else self._connection(write=True)
+        if connection.vendor != 'sqlite':
+            return 0
+        self.create_table(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        count = 0
+        last_id = 0
+        queryset = self.model._base_manager.using(connection.alias).order_by('id').values('id', *self.fields)
+        while True:
+            rows = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            # Пачка — одна транзакция: без нее каждая вставка фиксируется отдельно
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.executemany(f"INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)",
+                                   [(row['id'], f" {self.build_document(row)} ") for row in rows])
+            count += len(rows)
+        logger.info("Search index %s rebuilt with %s document(s)", self.table, count)
+        return count
+
+    def match(self, query):
+        """Условие для queryset: ID документов, подходящих под запрос; None, если искать нечего"""
+        words = normalize_text(query).split()
+        phone = normalize_phone(query)
+        if _PHONE_QUERY_RE.match(query.strip()) and len(phone) >= MIN_TRIGRAM_LENGTH:
+            # Телефон в индексе хранится одним словом из цифр; начало «8 916...» — то же, что «+7 916...»
+            if phone[0] == '8' and len(phone) >= 4:
+                phone = '7' + phone[1:]
+            words = [phone]
+        if not words:
+            return None
+
+        long_words = [word for word in words if len(word) >= MIN_TRIGRAM_LENGTH]
+        short_words = [word for word in words if len(word) < MIN_TRIGRAM_LENGTH]
+        conditions, params = [], []
+        if long_words:
+            conditions.append(f"{self.table} MATCH %s")
+            params.append(' '.join('"%s"' % word.replace('"', '""') for word in long_words))
+        for word in short_words:
+            # Короткие слова (номер дома) — целым словом; документ обрамлен пробелами
+            conditions.append("body LIKE %s ESCAPE '\\'")
+            params.append('%% %s %%' % word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+        sql = f"SELECT rowid FROM {self.table} WHERE {' AND '.join(conditions)}"
+        return Q(id__in=RawSQL(sql, params))
+
+    def search(self, queryset, query):
+        """Отбор объектов queryset по строке поиска"""
+        query = (query or '').strip()
+        if not query:
+            return queryset
+        if connections[queryset.db].vendor != 'sqlite':
+            words = query.split()
+            return queryset.filter(*[
+                reduce(or_, [Q(**{f'{field}__icontains': word}) for field in self.fallback_fields])
+                for word in words
+            ])
+        condition = self.match(query)
+        if condition is None:
+            return queryset.none()
+        if self.model is Order and query.lstrip('#').isdigit():
+            condition |= id_prefix(query.lstrip('#'))
+        return queryset.filter(condition)
+
+
+def id_prefix(digits):
+    """Заказы, ID которых начинается с цифр: диапазоны [p·10^k, (p+1)·10^k) по первичному ключу"""
+    if digits.startswith('0'):
+        return Q(pk__in=[])
+    prefix = int(digits)
+    return reduce(or_, [
+        Q(id__gte=prefix * 10 ** k, id__lt=(prefix + 1) * 10 ** k)
+        for k in range(max(MAX_ID_DIGITS - len(str(prefix)), 0) + 1)
+    ])
+
+
+def _order_document(row):
+    parts = [normalize_text(row['address']), normalize_text(row['user__username']),
+             normalize_text(row['guest_email'])]
+    phone = normalize_phone(row['guest_phone'])
+    if phone:
+        parts.append(phone)
+    return ' '.join(part for part in parts if part)
+
+
+def _review_document(row):
+    return ' '.join(part for part in (normalize_text(row['comment']), normalize_text(row['user__username']),
+                                      normalize_text(row['flower__name'])) if part)
+
+
+ORDER_INDEX = SearchIndex(
+    Order, 'orders_order_search', ('address', 'user__username', 'guest_email', 'guest_phone'), _order_document,
+    fallback_fields=('address', 'user__username', 'guest_email', 'guest_phone'),
+)
+REVIEW_INDEX = SearchIndex(
+    Review, 'orders_review_search', ('comment', 'user__username', 'flower__name'), _review_document,
+    fallback_fields=('comment', 'user__username', 'flower__name'),
+)
+INDEXES = (ORDER_INDEX, REVIEW_INDEX)
+# Поля, от которых зависит документ заказа: сохранение с update_fields без них индекс не трогает
+ORDER_INDEXED_FIELDS = {'address', 'user', 'user_id', 'guest_email', 'guest_phone'}
+REVIEW_INDEXED_FIELDS = {'comment', 'user', 'user_id', 'flower', 'flower_id'}
+
+
+def index_orders(ids):
+    ORDER_INDEX.update(ids)
+
+
+def index_reviews(ids):
+    REVIEW_INDEX.update(ids)
+
+
+def search_orders(query, queryset=None):
+    return ORDER_INDEX.search(Order.objects.all() if queryset is None else queryset, query)
+
+
+def search_reviews(query, queryset=None):
+    return REVIEW_INDEX.search(Review.objects.all() if queryset is None else queryset, query)
+
+
+def create_search_tables(using='default', **kwargs):
+    """После migrate: создать таблицы поиска и заполнить новые по существующим данным"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    for index in INDEXES:
+        if index.create_table(connection):
+            index.rebuild(using=using)
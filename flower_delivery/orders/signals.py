@@ -1,8 +1,65 @@
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Order
+
+from .bot_catalog import bump_catalog_snapshot
+from .caching import bump_flower_version
+from .cart import merge_session_cart
+from .models import Flower, Order, Rating, Review, TelegramPhoto
+from .search import ORDER_INDEXED_FIELDS, ORDER_INDEX, REVIEW_INDEXED_FIELDS, REVIEW_INDEX
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    if request is not None:
+        merge_session_cart(request, user)  # Корзина гостя переходит в корзину пользователя
+
+
+@receiver([post_save, post_delete], sender=Flower)
+def flower_changed(sender, instance, **kwargs):
+    bump_flower_version(instance.id)  # Страница букета пересчитается при следующем запросе
+
+
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Rating)
+def flower_feedback_changed(sender, instance, **kwargs):
+    bump_flower_version(instance.flower_id)
+
+
+@receiver([post_save, post_delete], sender=Flower)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Rating)
+@receiver([post_save, post_delete], sender=TelegramPhoto)
+def catalog_snapshot_changed(sender, **kwargs):
+    bump_catalog_snapshot()  # Бот перечитает каталог для inline-режима
+
+
+def _indexed_fields_changed(update_fields, indexed_fields):
+    return update_fields is None or bool(indexed_fields & set(update_fields))
+
 
 @receiver(post_save, sender=Order)
-def order_post_save(sender, instance, created, **kwargs):
-    if created:
-        instance.send_to_telegram()  # Отправка сообщения в Telegram
+def order_saved(sender, instance, update_fields=None, **kwargs):
+    if _indexed_fields_changed(update_fields, ORDER_INDEXED_FIELDS):
+        ORDER_INDEX.update([instance.id])  # Индекс поиска обновляется в той же транзакции
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, update_fields=None, **kwargs):
+    if _indexed_fields_changed(update_fields, REVIEW_INDEXED_FIELDS):
+        REVIEW_INDEX.update([instance.id])
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Review)
+def search_document_deleted(sender, instance, **kwargs):
+    (ORDER_INDEX if sender is Order else REVIEW_INDEX).remove([instance.id])
+
+
+@receiver(post_save, sender=User)
+def username_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login — переиндексация не нужна
+    if not created and _indexed_fields_changed(update_fields, {'username'}):
+        ORDER_INDEX.update(Order.objects.filter(user=instance).values_list('id', flat=True))
+        REVIEW_INDEX.update(Review.objects.filter(user=instance).values_list('id', flat=True))
@@ -0,0 +1,185 @@
+"""Статусы заказа: допустимые переходы, журнал и уведомления покупателей.
+
+Статус меняется только через ``transition_orders``: переход проверяется по
+``TRANSITIONS``, заказы обновляются одним UPDATE на каждый исходный статус,
+а записи журнала и уведомления добавляются через ``bulk_create``.
+Склад следует за статусом: при подтверждении резерв заказа становится
+постоянным (если резерв истек и букетов уже нет, заказ не подтверждается),
+при отмене на склад возвращаются и активные, и оплаченные резервы.
+Уведомления копятся в очереди и отправляются пачками
+(``send_status_notifications``), чтобы массовая смена статуса не
+отправляла письма по одному внутри запроса.
+
+Статус по номеру заказа чаще всего спрашивают в боте, поэтому он читается
+через кэш, а кэш сбрасывается после фиксации перехода.
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import get_connection, send_mass_mail
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderStatusEvent, StatusNotification
+from .stock import OutOfStock, commit_order_stock, release_order_stock
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+DELIVERED = 'delivered'
+CANCELED = 'canceled'
+
+# Из какого статуса в какие можно перейти
+TRANSITIONS = {
+    PENDING: {CONFIRMED, CANCELED},
+    CONFIRMED: {PENDING, DELIVERED, CANCELED},
+    DELIVERED: set(),
+    CANCELED: set(),
+}
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+STATUS_CACHE_TIMEOUT = 300
+NOTIFICATION_BATCH_SIZE = 100
+
+
+class InvalidTransition(Exception):
+    """Заказ нельзя перевести в запрошенный статус"""
+
+
+def _status_key(order_id):
+    return f"order:{order_id}:status"
+
+
+def transition_orders(order_ids, to_status, source, actor=None):
+    """Перевод заказов в статус ``to_status``.
+
+    Возвращает (id переведенных заказов, {id: текущий статус} для заказов,
+    которым такой переход не разрешен). Заказы, уже стоящие в ``to_status``,
+    пропускаются без записи в журнал.
+    """
+    if to_status not in TRANSITIONS:
+        raise InvalidTransition(f"Неизвестный статус: {to_status}")
+
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update().filter(id__in=list(order_ids)).values_list('id', 'status')
+        )
+        by_status = defaultdict(list)
+        rejected = {}
+        for order_id, status in current.items():
+            if status == to_status:
+                continue
+            if to_status in TRANSITIONS.get(status, ()):
+                by_status[status].append(order_id)
+            else:
+                rejected[order_id] = status
+
+        orders = Order.objects.select_related('cart').in_bulk([order_id for ids in by_status.values() for order_id in ids])
+        if to_status == CONFIRMED:
+            _commit_stock(orders, by_status, rejected)
+
+        now = timezone.now()
+        events = []
+        for from_status, ids in by_status.items():
+            Order.objects.filter(id__in=ids, status=from_status).update(status=to_status)
+            events.extend(
+                OrderStatusEvent(order_id=order_id, from_status=from_status, to_status=to_status,
+                                 source=source, actor=actor, created_at=now)
+                for order_id in ids
+            )
+        OrderStatusEvent.objects.bulk_create(events)
+        StatusNotification.objects.bulk_create([
+            StatusNotification(order_id=event.order_id, status=to_status, created_at=now) for event in events
+        ])
+
+        changed = [event.order_id for event in events]
+        if to_status == CANCELED:
+            # Отмененный заказ возвращает на склад и оплаченные букеты
+            for order_id in changed:
+                release_order_stock(orders[order_id], committed=True)
+        transaction.on_commit(lambda: cache.delete_many([_status_key(order_id) for order_id in changed]))
+
+    if changed:
+        logger.info("%s order(s) moved to %s by %s", len(changed), to_status, source)
+    if rejected:
+        logger.warning("Rejected transition to %s for orders %s", to_status, sorted(rejected))
+    return changed, rejected
+
+
+def _commit_stock(orders, by_status, rejected):
+    """Резерв подтверждаемых заказов становится постоянным; без букетов на складе заказ не подтверждается"""
+    for from_status, ids in by_status.items():
+        for order_id in list(ids):
+            try:
+                with transaction.atomic():
+                    commit_order_stock(orders[order_id])
+            except OutOfStock as e:
+                logger.warning("Order %s cannot be confirmed: %s", order_id, e)
+                ids.remove(order_id)
+                rejected[order_id] = from_status
+
+
+def transition_order(order, to_status, source, actor=None):
+    """Перевод одного заказа; недопустимый переход — ``InvalidTransition``"""
+    changed, rejected = transition_orders([order.id], to_status, source, actor)
+    if order.id in rejected:
+        raise InvalidTransition(
+            f"Заказ {order.id} в статусе «{STATUS_LABELS.get(rejected[order.id])}» "
+            f"нельзя перевести в «{STATUS_LABELS[to_status]}»."
+        )
+    order.status = to_status
+    return bool(changed)
+
+
+def get_order_status(order_id):
+    """Статус заказа по номеру (через кэш); None, если заказа нет"""
+    key = _status_key(order_id)
+    status = cache.get(key)
+    if status is None:
+        status = Order.objects.filter(id=order_id).values_list('status', flat=True).first()
+        if status is not None:
+            cache.set(key, status, STATUS_CACHE_TIMEOUT)
+    return status
+
+
+def _recipient(order):
+    if order.user_id and order.user.email:
+        return order.user.email
+    return order.guest_email
+
+
+def send_status_notifications(batch_size=NOTIFICATION_BATCH_SIZE):
+    """Отправка накопленных уведомлений пачками через одно соединение с почтовым сервером"""
+    sent = 0
+    connection = get_connection()
+    while True:
+        batch = list(
+            StatusNotification.objects.filter(sent_at=None).select_related('order', 'order__user')
+            .order_by('id')[:batch_size]
+        )
+        if not batch:
+            break
+
+        messages = []
+        for notification in batch:
+            recipient = _recipient(notification.order)
+            if recipient:
+                messages.append((
+                    f"Заказ №{notification.order_id}: {STATUS_LABELS[notification.status].lower()}",
+                    f"Статус вашего заказа №{notification.order_id}: {STATUS_LABELS[notification.status]}.",
+                    settings.DEFAULT_FROM_EMAIL,
+                    [recipient],
+                ))
+        if messages:
+            send_mass_mail(messages, fail_silently=False, connection=connection)
+
+        StatusNotification.objects.filter(id__in=[notification.id for notification in batch]).update(
+            sent_at=timezone.now())
+        sent += len(messages)
+
+    if sent:
+        logger.info("Sent %s status notification(s)", sent)
+    return sent
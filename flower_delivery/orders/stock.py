@@ -0,0 +1,180 @@
+"""Складские остатки и резервирование букетов под заказы.
+
+Списание идет только условным ``UPDATE ... WHERE stock >= n``: проверка и
+уменьшение остатка выполняются одной командой, поэтому параллельные
+оформления заказа не могут продать больше, чем есть на складе.
+
+Букеты с пустым остатком (``stock is None``) на складе не учитываются:
+резерв для них всегда успешен, а остаток остается пустым. Учет
+начинается с первого поступления (``restock``).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Flower, StockReservation
+
+logger = logging.getLogger(__name__)
+
+# Сколько минут держится резерв неоплаченного заказа; дольше окна оплаты (PAYMENT_TIMEOUT_MINUTES)
+DEFAULT_RESERVATION_MINUTES = 35
+
+
+class OutOfStock(Exception):
+    """Недостаточно букетов на складе"""
+
+    def __init__(self, flower_id, requested):
+        self.flower_id = flower_id
+        self.requested = requested
+        super().__init__(f"Flower {flower_id}: not enough stock for {requested}")
+
+
+def _reservation_timeout():
+    return timedelta(minutes=getattr(settings, 'RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES))
+
+
+def _quantities(items):
+    """Сводка количества по букетам: {flower_id: quantity}"""
+    quantities = {}
+    for flower_id, quantity in items:
+        quantities[flower_id] = quantities.get(flower_id, 0) + quantity
+    return quantities
+
+
+def reserve_stock(order, items, status=StockReservation.ACTIVE):
+    """Резервирование букетов под заказ.
+
+    ``items`` — пары (flower_id, quantity). Все позиции резервируются в одной
+    транзакции; если хотя бы одной не хватает, ничего не списывается и
+    выбрасывается ``OutOfStock``.
+    """
+    quantities = _quantities(items)
+    expires_at = timezone.now() + _reservation_timeout()
+
+    with transaction.atomic():
+        # Фиксированный порядок обновления исключает взаимные блокировки
+        for flower_id in sorted(quantities):
+            quantity = quantities[flower_id]
+            # NULL - n остается NULL: у букетов без учета остаток не появляется
+            updated = Flower.objects.filter(Q(stock__isnull=True) | Q(stock__gte=quantity), id=flower_id).update(
+                stock=F('stock') - quantity)
+            if not updated:
+                raise OutOfStock(flower_id, quantity)
+
+        StockReservation.objects.bulk_create([
+            StockReservation(order=order, flower_id=flower_id, quantity=quantity, status=status, expires_at=expires_at)
+            for flower_id, quantity in quantities.items()
+        ])
+
+    logger.debug("Reserved stock for order %s: %s", order.id, quantities)
+
+
+def reserve_cart(order, cart, status=StockReservation.ACTIVE):
+    """Резервирование содержимого корзины под заказ"""
+    reserve_stock(order, cart.items.values_list('flower_id', 'quantity'), status=status)
+
+
+def _release(reservations, statuses=(StockReservation.ACTIVE,)):
+    """Возврат на склад перечисленных резервов, если они еще в одном из ``statuses``"""
+    released = 0
+    for reservation in reservations:
+        with transaction.atomic():
+            # Условный переход статуса гарантирует, что резерв вернется на склад ровно один раз
+            if StockReservation.objects.filter(id=reservation.id, status__in=statuses).update(
+                    status=StockReservation.RELEASED):
+                Flower.objects.filter(id=reservation.flower_id).update(stock=F('stock') + reservation.quantity)
+                released += 1
+    return released
+
+
+def release_order_stock(order, committed=False):
+    """Снятие резерва заказа (неуспешная оплата); при отмене с ``committed`` возвращаются и оплаченные букеты"""
+    statuses = (StockReservation.ACTIVE, StockReservation.COMMITTED) if committed else (StockReservation.ACTIVE,)
+    released = _release(StockReservation.objects.filter(order=order, status__in=statuses), statuses)
+    if released:
+        logger.info("Released %s reservation(s) of order %s", released, order.id)
+    return released
+
+
+def extend_order_reservation(order):
+    """Продление резерва на время оплаты; снятый резерв берется заново (``OutOfStock``, если букетов нет)"""
+    with transaction.atomic():
+        extended = StockReservation.objects.filter(order=order, status=StockReservation.ACTIVE).update(
+            expires_at=timezone.now() + _reservation_timeout())
+        if extended or StockReservation.objects.filter(order=order, status=StockReservation.COMMITTED).exists():
+            return
+        if order.cart:
+            reserve_cart(order, order.cart)
+
+
+def commit_order_stock(order):
+    """Перевод резерва в оплаченный. Истекший резерв пробуем взять заново"""
+    with transaction.atomic():
+        committed = StockReservation.objects.filter(order=order, status=StockReservation.ACTIVE).update(
+            status=StockReservation.COMMITTED)
+        if committed or StockReservation.objects.filter(order=order, status=StockReservation.COMMITTED).exists():
+            return
+        if order.cart:
+            reserve_stock(order, order.cart.items.values_list('flower_id', 'quantity'),
+                          status=StockReservation.COMMITTED)
+
+
+def release_expired_reservations(now=None, batch_size=500):
+    """Снятие резервов неоплаченных заказов с истекшим сроком"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(status=StockReservation.ACTIVE, expires_at__lt=now)
+            .only('id', 'flower_id', 'quantity')[:batch_size]
+        )
+        if not batch:
+            break
+        released += _release(batch)
+    if released:
+        logger.info("Released %s expired reservation(s)", released)
+    return released
+
+
+def restock(flower_id, quantity):
+    """Поступление букетов на склад; у букета без учета остатков учет начинается с этой партии"""
+    return Flower.objects.filter(id=flower_id).update(
+        stock_total=Coalesce(F('stock_total'), Value(0)) + quantity,
+        stock=Coalesce(F('stock'), Value(0)) + quantity,
+    )
+
+
+def reconcile_stock():
+    """Пересчет доступного остатка из поступлений и резервов одной командой UPDATE (только букеты с учетом)"""
+    held = (
+        StockReservation.objects
+        .filter(flower=OuterRef('pk'), status__in=[StockReservation.ACTIVE, StockReservation.COMMITTED])
+        .values('flower')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    updated = Flower.objects.filter(stock_total__isnull=False).update(
+        stock=Greatest(F('stock_total') - Coalesce(Subquery(held), Value(0)), Value(0))
+    )
+    logger.info("Reconciled stock for %s flower(s)", updated)
+    return updated
+
+
+def untrack_empty_stock():
+    """Букеты без поступлений и резервов переводятся в режим без учета остатков.
+
+    Для баз, где остатки появились с нулем по умолчанию: такие букеты
+    нельзя было заказать, хотя склад по ним никогда не вели.
+    """
+    updated = (
+        Flower.objects.filter(stock_total=0, stock=0)
+        .exclude(id__in=StockReservation.objects.values('flower_id'))
+        .update(stock_total=None, stock=None)
+    )
+    logger.info("Stock tracking disabled for %s flower(s) without receipts", updated)
+    return updated
@@ -0,0 +1,248 @@
+"""Регулярные заказы по подписке.
+
+Планировщик (``manage.py generate_subscription_orders`` по расписанию)
+создает заказы на все доставки подписок, попадающие в ближайшее окно.
+Подписки обрабатываются пачками: на пачку один запрос позиций с текущими
+ценами и по одному ``bulk_create`` в каждую таблицу — корзины, заказы,
+позиции корзин, история, журнал статусов и очередь уведомлений
+(отправляет ``send_status_notifications``); индекс поиска заказов
+обновляется одной пачкой вслед за ними.
+
+Заказ подписки уникален по (подписка, период), а сдвиг
+``next_delivery_date`` записывается в той же транзакции, что и заказы,
+поэтому перезапуск после сбоя или параллельный запуск не создают дублей.
+
+Заказы подписок сразу подтверждены (корпоративные покупатели платят по
+счету), поэтому букеты под них сразу списываются со склада оплаченным
+резервом (``StockReservation.COMMITTED``) — тем же условным
+``UPDATE ... WHERE stock >= n``, одним на букет для всей пачки. Остаток
+распределяется по доставкам в порядке дат; доставка, на которую букетов не
+хватило, не создается, попадает в отчет (``unfulfilled``) и повторяется при
+следующем запуске, пока ее дата в окне.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import (Cart, CartItem, Flower, Order, OrderHistory, OrderStatusEvent, StatusNotification,
+                     StockReservation, Subscription, SubscriptionItem)
+from .search import index_orders
+from .status import CONFIRMED, PENDING
+from .stock import OutOfStock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_DAYS = 7
+DEFAULT_BATCH_SIZE = 1000
+SOURCE = 'subscription'
+
+
+class SubscriptionError(Exception):
+    """Подписку нельзя оформить; текст исключения показывается пользователю"""
+
+
+def subscribe_order(order, interval_days=7, first_date=None):
+    """Подписка по образцу заказа: тот же набор букетов, адрес и время"""
+    if order.user_id is None:
+        raise SubscriptionError("Подписку можно оформить только на заказ зарегистрированного покупателя.")
+    if interval_days < 1:
+        raise SubscriptionError("Интервал подписки должен быть не меньше одного дня.")
+
+    items = list(
+        OrderHistory.objects.filter(order=order).values('flower_id').annotate(quantity=Sum('quantity')).order_by()
+    )
+    if not items and order.flower_id:
+        items = [{'flower_id': order.flower_id, 'quantity': order.quantity}]
+    if not items:
+        raise SubscriptionError(f"В заказе {order.id} нет букетов.")
+
+    with transaction.atomic():
+        subscription = Subscription.objects.create(
+            user_id=order.user_id,
+            address=order.address,
+            delivery_time=order.delivery_time,
+            comment=order.comment,
+            interval_days=interval_days,
+            next_delivery_date=first_date or order.delivery_date + timedelta(days=interval_days),
+        )
+        SubscriptionItem.objects.bulk_create([
+            SubscriptionItem(subscription=subscription, flower_id=item['flower_id'], quantity=item['quantity'])
+            for item in items
+        ])
+
+    logger.info("Subscription %s created from order %s", subscription.id, order.id)
+    return subscription
+
+
+def due_dates(subscription, today, horizon):
+    """Даты доставок подписки в окне [today, horizon] и следующая дата после окна.
+
+    Пропущенные доставки в прошлом (планировщик не запускался) не создаются.
+    """
+    step = timedelta(days=subscription.interval_days)
+    day = subscription.next_delivery_date
+    if day < today:
+        day += step * -(-(today - day).days // subscription.interval_days)
+    dates = []
+    while day <= horizon:
+        dates.append(day)
+        day += step
+    return dates, day
+
+
+def generate_subscription_orders(today=None, window_days=DEFAULT_WINDOW_DAYS, batch_size=DEFAULT_BATCH_SIZE):
+    """Создание заказов по всем подпискам с доставкой в ближайшие ``window_days`` дней.
+
+    Возвращает {'created': число заказов, 'unfulfilled': [(ID подписки, дата
+    доставки)]} — доставки, на которые не хватило букетов на складе.
+    """
+    today = today or timezone.localdate()
+    horizon = today + timedelta(days=window_days)
+    created = 0
+    unfulfilled = []
+    last_id = 0
+    while True:
+        batch = list(
+            Subscription.objects.filter(is_active=True, next_delivery_date__lte=horizon, id__gt=last_id)
+            .order_by('id')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].id
+        try:
+            batch_created, batch_unfulfilled = _materialize(batch, today, horizon)
+        except (IntegrityError, OutOfStock):
+            # Параллельный запуск или покупатели успели изменить заказы или остатки — пересчитываем пачку
+            logger.warning("Subscription batch up to %s conflicted with another run; retrying", last_id)
+            for subscription in batch:
+                subscription.refresh_from_db(fields=['next_delivery_date'])
+            batch_created, batch_unfulfilled = _materialize(batch, today, horizon)
+        created += batch_created
+        unfulfilled.extend(batch_unfulfilled)
+
+    if unfulfilled:
+        logger.warning("%s subscription delivery(ies) up to %s not created: out of stock", len(unfulfilled), horizon)
+    logger.info("Generated %s subscription order(s) up to %s", created, horizon)
+    return {'created': created, 'unfulfilled': unfulfilled}
+
+
+def _item_quantities(subscription_items):
+    quantities = defaultdict(int)
+    for item in subscription_items:
+        quantities[item.flower_id] += item.quantity
+    return quantities
+
+
+def _allocate_stock(plan, items):
+    """Распределение остатка по доставкам в порядке дат: (выполнимые, невыполнимые, {flower_id: списать})"""
+    flower_ids = {item.flower_id for subscription, _ in plan for item in items[subscription.id]}
+    available = dict(Flower.objects.filter(id__in=flower_ids).values_list('id', 'stock'))
+    fulfilled, unfulfilled, needed = [], [], defaultdict(int)
+    for subscription, day in sorted(plan, key=lambda entry: (entry[1], entry[0].id)):
+        quantities = _item_quantities(items[subscription.id])
+        # Пустой остаток (None) — склад по букету не ведется
+        if all(available[flower_id] is None or available[flower_id] >= quantity
+               for flower_id, quantity in quantities.items()):
+            for flower_id, quantity in quantities.items():
+                if available[flower_id] is not None:
+                    available[flower_id] -= quantity
+                needed[flower_id] += quantity
+            fulfilled.append((subscription, day))
+        else:
+            unfulfilled.append((subscription, day))
+    return fulfilled, unfulfilled, needed
+
+
+def _materialize(subscriptions, today, horizon):
+    items = defaultdict(list)
+    for item in SubscriptionItem.objects.filter(subscription__in=subscriptions).select_related('flower'):
+        items[item.subscription_id].append(item)
+
+    plan = []
+    for subscription in subscriptions:
+        dates, subscription.next_delivery_date = due_dates(subscription, today, horizon)
+        if items[subscription.id]:
+            plan.extend((subscription, day) for day in dates)
+
+    with transaction.atomic():
+        existing = set(
+            Order.objects.filter(subscription__in=subscriptions, subscription_period__gte=today)
+            .values_list('subscription_id', 'subscription_period')
+        )
+        plan = [(subscription, day) for subscription, day in plan if (subscription.id, day) not in existing]
+        plan, unfulfilled, needed = _allocate_stock(plan, items)
+        # Одно условное списание на букет за всю пачку; если остаток успели уменьшить — пачка пересчитывается
+        for flower_id in sorted(needed):
+            if not Flower.objects.filter(Q(stock__isnull=True) | Q(stock__gte=needed[flower_id]), id=flower_id).update(
+                    stock=F('stock') - needed[flower_id]):
+                raise OutOfStock(flower_id, needed[flower_id])
+        now = timezone.now()
+
+        carts = Cart.objects.bulk_create([Cart(is_completed=True, created_at=now) for _ in plan])
+        orders = Order.objects.bulk_create([
+            Order(
+                user_id=subscription.user_id,
+                cart=cart,
+                flower=items[subscription.id][0].flower,
+                quantity=sum(item.quantity for item in items[subscription.id]),
+                delivery_date=day,
+                delivery_time=subscription.delivery_time,
+                address=subscription.address,
+                comment=subscription.comment,
+                status=CONFIRMED,
+                total_price=sum(item.flower.price * item.quantity for item in items[subscription.id]),
+                created_at=now,
+                subscription=subscription,
+                subscription_period=day,
+            )
+            for cart, (subscription, day) in zip(carts, plan)
+        ])
+
+        cart_items, history = [], []
+        for order in orders:
+            for item in items[order.subscription_id]:
+                cart_items.append(CartItem(cart_id=order.cart_id, flower_id=item.flower_id, quantity=item.quantity,
+                                           user_id=order.user_id))
+                history.append(OrderHistory(
+                    user_id=order.user_id,
+                    order=order,
+                    flower_id=item.flower_id,
+                    quantity=item.quantity,
+                    delivery_date=order.delivery_date,
+                    delivery_time=order.delivery_time,
+                    delivery_address=order.address,
+                    comment=order.comment,
+                    cost=item.flower.price * item.quantity,
+                ))
+        CartItem.objects.bulk_create(cart_items)
+        OrderHistory.objects.bulk_create(history)
+        StockReservation.objects.bulk_create([
+            StockReservation(order=order, flower_id=flower_id, quantity=quantity,
+                             status=StockReservation.COMMITTED, expires_at=now)
+            for order in orders
+            for flower_id, quantity in _item_quantities(items[order.subscription_id]).items()
+        ])
+        OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(order=order, from_status=PENDING, to_status=CONFIRMED, source=SOURCE, created_at=now)
+            for order in orders
+        ])
+        StatusNotification.objects.bulk_create([
+            StatusNotification(order=order, status=CONFIRMED, created_at=now) for order in orders
+        ])
+        # bulk_create не вызывает сигналы — индекс поиска обновляется явно
+        index_orders([order.id for order in orders])
+        # Невыполненная доставка остается следующей: ее повторит следующий запуск
+        for subscription, day in unfulfilled:
+            subscription.next_delivery_date = min(subscription.next_delivery_date, day)
+        # У подписок пачки обычно несколько разных следующих дат — по одному UPDATE на дату вместо CASE на строку
+        by_next_date = defaultdict(list)
+        for subscription in subscriptions:
+            by_next_date[subscription.next_delivery_date].append(subscription.id)
+        for next_date, ids in by_next_date.items():
+            Subscription.objects.filter(id__in=ids).update(next_delivery_date=next_date)
+
+    return len(orders), [(subscription.id, day) for subscription, day in unfulfilled]
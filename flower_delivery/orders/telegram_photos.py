@@ -0,0 +1,188 @@
+"""Фотографии букетов в боте без повторной загрузки файлов.
+
+Оригиналы в ``media/`` весят до мегабайта, и отправлять их в каждом
+сообщении — значит каждый раз заново загружать файл в Telegram. Вместо
+этого букет один раз загружается уменьшенной копией (``large`` из импорта
+каталога, если она есть, иначе копия строится из оригинала), а ``file_id``,
+который вернул Telegram, сохраняется в ``TelegramPhoto``. Дальше фото
+отправляется по ``file_id`` — это строка в запросе вместо файла.
+
+Запись привязана к хэшу содержимого изображения: после замены картинки
+хэш другой, сохраненный ``file_id`` не подходит, и фото загружается заново
+(старая запись при этом удаляется). ``file_id`` действителен только для
+загрузившего его бота, поэтому в записи хранится и ID бота.
+
+Каталог отправляется альбомами по ``MEDIA_GROUP_SIZE`` фото; одновременно
+отправляется не больше ``concurrency`` альбомов, чтобы не упереться в
+ограничения Bot API.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import BufferedInputFile, InputMediaPhoto
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .catalog_import import RENDITIONS, rendition_name
+from .models import Flower, TelegramPhoto
+
+logger = logging.getLogger(__name__)
+
+PHOTO_RENDITION = 'large'
+PHOTO_QUALITY = 85
+# Меняется вместе с параметрами копии: старые file_id тогда загружаются заново
+PHOTO_VERSION = f"{PHOTO_RENDITION}-{RENDITIONS[PHOTO_RENDITION][0]}x{RENDITIONS[PHOTO_RENDITION][1]}-q{PHOTO_QUALITY}"
+# Больше фото в одном альбоме Bot API не принимает
+MEDIA_GROUP_SIZE = 10
+DEFAULT_CONCURRENCY = 3
+MAX_ATTEMPTS = 3
+
+# Хэши изображений по (имя, размер, время изменения): файл читается один раз, пока не изменится
+_digests = {}
+
+
+def image_digest(name):
+    """Хэш содержимого изображения вместе с версией копии; None, если файла нет"""
+    if not name:
+        return None
+    try:
+        key = (name, default_storage.size(name), default_storage.get_modified_time(name))
+    except (OSError, NotImplementedError):
+        return None
+    if key not in _digests:
+        digest = hashlib.sha1(PHOTO_VERSION.encode())
+        with default_storage.open(name) as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+
+def render_photo(name):
+    """JPEG-копия изображения для Telegram: готовая из импорта или построенная из оригинала"""
+    prepared = rendition_name(name, PHOTO_RENDITION)
+    if default_storage.exists(prepared):
+        with default_storage.open(prepared) as f:
+            return f.read()
+    with default_storage.open(name) as f, Image.open(f) as image:
+        copy = image.convert('RGB')
+        copy.thumbnail(RENDITIONS[PHOTO_RENDITION])
+        buffer = BytesIO()
+        copy.save(buffer, format='JPEG', quality=PHOTO_QUALITY)
+    return buffer.getvalue()
+
+
+def caption(flower):
+    return f"{flower['name']} — {flower['price']} ₽ (ID {flower['id']})"
+
+
+@sync_to_async
+def load_catalog(bot_id, flower_ids=None):
+    """Букеты для отправки: поля, хэш изображения и сохраненный file_id (None — нужно загрузить)"""
+    flowers = Flower.objects.order_by('name', 'id')
+    if flower_ids is not None:
+        flowers = flowers.filter(id__in=flower_ids)
+    entries = list(flowers.values('id', 'name', 'price', 'image'))
+    known = {
+        (photo['flower_id'], photo['image_hash']): photo['file_id']
+        for photo in TelegramPhoto.objects.filter(bot_id=bot_id, flower_id__in=[entry['id'] for entry in entries])
+        .values('flower_id', 'image_hash', 'file_id')
+    }
+    for entry in entries:
+        entry['digest'] = image_digest(entry['image'])
+        entry['file_id'] = known.get((entry['id'], entry['digest']))
+    return entries
+
+
+@sync_to_async
+def remember_photos(bot_id, uploaded):
+    """Сохранение file_id загруженных фото; записи для прежних версий изображения удаляются"""
+    for entry, file_id in uploaded:
+        TelegramPhoto.objects.update_or_create(
+            flower_id=entry['id'], bot_id=bot_id, image_hash=entry['digest'], defaults={'file_id': file_id},
+        )
+        TelegramPhoto.objects.filter(flower_id=entry['id'], bot_id=bot_id).exclude(image_hash=entry['digest']).delete()
+
+
+@sync_to_async
+def forget_photos(bot_id, entries):
+    TelegramPhoto.objects.filter(bot_id=bot_id, flower_id__in=[entry['id'] for entry in entries]).delete()
+
+
+async def _media(entry):
+    if entry['file_id']:
+        return InputMediaPhoto(media=entry['file_id'], caption=caption(entry))
+    # Сжатие картинки — работа процессора, не для потока с ORM
+    data = await sync_to_async(render_photo, thread_sensitive=False)(entry['image'])
+    filename = os.path.splitext(os.path.basename(entry['image']))[0] + '.jpg'
+    return InputMediaPhoto(media=BufferedInputFile(data, filename=filename), caption=caption(entry))
+
+
+async def send_photo_group(bot, chat_id, entries):
+    """Отправка до MEDIA_GROUP_SIZE фото одним альбомом; возвращает (загружено, по file_id)"""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        media = [await _media(entry) for entry in entries]
+        try:
+            if len(media) == 1:
+                messages = [await bot.send_photo(chat_id, photo=media[0].media, caption=media[0].caption)]
+            else:
+                messages = await bot.send_media_group(chat_id, media=media)
+        except TelegramRetryAfter as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.warning("Telegram flood control, retrying album in %ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramBadRequest as e:
+            cached = [entry for entry in entries if entry['file_id']]
+            if not cached or attempt == MAX_ATTEMPTS:
+                raise
+            # Telegram не узнал file_id (например, токен бота сменился): загружаем эти фото заново
+            logger.warning("Cached Telegram file_id rejected, re-uploading %s photo(s): %s", len(cached), e)
+            await forget_photos(bot.id, cached)
+            for entry in cached:
+                entry['file_id'] = None
+            continue
+        break
+
+    uploaded = [(entry, message.photo[-1].file_id) for entry, message in zip(entries, messages)
+                if not entry['file_id']]
+    if uploaded:
+        await remember_photos(bot.id, uploaded)
+    return len(uploaded), len(entries) - len(uploaded)
+
+
+async def send_catalog(bot, chat_id, flower_ids=None, concurrency=DEFAULT_CONCURRENCY):
+    """Каталог альбомами с фото; букеты без изображения — одним текстовым сообщением.
+
+    Альбомы отправляются параллельно (не больше ``concurrency`` сразу), поэтому
+    их порядок в чате может не совпадать с порядком каталога.
+    Возвращает {'albums', 'uploaded', 'reused', 'without_photo'}.
+    """
+    entries = await load_catalog(bot.id, flower_ids)
+    with_photo = [entry for entry in entries if entry['digest']]
+    without_photo = [entry for entry in entries if not entry['digest']]
+    groups = [with_photo[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(with_photo), MEDIA_GROUP_SIZE)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(group):
+        async with semaphore:
+            return await send_photo_group(bot, chat_id, group)
+
+    results = await asyncio.gather(*(send(group) for group in groups))
+    if without_photo:
+        await bot.send_message(chat_id, "\n".join(caption(entry) for entry in without_photo))
+
+    stats = {
+        'albums': len(groups),
+        'uploaded': sum(uploaded for uploaded, _ in results),
+        'reused': sum(reused for _, reused in results),
+        'without_photo': len(without_photo),
+    }
+    logger.info("Catalog sent to chat %s: %s", chat_id, stats)
+    return stats
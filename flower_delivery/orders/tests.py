@@ -1,7 +1,70 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import importlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time as time_module
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import InlineQueryResultArticle, InlineQueryResultCachedPhoto
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Flower, Review, Rating
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import engines
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .models import (Flower, Review, Rating, Order, GeocodeCache, StockReservation, Cart, CartItem,
+                     OrderHistory, OrderHistoryArchive, FlowerRecommendation,
+                     OrderStatusEvent, StatusNotification, Payment, DigestDelivery, Report,
+                     Subscription, SubscriptionItem, TelegramPhoto, CatalogVersion)
+from .assets import minify_css, serve as serve_static
+from .bot_catalog import add_to_telegram_cart, catalog, checkout_telegram_cart, telegram_cart
+from .cart import CartError
+from .caching import flower_detail_key, get_or_compute, stats as cache_stats
+from .catalog_import import import_catalog, read_catalog, rendition_name
+from .digest import send_digests
+from .forecast import forecast_demand, format_forecast
+from .history import archive_order_history, history_page
+from .log import BackgroundHandler, JsonFormatter, SamplingFilter, redact, request_id_var
+from .payments import FakePaymentProvider, check_payment_settings, expire_unpaid_orders, reconcile_payments
+from .ratelimit import reset as reset_rate_limits
+from .replica import PIN_COOKIE, REPLICA, ReplicaMiddleware, ReplicaRouter, read_from_replica, snapshot_replica
+from .recommendations import (ALSO, TOGETHER, build_recommendations, get_recommendations,
+                              update_recommendations)
+from .reorder import reorder
+from .routing import plan_routes, time_window
+from .search import normalize_phone, normalize_text, search_orders, search_reviews
+from .subscriptions import due_dates, generate_subscription_orders, subscribe_order
+from .status import InvalidTransition, get_order_status, send_status_notifications, transition_order, transition_orders
+from .stock import (OutOfStock, reserve_cart, reserve_stock, release_order_stock, release_expired_reservations,
+                    reconcile_stock, restock)
+from .telegram_photos import send_catalog
 
 
 class ReviewModelTest(TestCase):
@@ -66,3 +129,1405 @@ class ReviewAndRatingViewsTest(TestCase):
 
         self.assertEqual(response.status_code, 302)  # Перенаправление после успешной отправки
         self.assertTrue(Rating.objects.filter(rating=5).exists())
+
+class RoutePlanningTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        addresses = [f"Москва, ул. Цветочная, д. {n}" for n in range(10)]
+        for n, address in enumerate(addresses):
+            Order.objects.create(
+                user=self.user,
+                delivery_date=date(2024, 2, 14),
+                delivery_time=time(10 + (n % 2) * 4, 30),
+                address=address,
+                status='confirmed',
+            )
+        # Неподтвержденный заказ в маршруты не попадает
+        Order.objects.create(
+            user=self.user,
+            delivery_date=date(2024, 2, 14),
+            delivery_time=time(10, 0),
+            address="Москва, ул. Садовая, д. 1",
+        )
+
+    def test_batches_respect_windows_and_capacity(self):
+        manifests = plan_routes(date(2024, 2, 14), capacity=3)
+
+        stops = [order for manifest in manifests for order in manifest['stops']]
+        self.assertEqual(len(stops), 10)
+        self.assertEqual(len({order.id for order in stops}), 10)
+        for manifest in manifests:
+            self.assertLessEqual(len(manifest['stops']), 3)
+            windows = {time_window(order.delivery_time, 2) for order in manifest['stops']}
+            self.assertEqual(windows, {manifest['window']})
+
+    def test_geocodes_are_cached(self):
+        plan_routes(date(2024, 2, 14))
+        self.assertEqual(GeocodeCache.objects.count(), 10)
+
+        # Повторное планирование не обращается к геокодеру
+        class FailingGeocoder:
+            source = 'test'
+
+            def geocode(self, address):
+                raise AssertionError("geocoder should not be called")
+
+        plan_routes(date(2024, 2, 14), geocoder=FailingGeocoder())
+
+
+class StockReservationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100.0, description="Красная роза",
+                                            image="path/to/image", stock_total=5, stock=5)
+
+    def create_order(self):
+        return Order.objects.create(user=self.user, delivery_date=date(2024, 3, 8),
+                                    delivery_time=time(12, 0), address="Москва, ул. Тверская, д. 1")
+
+    def test_parallel_checkouts_never_oversell(self):
+        orders = [self.create_order() for _ in range(20)]
+        barrier = threading.Barrier(len(orders))
+        results = []
+
+        def checkout(order):
+            try:
+                barrier.wait()
+                reserve_stock(order, [(self.flower.id, 1)])
+                results.append(True)
+            except OutOfStock:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.flower.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(self.flower.stock, 0)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.ACTIVE).count(), 5)
+
+    def test_release_and_reconcile(self):
+        order = self.create_order()
+        reserve_stock(order, [(self.flower.id, 3)])
+        self.assertEqual(release_order_stock(order), 1)
+        self.assertEqual(release_order_stock(order), 0)  # Повторное снятие не возвращает букеты дважды
+        self.flower.refresh_from_db()
+        self.assertEqual(self.flower.stock, 5)
+
+        reserve_stock(self.create_order(), [(self.flower.id, 2)])
+        Flower.objects.filter(id=self.flower.id).update(stock=100)  # Рассинхронизация счетчика
+        reconcile_stock()
+        self.flower.refresh_from_db()
+        self.assertEqual(self.flower.stock, 3)
+
+    def test_expired_reservations_are_released(self):
+        reserve_stock(self.create_order(), [(self.flower.id, 4)])
+        with self.assertRaises(OutOfStock):
+            reserve_stock(self.create_order(), [(self.flower.id, 2)])
+
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(release_expired_reservations(), 1)
+        self.flower.refresh_from_db()
+        self.assertEqual(self.flower.stock, 5)
+
+    def test_untracked_stock_is_unlimited(self):
+        untracked = Flower.objects.create(name="Тюльпан", price=50, description="Тюльпан", image="path/to/image")
+        reserve_stock(self.create_order(), [(untracked.id, 100)])
+        untracked.refresh_from_db()
+        self.assertIsNone(untracked.stock)
+
+        legacy = Flower.objects.create(name="Пион", price=80, description="Пион", image="path/to/image",
+                                       stock_total=0, stock=0)
+        call_command('untrack_stock', stdout=io.StringIO())
+        legacy.refresh_from_db()
+        self.assertIsNone(legacy.stock)
+        self.flower.refresh_from_db()
+        self.assertEqual(self.flower.stock, 5)
+
+        restock(untracked.id, 3)
+        untracked.refresh_from_db()
+        self.assertEqual((untracked.stock_total, untracked.stock), (3, 3))
+
+
+class CartApiTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100.0, description="Красная роза",
+                                            image="path/to/image", stock_total=10, stock=10)
+        self.client.login(username='testuser', password='password123')
+
+    def post(self, name, data):
+        return self.client.post(reverse(name), data, content_type='application/json')
+
+    def test_add_and_set_quantity(self):
+        response = self.post('cart_api_add', {'flower_id': self.flower.id, 'version': 0})
+        self.assertEqual(response.status_code, 200)
+        cart = response.json()['cart']
+        self.assertEqual(cart['total_items'], 1)
+
+        response = self.post('cart_api_set', {'flower_id': self.flower.id, 'quantity': 3, 'version': cart['version']})
+        self.assertEqual(response.json()['cart']['total_items'], 3)
+        self.assertEqual(response.json()['cart']['total_price'], '300.00')
+
+    def test_stale_version_is_rejected(self):
+        self.post('cart_api_add', {'flower_id': self.flower.id, 'version': 0})
+        # Повторный клик с той же версией не меняет количество
+        response = self.post('cart_api_add', {'flower_id': self.flower.id, 'version': 0})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['cart']['total_items'], 1)
+
+    def test_cannot_remove_foreign_item(self):
+        other = User.objects.create_user(username='other', password='password123')
+        foreign_item = CartItem.objects.create(cart=Cart.objects.create(user=other), flower=self.flower)
+
+        response = self.post('cart_api_remove', {'item_id': foreign_item.id, 'version': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('remove_from_cart', args=[foreign_item.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(CartItem.objects.filter(id=foreign_item.id).exists())
+
+
+class OrderHistoryTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100.0, description="Красная роза", image="path/to/image")
+        OrderHistory.objects.bulk_create([
+            OrderHistory(user=self.user, flower=self.flower, delivery_date=date(2024, 3, 8),
+                         delivery_time=time(12, 0), delivery_address="Москва", cost=100)
+            for _ in range(25)
+        ])
+
+    def test_keyset_pages_cover_history_once(self):
+        rows = OrderHistory.objects.filter(user=self.user)
+        first, cursor = history_page(rows, page_size=10)
+        second, cursor = history_page(rows, cursor=cursor, page_size=10)
+        third, cursor = history_page(rows, cursor=cursor, page_size=10)
+
+        ids = [row.id for row in first + second + third]
+        self.assertEqual(len(third), 5)
+        self.assertIsNone(cursor)
+        self.assertEqual(sorted(ids), sorted(rows.values_list('id', flat=True)))
+
+    def test_archive_moves_old_rows(self):
+        OrderHistory.objects.filter(id__in=OrderHistory.objects.values('id')[:15]).update(
+            completed_at=timezone.now() - timedelta(days=400))
+
+        self.assertEqual(archive_order_history(batch_size=4), 15)
+        self.assertEqual(OrderHistory.objects.count(), 10)
+        self.assertEqual(OrderHistoryArchive.objects.filter(user=self.user).count(), 15)
+
+    def test_archive_keeps_quantity_and_order(self):
+        order = Order.objects.create(user=self.user, delivery_date=date(2024, 3, 8), delivery_time=time(12, 0),
+                                     address="Москва")
+        OrderHistory.objects.update(order=order, quantity=3, completed_at=timezone.now() - timedelta(days=400))
+
+        archive_order_history()
+        self.assertEqual(set(OrderHistoryArchive.objects.values_list('order_id', 'quantity')), {(order.id, 3)})
+
+
+class ReorderTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.rose = Flower.objects.create(name="Роза", price=100.0, description="Красная роза",
+                                          image="path/to/image", stock_total=20, stock=20)
+        self.tulip = Flower.objects.create(name="Тюльпан", price=50.0, description="Желтый тюльпан",
+                                           image="path/to/image", stock_total=20, stock=20)
+        order = Order.objects.create(user=self.user, delivery_date=date(2024, 3, 8),
+                                     delivery_time=time(12, 0), address="Москва")
+        self.history = [
+            OrderHistory.objects.create(user=self.user, order=order, flower=self.rose, quantity=2, cost=200,
+                                        delivery_date=order.delivery_date, delivery_time=order.delivery_time,
+                                        delivery_address=order.address),
+            OrderHistory.objects.create(user=self.user, order=order, flower=self.tulip, quantity=3, cost=120,
+                                        delivery_date=order.delivery_date, delivery_time=order.delivery_time,
+                                        delivery_address=order.address),
+        ]
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, flower=self.rose, quantity=1)
+
+    def test_full_basket_is_merged_at_current_prices(self):
+        summary, added, repriced = reorder(self.history[0].id, user=self.user)
+
+        self.assertTrue(added)
+        quantities = {item['flower_id']: item['quantity'] for item in summary['items']}
+        self.assertEqual(quantities, {self.rose.id: 3, self.tulip.id: 3})
+        self.assertEqual(summary['total_price'], '450.00')
+        self.assertEqual(repriced, ["Тюльпан"])
+        self.assertFalse(Order.objects.exclude(id=self.history[0].order_id).exists())
+
+    def test_reorder_is_idempotent(self):
+        reorder(self.history[0].id, user=self.user)
+        summary, added, _ = reorder(self.history[1].id, user=self.user)
+
+        self.assertFalse(added)
+        self.assertEqual(summary['total_items'], 6)
+
+    def test_foreign_history_is_not_found(self):
+        other = User.objects.create_user(username='other', password='password123')
+        self.client.login(username='other', password='password123')
+        response = self.client.get(reverse('repeat_order', args=[self.history[0].id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Cart.objects.filter(user=other, items__isnull=False).exists())
+
+    def test_admin_action_reorders_into_customer_cart(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'repeat_order', '_selected_action': [self.history[0].order_id],
+        }, follow=True)
+
+        self.assertContains(response, "добавлен в корзину покупателя")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.cart.items.get(flower=self.tulip).quantity, 3)
+
+
+class GuestSessionCartTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100.0, description="Красная роза",
+                                            image="path/to/image", stock_total=10, stock=10)
+
+    def add(self, version, quantity=1):
+        return self.client.post(reverse('cart_api_add'),
+                                {'flower_id': self.flower.id, 'quantity': quantity, 'version': version},
+                                content_type='application/json')
+
+    def test_guest_browsing_does_not_write_carts(self):
+        self.client.get(reverse('index'))
+        response = self.add(version=0, quantity=2)
+        self.assertEqual(response.json()['cart']['total_items'], 2)
+        self.assertEqual(self.add(version=0).status_code, 409)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_guest_cart_is_merged_on_login(self):
+        self.add(version=0, quantity=2)
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), flower=self.flower, quantity=1)
+
+        self.client.post(reverse('login'), {'username': 'testuser', 'password': 'password123'})
+
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 3)
+        self.assertEqual(self.client.get(reverse('cart_api')).json()['cart']['total_items'], 3)
+
+    @mock.patch('orders.checkout.notify_new_order', return_value=True)
+    def test_guest_cart_is_promoted_at_checkout(self, notify_new_order):
+        self.add(version=0, quantity=2)
+        response = self.client.post(reverse('confirm_order'), {
+            'address': "Москва, ул. Тверская, д. 1",
+            'delivery_date_year': 2030, 'delivery_date_month': 3, 'delivery_date_day': 8,
+            'delivery_time': '12:00',
+        })
+
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('payment_window', args=[order.id]), fetch_redirect_response=False)
+        self.assertIsNone(order.user)
+        self.assertEqual(order.cart.items.get().quantity, 2)
+
+    @mock.patch('orders.checkout.notify_new_order', return_value=True)
+    def test_user_checks_out_twice_in_a_row(self, notify_new_order):
+        self.client.login(username='testuser', password='password123')
+        form = {
+            'address': "Москва, ул. Тверская, д. 1",
+            'delivery_date_year': 2030, 'delivery_date_month': 3, 'delivery_date_day': 8,
+            'delivery_time': '12:00',
+        }
+        for quantity in (2, 3):
+            version = self.client.get(reverse('cart_api')).json()['cart']['version']
+            self.assertEqual(self.add(version=version, quantity=quantity).status_code, 200)
+            self.client.post(reverse('confirm_order'), form)
+
+        orders = list(Order.objects.filter(user=self.user).order_by('id'))
+        self.assertEqual([order.cart.items.get().quantity for order in orders], [2, 3])
+        self.assertEqual(self.client.get(reverse('cart_api')).json()['cart']['total_items'], 0)
+
+
+class FlowerDetailCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100.0, description="Красная роза",
+                                            image="flowers/image.jpg")
+
+    def test_second_request_is_served_from_cache(self):
+        self.client.get(reverse('flower_detail', args=[self.flower.id]))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('flower_detail', args=[self.flower.id]))
+        self.assertContains(response, "Роза")
+
+    def test_review_invalidates_page(self):
+        key = flower_detail_key(self.flower.id)
+        self.client.get(reverse('flower_detail', args=[self.flower.id]))
+        Review.objects.create(flower=self.flower, user=self.user, rating=5, comment="Прекрасно")
+
+        self.assertNotEqual(flower_detail_key(self.flower.id), key)
+        response = self.client.get(reverse('flower_detail', args=[self.flower.id]))
+        self.assertContains(response, "Прекрасно")
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time_module.sleep(0.2)
+            return 'value'
+
+        threads = [threading.Thread(target=get_or_compute, args=('single-flight', compute)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertGreater(cache_stats.as_dict()['misses'], 0)
+
+
+class RecommendationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.other = User.objects.create_user(username='other', password='password123')
+        self.rose, self.tulip, self.lily = [
+            Flower.objects.create(name=name, price=100, description=name, image="path/to/image")
+            for name in ("Роза", "Тюльпан", "Лилия")
+        ]
+
+    def _order(self, user, *flowers):
+        order = Order.objects.create(user=user, delivery_date=date(2024, 3, 8), delivery_time=time(12, 0),
+                                     address="Москва", total_price=100 * len(flowers))
+        OrderHistory.objects.bulk_create([
+            OrderHistory(user=user, order=order, flower=flower, delivery_date=order.delivery_date,
+                         delivery_time=order.delivery_time, delivery_address=order.address, cost=flower.price)
+            for flower in flowers
+        ])
+
+    def _snapshot(self):
+        return sorted(FlowerRecommendation.objects.values_list('kind', 'flower_id', 'recommended_id', 'rank'))
+
+    def test_bought_together_ranked_by_cooccurrence(self):
+        self._order(self.user, self.rose, self.tulip)
+        self._order(self.other, self.rose, self.tulip)
+        self._order(self.other, self.rose, self.lily)
+        build_recommendations()
+
+        self.assertEqual(get_recommendations(self.rose.id, kind=TOGETHER), [self.tulip, self.lily])
+        self.assertEqual(get_recommendations(self.tulip.id, kind=ALSO), [self.rose, self.lily])
+        self.assertNotIn(self.rose, get_recommendations([self.rose.id, self.tulip.id]))
+
+    def test_incremental_update_matches_full_build(self):
+        self._order(self.user, self.rose, self.tulip)
+        build_recommendations()
+        self._order(self.user, self.lily)
+        self._order(self.other, self.tulip, self.lily)
+
+        update_recommendations()
+        incremental = self._snapshot()
+        build_recommendations()
+        self.assertEqual(incremental, self._snapshot())
+
+    def test_flower_page_shows_recommendations(self):
+        self._order(self.user, self.rose, self.tulip)
+        build_recommendations()
+
+        response = self.client.get(reverse('flower_detail', args=[self.rose.id]))
+        self.assertContains(response, "С этим букетом покупают")
+        self.assertContains(response, "Тюльпан")
+
+
+class DemandForecastTest(TestCase):
+
+    def setUp(self):
+        self.rose = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image")
+        rows = []
+        day = date(2023, 1, 1)
+        while day < date(2025, 1, 1):
+            quantity = {(2, 12): 4, (2, 13): 4, (2, 14): 20}.get((day.month, day.day), 2)
+            rows.append(OrderHistory(flower=self.rose, quantity=quantity, delivery_date=day,
+                                     delivery_time=time(12, 0), delivery_address="Москва", cost=100))
+            day += timedelta(days=1)
+        OrderHistory.objects.bulk_create(rows)
+
+    def test_holiday_peak_is_forecast(self):
+        forecast = forecast_demand(start=date(2025, 2, 10), days=7, as_of=date(2025, 1, 1))
+
+        daily = dict(zip(forecast['dates'], forecast['rows'][0]['daily']))
+        self.assertEqual(daily[date(2025, 2, 10)], 2)
+        self.assertGreaterEqual(daily[date(2025, 2, 13)], 3)
+        self.assertGreaterEqual(daily[date(2025, 2, 14)], 15)
+        self.assertEqual(forecast['holidays'], {date(2025, 2, 14): "14 февраля"})
+        self.assertIn("14 февраля", format_forecast(forecast))
+
+    def test_no_history_gives_empty_forecast(self):
+        OrderHistory.objects.all().delete()
+        forecast = forecast_demand(start=date(2025, 3, 1), days=3, as_of=date(2025, 1, 1))
+        self.assertEqual(forecast['rows'], [])
+
+    def test_archived_history_counts_quantities(self):
+        before = forecast_demand(start=date(2025, 2, 10), days=7, as_of=date(2025, 1, 1))['rows']
+        OrderHistory.objects.update(completed_at=timezone.now() - timedelta(days=400))
+        archive_order_history(batch_size=500)
+
+        self.assertFalse(OrderHistory.objects.exists())
+        self.assertEqual(forecast_demand(start=date(2025, 2, 10), days=7, as_of=date(2025, 1, 1))['rows'], before)
+
+
+class OrderStatusTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password123', email='buyer@example.com')
+        self.orders = [
+            Order.objects.create(user=self.user, delivery_date=date(2024, 3, 8), delivery_time=time(12, 0),
+                                 address="Москва")
+            for _ in range(3)
+        ]
+
+    def test_bulk_transition_logs_and_queues_notifications(self):
+        delivered = self.orders[0]
+        transition_order(delivered, 'confirmed', source='test')
+        transition_order(delivered, 'delivered', source='test')
+
+        changed, rejected = transition_orders([order.id for order in self.orders], 'confirmed', source='test')
+
+        self.assertEqual(sorted(changed), [self.orders[1].id, self.orders[2].id])
+        self.assertEqual(rejected, {delivered.id: 'delivered'})
+        self.assertEqual(OrderStatusEvent.objects.count(), 4)
+        self.assertEqual(StatusNotification.objects.filter(sent_at=None).count(), 4)
+
+        self.assertEqual(send_status_notifications(batch_size=3), 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(StatusNotification.objects.filter(sent_at=None).exists())
+
+    def test_invalid_transition_is_rejected(self):
+        transition_order(self.orders[0], 'canceled', source='test')
+        with self.assertRaises(InvalidTransition):
+            transition_order(self.orders[0], 'confirmed', source='test')
+        self.assertEqual(Order.objects.get(id=self.orders[0].id).status, 'canceled')
+
+    def test_status_lookup_is_cached_and_invalidated(self):
+        order = self.orders[0]
+        self.assertEqual(get_order_status(order.id), 'pending')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_order_status(order.id), 'pending')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_order(order, 'confirmed', source='test')
+        self.assertEqual(get_order_status(order.id), 'confirmed')
+        self.assertIsNone(get_order_status(999999))
+
+    def _reserved_order(self, flower, quantity):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, flower=flower, quantity=quantity)
+        order = Order.objects.create(user=self.user, cart=cart, delivery_date=date(2024, 3, 8),
+                                     delivery_time=time(12, 0), address="Москва")
+        reserve_cart(order, cart)
+        return order
+
+    def test_confirm_commits_and_cancel_returns_committed_stock(self):
+        flower = Flower.objects.create(name="Роза", price=100, stock_total=5, stock=5)
+        order = self._reserved_order(flower, 2)
+
+        transition_order(order, 'confirmed', source='test')
+        self.assertEqual(StockReservation.objects.get(order=order).status, StockReservation.COMMITTED)
+        # Подтвержденный заказ не теряет букеты по истечении резерва
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timedelta(days=1)), 0)
+
+        transition_order(order, 'canceled', source='test')
+        self.assertEqual(StockReservation.objects.get(order=order).status, StockReservation.RELEASED)
+        self.assertEqual(Flower.objects.get(id=flower.id).stock, 5)
+        reconcile_stock()
+        self.assertEqual(Flower.objects.get(id=flower.id).stock, 5)
+
+    def test_order_without_stock_is_not_confirmed(self):
+        flower = Flower.objects.create(name="Роза", price=100, stock_total=2, stock=2)
+        order = self._reserved_order(flower, 2)
+        release_order_stock(order)
+        Flower.objects.filter(id=flower.id).update(stock=1)
+
+        changed, rejected = transition_orders([order.id, self.orders[0].id], 'confirmed', source='test')
+        self.assertEqual(changed, [self.orders[0].id])
+        self.assertEqual(rejected, {order.id: 'pending'})
+        self.assertEqual(Order.objects.get(id=order.id).status, 'pending')
+
+    def test_log_rows_are_append_only(self):
+        transition_order(self.orders[0], 'confirmed', source='test')
+        event = OrderStatusEvent.objects.get()
+        event.source = 'edited'
+        with self.assertRaises(ValueError):
+            event.save()
+
+
+@override_settings(PAYMENT_SUBMIT_ASYNC=False, PAYMENT_FAKE_AUTO_CAPTURE=False)
+class PaymentFlowTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.login(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image",
+                                            stock_total=5, stock=5)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, flower=self.flower, quantity=2)
+        self.order = Order.objects.create(user=self.user, cart=self.cart, delivery_date=date(2024, 3, 8),
+                                          delivery_time=time(12, 0), address="Москва", total_price=200)
+        reserve_cart(self.order, self.cart)
+
+    def _pay(self, key='key-1'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('payment_window', args=[self.order.id]), {'idempotency_key': key})
+
+    def _webhook(self, payment, status, signature=None):
+        body = json.dumps({'payment_id': payment.provider_payment_id, 'status': status}).encode()
+        return self.client.post(reverse('payment_webhook'), body, content_type='application/json',
+                                HTTP_X_PAYMENT_SIGNATURE=signature or FakePaymentProvider.sign(body))
+
+    def test_double_post_and_replayed_webhook_are_idempotent(self):
+        response = self._pay()
+        self.assertRedirects(response, reverse('payment_status', args=[self.order.id]), fetch_redirect_response=False)
+        self._pay()
+        payment = Payment.objects.get()
+        self.assertTrue(payment.provider_payment_id)
+
+        for _ in range(2):
+            self.assertEqual(self._webhook(payment, 'succeeded').status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'confirmed')
+        self.assertEqual(OrderStatusEvent.objects.filter(order=self.order).count(), 1)
+        self.assertFalse(self.cart.items.exists())
+        self.assertEqual(Flower.objects.get(id=self.flower.id).stock, 3)
+
+    def test_webhook_with_bad_signature_is_rejected(self):
+        self._pay()
+        response = self._webhook(Payment.objects.get(), 'succeeded', signature='forged')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'pending')
+
+    def test_webhook_without_configured_secret_is_rejected(self):
+        self._pay()
+        payment = Payment.objects.get()
+        self.assertNotIn('key-1', payment.provider_payment_id)
+        body = json.dumps({'payment_id': payment.provider_payment_id, 'status': 'succeeded'}).encode()
+        forged = hmac.new(settings.SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+
+        with self.settings(PAYMENT_WEBHOOK_SECRET=None):
+            response = self.client.post(reverse('payment_webhook'), body, content_type='application/json',
+                                        HTTP_X_PAYMENT_SIGNATURE=forged)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'pending')
+
+    def test_fake_provider_is_refused_outside_debug_and_tests(self):
+        with self.settings(DEBUG=False, TESTING=False):
+            with self.assertRaises(ImproperlyConfigured):
+                FakePaymentProvider()
+            ids = {error.id for error in check_payment_settings()}
+        self.assertIn('orders.E002', ids)
+        with self.settings(PAYMENT_PROVIDER=None, PAYMENT_WEBHOOK_SECRET=None, DEBUG=False):
+            self.assertEqual({error.id for error in check_payment_settings()}, {'orders.E001', 'orders.E003'})
+
+    def test_starting_payment_extends_the_reservation(self):
+        self.assertGreater(settings.RESERVATION_MINUTES, settings.PAYMENT_TIMEOUT_MINUTES)
+        StockReservation.objects.update(expires_at=timezone.now() + timedelta(minutes=1))
+        self._pay()
+        reservation = StockReservation.objects.get(order=self.order)
+        self.assertGreater(reservation.expires_at, timezone.now() + timedelta(minutes=settings.PAYMENT_TIMEOUT_MINUTES))
+
+        # Снятый резерв берется заново при новой попытке оплаты
+        Payment.objects.update(status=Payment.FAILED)
+        release_order_stock(self.order)
+        self._pay(key='key-2')
+        self.assertEqual(StockReservation.objects.filter(order=self.order, status=StockReservation.ACTIVE).count(), 1)
+        self.assertEqual(Flower.objects.get(id=self.flower.id).stock, 3)
+
+    def test_reconciler_settles_pending_payments(self):
+        self._pay()
+        payment = Payment.objects.get()
+        FakePaymentProvider().settle(payment.provider_payment_id, 'succeeded')
+
+        self.assertEqual(reconcile_payments()['settled'], 1)
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 'confirmed')
+
+    def test_unpaid_order_expires_and_releases_stock_and_cart(self):
+        self._pay()
+        Order.objects.filter(id=self.order.id).update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(expire_unpaid_orders(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'canceled')
+        self.assertIsNone(self.order.cart_id)
+        self.assertEqual(Payment.objects.get().status, 'expired')
+        self.assertEqual(Flower.objects.get(id=self.flower.id).stock, 5)
+
+    def test_expired_order_keeps_cart_when_user_started_a_new_one(self):
+        self._pay()
+        Order.objects.filter(id=self.order.id).update(created_at=timezone.now() - timedelta(hours=2))
+        self.client.get(reverse('cart_api'))  # Покупатель открыл корзину — создана новая
+        new_cart = Cart.objects.get(user=self.user, order__isnull=True)
+
+        self.assertEqual(expire_unpaid_orders(), 1)
+        self.assertEqual(Order.objects.get(id=self.order.id).cart_id, self.cart.id)
+        self.assertEqual(Cart.objects.get(user=self.user, order__isnull=True), new_cart)
+
+
+class CatalogImportTest(TestCase):
+
+    CATALOG = (
+        "sku,name,price,description,image\n"
+        "rose-5,Пять роз,1500,Букет из пяти роз,\n"
+        "tulip-9,Девять тюльпанов,\"990,50\",Весенний букет,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def _import(self, text, **kwargs):
+        return import_catalog(read_catalog(io.StringIO(text), 'csv'), **kwargs)
+
+    def test_import_creates_and_updates_with_one_version_bump(self):
+        report = self._import(self.CATALOG)
+        self.assertTrue(report['saved'])
+        self.assertEqual(report['created'], ['rose-5', 'tulip-9'])
+        self.assertEqual(Flower.objects.get(sku='tulip-9').price, Decimal('990.50'))
+
+        rose, tulip = Flower.objects.get(sku='rose-5'), Flower.objects.get(sku='tulip-9')
+        keys = (flower_detail_key(rose.id), flower_detail_key(tulip.id))
+        report = self._import(self.CATALOG.replace("1500", "1700"))
+
+        self.assertEqual(report['unchanged'], 1)
+        self.assertEqual(report['updated'], [('rose-5', {'price': (Decimal('1500.00'), Decimal('1700.00'))})])
+        self.assertNotEqual((flower_detail_key(rose.id), flower_detail_key(tulip.id)), keys)
+
+    def test_dry_run_and_invalid_rows_write_nothing(self):
+        report = self._import(self.CATALOG, dry_run=True)
+        self.assertEqual(len(report['created']), 2)
+        self.assertFalse(Flower.objects.exists())
+
+        report = self._import(self.CATALOG + "lily-3,Лилии,бесплатно,,\nrose-5,Дубль,100,,\n")
+        self.assertFalse(report['saved'])
+        self.assertEqual([line for line, _ in report['errors']], [4, 5])
+        self.assertFalse(Flower.objects.exists())
+
+    def test_images_are_copied_with_renditions(self):
+        with tempfile.TemporaryDirectory() as media, tempfile.TemporaryDirectory() as source_dir:
+            Image.new('RGB', (1600, 800), 'red').save(os.path.join(source_dir, 'rose.png'))
+
+            with self.settings(MEDIA_ROOT=media, CATALOG_IMPORT_DIR=source_dir):
+                report = self._import("sku,name,price,image\nrose-5,Розы,1500,rose.png\n")
+                flower = Flower.objects.get(sku='rose-5')
+                self.assertEqual(report['images'], 1)
+                self.assertTrue(default_storage.exists(flower.image.name))
+                with default_storage.open(rendition_name(flower.image.name, 'thumb')) as f:
+                    self.assertEqual(Image.open(f).size, (300, 150))
+
+                self.assertEqual(self._import("sku,name,price,image\nrose-5,Розы,1500,rose.png\n")['images'], 0)
+
+    def test_failed_import_removes_downloaded_images(self):
+        with tempfile.TemporaryDirectory() as media, tempfile.TemporaryDirectory() as source_dir:
+            Image.new('RGB', (400, 400), 'red').save(os.path.join(source_dir, 'rose.png'))
+
+            with self.settings(MEDIA_ROOT=media, CATALOG_IMPORT_DIR=source_dir):
+                report = self._import("sku,name,price,image\nrose-5,Розы,1500,rose.png\n"
+                                      "lily-3,Лилии,1200,missing.png\n")
+                self.assertFalse(report['saved'])
+                self.assertEqual([line for line, _ in report['errors']], [3])
+                self.assertEqual(os.listdir(os.path.join(media, 'flowers', 'renditions')), [])
+                self.assertEqual(os.listdir(os.path.join(media, 'flowers')), ['renditions'])
+
+    def test_local_images_outside_import_dir_are_rejected(self):
+        with tempfile.TemporaryDirectory() as media, tempfile.TemporaryDirectory() as source_dir:
+            with self.settings(MEDIA_ROOT=media, CATALOG_IMPORT_DIR=source_dir):
+                report = self._import("sku,name,price,image\nrose-5,Розы,1500,../../etc/passwd.png\n")
+        self.assertFalse(report['saved'])
+        self.assertIn("вне каталога импорта", report['errors'][0][1])
+
+
+class AsyncStorefrontViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image", stock=5)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, flower=self.flower, quantity=2)
+        OrderHistory.objects.create(user=self.user, flower=self.flower, delivery_date=date(2024, 3, 8),
+                                    delivery_time=time(12, 0), delivery_address="Москва", cost=100)
+
+    async def test_read_paths_under_asgi(self):
+        await self.async_client.alogin(username='testuser', password='password123')
+
+        response = await self.async_client.get(reverse('index'))
+        self.assertContains(response, "Роза")
+        self.assertContains(response, "testuser")
+
+        response = await self.async_client.get(reverse('cart'))
+        self.assertEqual(response.context['total_items'], 2)
+
+        response = await self.async_client.get(reverse('flower_detail', args=[self.flower.id]))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('flower_detail', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.get(reverse('order_history'))
+        self.assertEqual(len(response.context['orders']), 1)
+
+    async def test_telegram_webhook_requires_secret(self):
+        with self.settings(TELEGRAM_WEBHOOK_SECRET='secret'):
+            response = await self.async_client.post(reverse('telegram_webhook'), {}, content_type='application/json',
+                                                    headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(RATELIMITS={'add_to_cart': '3/m', 'login': '2/m'})
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        reset_rate_limits()
+        self.addCleanup(reset_rate_limits)
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.flower = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image", stock=5)
+
+    def test_rejected_requests_do_not_touch_database(self):
+        url = reverse('add_to_cart', args=[self.flower.id])
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 302)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        # Другой клиент с другого IP получает собственные ведра
+        self.assertEqual(Client().get(url, REMOTE_ADDR='10.0.0.2').status_code, 302)
+
+    def test_session_bucket_survives_cookie_changes_and_rejection_spends_nothing(self):
+        url = reverse('add_to_cart', args=[self.flower.id])
+        self.client.session  # Сессия с cookie есть уже у первого запроса
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+        # Cookie сессии менялась при каждой записи, но ведро сессии то же: с нового IP запрос отклонен
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 429)
+        # ...и отклоненный запрос не потратил жетон из ведра этого IP
+        other = Client()
+        for _ in range(3):
+            self.assertEqual(other.get(url, REMOTE_ADDR='10.0.0.2').status_code, 302)
+
+    def test_bucket_refills_over_time(self):
+        with mock.patch('orders.ratelimit.time.time', return_value=1000.0):
+            for _ in range(2):
+                self.client.post(reverse('login'), {'username': 'testuser', 'password': 'wrong'})
+            self.assertEqual(self.client.post(reverse('login'), {}).status_code, 429)
+            # Страница входа по GET не ограничивается
+            self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        with mock.patch('orders.ratelimit.time.time', return_value=1030.0):
+            self.assertEqual(self.client.post(reverse('login'), {}).status_code, 200)
+
+
+@override_settings(DIGEST_TELEGRAM_CHAT_IDS=['-100'], DIGEST_EMAIL_RECIPIENTS=['boss@example.com'],
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class DailyDigestTest(TestCase):
+
+    def setUp(self):
+        flower = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image")
+        # Понедельник 2024-03-11: вчера — воскресенье, прошлая неделя — 4–10 марта
+        for day, price, status in [(10, 300, 'pending'), (10, 200, 'canceled'), (5, 500, 'delivered'), (11, 900, 'pending')]:
+            Order.objects.create(flower=flower, address="Москва", delivery_date=date(2024, 3, day),
+                                 delivery_time=time(12, 0), total_price=price, status=status,
+                                 created_at=timezone.make_aware(datetime.combine(date(2024, 3, day), time(10, 0))))
+
+    @mock.patch('orders.digest.asend_shop_message', new_callable=mock.AsyncMock, return_value=True)
+    def test_digest_is_sent_once_per_period(self, send_message):
+        result = send_digests(today=date(2024, 3, 11))
+
+        self.assertEqual(result['sent'], 2)
+        text = send_message.call_args.args[0]
+        self.assertIn("Вчера (10.03.2024)", text)
+        self.assertIn("Заказов: 2\nПродажи: 300", text)
+        self.assertIn("Прошлая неделя (04.03.2024 – 10.03.2024)", text)
+        self.assertIn("Продажи: 800", text)
+        self.assertEqual(mail.outbox[0].body, text)
+        self.assertEqual(Report.objects.get(start_date=date(2024, 3, 4)).total_orders, 3)
+
+        # Повторный запуск в тот же день и запуск во вторник не повторяют недельную сводку
+        self.assertIsNone(send_digests(today=date(2024, 3, 11))['text'])
+        send_digests(today=date(2024, 3, 12))
+        self.assertNotIn("Прошлая неделя", send_message.call_args.args[0])
+        self.assertEqual(DigestDelivery.objects.filter(period=DigestDelivery.WEEK).count(), 2)
+
+    @mock.patch('orders.digest.asend_shop_message', new_callable=mock.AsyncMock, return_value=False)
+    def test_failed_delivery_is_retried(self, send_message):
+        result = send_digests(today=date(2024, 3, 11))
+        self.assertEqual((result['sent'], result['failed']), (1, 1))
+        self.assertFalse(DigestDelivery.objects.filter(channel='telegram:-100').exists())
+
+        send_message.return_value = True
+        self.assertEqual(send_digests(today=date(2024, 3, 11))['sent'], 1)
+        self.assertEqual(DigestDelivery.objects.exclude(sent_at=None).count(), 4)
+
+
+class SubscriptionOrdersTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='corp', password='password123', email='corp@example.com')
+        self.rose = Flower.objects.create(name="Роза", price=100, description="Роза", image="path/to/image")
+        self.tulip = Flower.objects.create(name="Тюльпан", price=50, description="Тюльпан", image="path/to/image")
+        self.subscription = Subscription.objects.create(user=self.user, address="Москва, офис", delivery_time=time(9, 0),
+                                                        interval_days=7, next_delivery_date=date(2024, 3, 4))
+        SubscriptionItem.objects.bulk_create([
+            SubscriptionItem(subscription=self.subscription, flower=self.rose, quantity=10),
+            SubscriptionItem(subscription=self.subscription, flower=self.tulip, quantity=5),
+        ])
+
+    def test_due_dates_skip_missed_periods(self):
+        dates, next_date = due_dates(self.subscription, today=date(2024, 3, 13), horizon=date(2024, 3, 27))
+        self.assertEqual(dates, [date(2024, 3, 18), date(2024, 3, 25)])
+        self.assertEqual(next_date, date(2024, 4, 1))
+
+    def test_orders_are_generated_once_per_period(self):
+        self.assertEqual(generate_subscription_orders(today=date(2024, 3, 1), window_days=14)['created'], 2)
+
+        orders = Order.objects.filter(subscription=self.subscription).order_by('delivery_date')
+        self.assertEqual([order.delivery_date for order in orders], [date(2024, 3, 4), date(2024, 3, 11)])
+        self.assertEqual(orders[0].total_price, 1250)
+        self.assertEqual(orders[0].status, 'confirmed')
+        self.assertEqual(orders[0].cart.items.count(), 2)
+        self.assertEqual(OrderHistory.objects.filter(order=orders[0]).count(), 2)
+        self.assertEqual(StatusNotification.objects.filter(sent_at=None).count(), 2)
+
+        # Повторный запуск (например, после перезапуска) не создает дублей, даже если дата подписки не сдвинута
+        self.assertEqual(generate_subscription_orders(today=date(2024, 3, 1), window_days=14)['created'], 0)
+        Subscription.objects.filter(id=self.subscription.id).update(next_delivery_date=date(2024, 3, 4))
+        self.assertEqual(generate_subscription_orders(today=date(2024, 3, 1), window_days=14)['created'], 0)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_orders_take_stock_and_shortages_are_reported(self):
+        restock(self.rose.id, 15)
+
+        result = generate_subscription_orders(today=date(2024, 3, 1), window_days=14)
+
+        # Роз хватает только на первую доставку; тюльпаны без учета остатков
+        self.assertEqual(result, {'created': 1, 'unfulfilled': [(self.subscription.id, date(2024, 3, 11))]})
+        order = Order.objects.get(subscription=self.subscription)
+        self.assertEqual(order.delivery_date, date(2024, 3, 4))
+        self.assertEqual(
+            set(StockReservation.objects.filter(order=order).values_list('flower_id', 'quantity', 'status')),
+            {(self.rose.id, 10, 'committed'), (self.tulip.id, 5, 'committed')},
+        )
+        self.assertEqual(Flower.objects.get(id=self.rose.id).stock, 5)
+        self.assertEqual(Subscription.objects.get(id=self.subscription.id).next_delivery_date, date(2024, 3, 11))
+
+        # После поступления пропущенная доставка создается при следующем запуске
+        restock(self.rose.id, 5)
+        result = generate_subscription_orders(today=date(2024, 3, 1), window_days=14)
+        self.assertEqual(result, {'created': 1, 'unfulfilled': []})
+        self.assertEqual(Flower.objects.get(id=self.rose.id).stock, 0)
+
+    def test_subscription_from_order(self):
+        order = Order.objects.create(user=self.user, flower=self.rose, delivery_date=date(2024, 3, 8),
+                                     delivery_time=time(12, 0), address="Москва", total_price=300)
+        OrderHistory.objects.create(user=self.user, order=order, flower=self.rose, quantity=3,
+                                    delivery_date=order.delivery_date, delivery_time=order.delivery_time,
+                                    delivery_address=order.address, cost=300)
+
+        subscription = subscribe_order(order)
+        self.assertEqual(subscription.next_delivery_date, date(2024, 3, 15))
+        self.assertEqual(list(subscription.items.values_list('flower_id', 'quantity')), [(self.rose.id, 3)])
+
+
+class LoggingTest(TestCase):
+
+    def test_addresses_and_phones_are_redacted(self):
+        text = redact("Заказ 5: Москва, ул. Тверская, д. 1, кв. 2; тел. +7 (999) 123-45-67")
+        self.assertNotIn("Тверская", text)
+        self.assertNotIn("123-45-67", text)
+        self.assertIn("Заказ 5", text)
+
+    def test_sampling_keeps_warnings(self):
+        sampling = SamplingFilter({'orders.access': 0.25})
+        records = [logging.makeLogRecord({'name': 'orders.access.index', 'levelno': logging.INFO})
+                   for _ in range(8)]
+        self.assertEqual(sum(sampling.filter(record) for record in records), 2)
+        warning = logging.makeLogRecord({'name': 'orders.access', 'levelno': logging.WARNING})
+        self.assertTrue(sampling.filter(warning))
+        other = logging.makeLogRecord({'name': 'orders.views', 'levelno': logging.INFO})
+        self.assertTrue(sampling.filter(other))
+
+    def test_background_handler_writes_json_with_ids(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'app.log')
+            handler = BackgroundHandler(filename=path)
+            test_logger = logging.getLogger('orders.tests.background')
+            test_logger.addHandler(handler)
+            test_logger.propagate = False
+            test_logger.setLevel(logging.INFO)  # В тестах корневой уровень — ERROR
+            token = request_id_var.set('req-1')
+            try:
+                test_logger.warning("Order %s to %s", 7, "ул. Ленина, д. 3", extra={'order_id': 7})
+            finally:
+                request_id_var.reset(token)
+                test_logger.setLevel(logging.NOTSET)
+                test_logger.removeHandler(handler)
+                handler.close()
+
+            with open(path, encoding='utf-8') as f:
+                record = json.loads(f.readline())
+        self.assertEqual(record['request_id'], 'req-1')
+        self.assertEqual(record['order_id'], 7)
+        self.assertEqual(record['message'], "Order 7 to [адрес скрыт]")
+
+    def test_extra_fields_and_exceptions_are_redacted(self):
+        try:
+            raise ValueError("Не удалось доставить: ул. Ленина, д. 3, тел. +7 999 123-45-67")
+        except ValueError:
+            record = logging.getLogger('orders.tests').makeRecord(
+                'orders.tests', logging.ERROR, __file__, 0, "Delivery failed", (), sys.exc_info(),
+                extra={'address': "ул. Ленина, д. 3", 'order_id': 7},
+            )
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['address'], "[адрес скрыт]")
+        self.assertEqual(data['order_id'], 7)
+        self.assertNotIn("Ленина", data['exc'])
+        self.assertNotIn("123-45-67", data['exc'])
+
+    def test_request_id_is_returned(self):
+        response = self.client.get(reverse('index'), HTTP_X_REQUEST_ID='abc123')
+        self.assertEqual(response['X-Request-ID'], 'abc123')
+        self.assertTrue(self.client.get(reverse('index'))['X-Request-ID'])
+
+
+
+class StaticAssetsTest(TestCase):
+
+    def test_minify_css_keeps_strings(self):
+        css = 'a :hover {\n  content: "a  ;  b" ; /* цвет */ color: red ;\n}\n'
+        self.assertEqual(minify_css(css), 'a :hover{content:"a  ;  b";color:red}')
+
+    def test_templates_are_cached_and_styles_external(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertEqual(type(loader).__module__, 'django.template.loaders.cached')
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, '<style>')
+        self.assertContains(response, 'orders/css/storefront.css')
+
+    def test_collectstatic_precompresses_and_serve_negotiates(self):
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'orders.assets.PrecompressedManifestStaticFilesStorage'},
+        }
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, STORAGES=storages):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            from django.contrib.staticfiles.storage import staticfiles_storage
+            name = staticfiles_storage.stored_name('orders/css/storefront.css')
+            self.assertRegex(name, r'^orders/css/storefront\.[0-9a-f]{12}\.css$')
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                minified = f.read()
+            self.assertNotIn('/*', minified)
+
+            factory = RequestFactory()
+            response = serve_static(factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'), name)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertTrue(response['Content-Type'].startswith('text/css'))
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode('utf-8'), minified)
+
+            response = serve_static(factory.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0'), name)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content).decode('utf-8'), minified)
+
+
+class ReplicaRoutingTest(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        patcher = mock.patch('orders.replica.replica_available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_replica_until_own_write(self):
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Order), REPLICA)
+            self.assertEqual(self.router.db_for_write(Report), 'default')
+            self.assertEqual(self.router.db_for_read(Report), 'default')
+            self.assertEqual(self.router.db_for_read(Order), REPLICA)
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_write_pins_following_requests_to_default(self):
+        routed = []
+
+        def view(request):
+            with read_from_replica():
+                routed.append(self.router.db_for_read(Order))
+            if request.method == 'POST':
+                self.router.db_for_write(Order)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        factory = RequestFactory()
+        self.assertNotIn(PIN_COOKIE, middleware(factory.get('/')).cookies)
+        response = middleware(factory.post('/'))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        pinned = factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        middleware(pinned)
+        self.assertEqual(routed, [REPLICA, REPLICA, 'default'])
+
+    def test_snapshot_copies_default_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+            with mock.patch.dict('django.conf.settings.DATABASES', {REPLICA: replica}):
+                snapshot_replica()
+            copy = sqlite3.connect(path)
+            try:
+                tables = {row[0] for row in copy.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            finally:
+                copy.close()
+        self.assertIn(Order._meta.db_table, tables)
+
+    def test_report_reads_orders_from_replica_and_report_from_default_after_write(self):
+        user = User.objects.create_user(username='manager', password='password123')
+        for total in (1500, 990):
+            Order.objects.create(user=user, delivery_date=date(2030, 3, 8), delivery_time=time(12, 0),
+                                 address="Москва", total_price=total)
+        self.client.login(username='manager', password='password123')
+
+        reads, real_read, real_write = [], ReplicaRouter.db_for_read, ReplicaRouter.db_for_write
+
+        def route_read(router, model, **hints):
+            reads.append((model, real_read(router, model, **hints)))
+            return 'default'  # Реплики в тестах нет: запоминаем решение роутера, а читаем из тестовой базы
+
+        def route_write(router, model, **hints):
+            alias = real_write(router, model, **hints)
+            if model is Report:
+                # Сразу после записи отчет в этом же запросе должен читаться из default
+                reads.append((model, real_read(router, model)))
+            return alias
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=route_read), \
+                mock.patch.object(ReplicaRouter, 'db_for_write', autospec=True, side_effect=route_write):
+            response = self.client.get(reverse('generate_report'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({db for model, db in reads if model is Order}, {REPLICA})
+        self.assertEqual([db for model, db in reads if model is Report], ['default'])
+        report = Report.objects.get()
+        self.assertEqual((report.total_orders, report.total_sales), (2, Decimal('2490')))
+
+
+class OrderSearchTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ivanov', password='password')
+        self.lenina5 = self.create_order("Москва, ул. Ленина, д. 5, кв. 12", guest_phone="+7 (916) 123-45-67")
+        self.lenina15 = self.create_order("Москва, улица Ленина, дом 15")
+        self.tverskaya = self.create_order("Москва, Тверская ул., д. 1")
+
+    def create_order(self, address, **kwargs):
+        return Order.objects.create(user=self.user, delivery_date=date(2024, 3, 8), delivery_time=time(12, 0),
+                                    address=address, **kwargs)
+
+    def found(self, query):
+        return set(search_orders(query).values_list('id', flat=True))
+
+    def test_normalization(self):
+        self.assertEqual(normalize_text("Улица Лёнина, дом 5"), "ул ленина д 5")
+        self.assertEqual(normalize_phone("8 (916) 123-45-67"), "79161234567")
+
+    def test_partial_address_phone_and_id_prefix(self):
+        self.assertEqual(self.found("ленина"), {self.lenina5.id, self.lenina15.id})
+        self.assertEqual(self.found("улица Ленина, д. 5"), {self.lenina5.id})
+        self.assertEqual(self.found("тверск"), {self.tverskaya.id})
+        self.assertEqual(self.found("8 916 123"), {self.lenina5.id})
+        self.assertIn(self.tverskaya.id, self.found(str(self.tverskaya.id)))
+        self.assertEqual(self.found("садовая"), set())
+
+    def test_index_follows_changes(self):
+        self.tverskaya.address = "Москва, Садовая ул., д. 3"
+        self.tverskaya.save()
+        self.assertEqual(self.found("тверск"), set())
+        self.assertEqual(self.found("садовая"), {self.tverskaya.id})
+        self.tverskaya.delete()
+        self.assertEqual(self.found("садовая"), set())
+
+    def test_subscription_orders_are_indexed(self):
+        flower = Flower.objects.create(name="Розы", price=Decimal('1000'))
+        OrderHistory.objects.create(user=self.user, order=self.lenina15, flower=flower, quantity=1,
+                                    delivery_date=date(2024, 3, 8), delivery_time=time(12, 0),
+                                    delivery_address=self.lenina15.address, cost=Decimal('1000'))
+        subscribe_order(self.lenina15, interval_days=7, first_date=date(2024, 3, 15))
+        generate_subscription_orders(today=date(2024, 3, 14), window_days=7)
+        self.assertEqual(len(self.found("ленина 15")), 2)
+
+    def test_admin_and_review_search(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:orders_order_changelist'), {'q': 'ленина 5'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.lenina5])
+
+        flower = Flower.objects.create(name="Пионы", price=Decimal('1500'))
+        review = Review.objects.create(flower=flower, user=self.user, rating=5, comment="Свежие, ароматные")
+        self.assertEqual(list(search_reviews("аромат")), [review])
+        self.assertEqual(list(search_reviews("пион")), [review])
+
+
+class FakeBotAPI:
+    """Локальный сервер Bot API: запоминает вызовы и загруженные файлы, file_id выдает по порядку"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.uploads = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        form = await request.post()
+        self.calls.append(method)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        if method == 'sendMessage':
+            return web.json_response({'ok': True, 'result': self.message(form['chat_id'])})
+        if method == 'sendPhoto':
+            media = [form['photo']]
+        else:
+            media = [item['media'] for item in json.loads(form['media'])]
+        result = [self.message(form['chat_id'], self.file_id(form, value)) for value in media]
+        return web.json_response({'ok': True, 'result': result if method == 'sendMediaGroup' else result[0]})
+
+    def file_id(self, form, value):
+        if isinstance(value, str) and value.startswith('attach://'):
+            value = form[value[len('attach://'):]]
+        if isinstance(value, str):
+            return value
+        self.uploads += 1
+        return f'uploaded-{self.uploads}'
+
+    def message(self, chat_id, file_id=None):
+        message = {'message_id': len(self.calls), 'date': 0, 'chat': {'id': int(chat_id), 'type': 'private'}}
+        if file_id:
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 100, 'height': 100}]
+        return message
+
+
+class TelegramPhotoTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.rose = Flower.objects.create(name="Розы", price=Decimal('1500'), image=self.save_image('rose.png', 'red'))
+        self.tulip = Flower.objects.create(name="Тюльпаны", price=Decimal('900'),
+                                           image=self.save_image('tulip.png', 'yellow'))
+        Flower.objects.create(name="Без фото", price=Decimal('500'))
+
+    def save_image(self, name, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1600, 1200), color).save(buffer, format='PNG')
+        buffer.seek(0)
+        return default_storage.save(f'flowers/{name}', buffer)
+
+    async def send(self, api, **kwargs):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', api.handle)
+        server = TestServer(app, host='127.0.0.1', access_log=None)
+        await server.start_server()
+        bot = Bot(token='123456:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')))))
+        try:
+            return await send_catalog(bot, 42, **kwargs)
+        finally:
+            await bot.session.close()
+            await server.close()
+
+    async def test_photos_uploaded_once_and_reused(self):
+        api = FakeBotAPI()
+        stats = await self.send(api)
+        self.assertEqual(stats, {'albums': 1, 'uploaded': 2, 'reused': 0, 'without_photo': 1})
+        self.assertEqual(api.uploads, 2)
+        self.assertEqual(sorted(api.calls), ['sendMediaGroup', 'sendMessage'])
+
+        api = FakeBotAPI()
+        stats = await self.send(api)
+        self.assertEqual((stats['uploaded'], stats['reused']), (0, 2))
+        self.assertEqual(api.uploads, 0)
+
+    async def test_changed_image_is_uploaded_again(self):
+        await self.send(FakeBotAPI())
+        old_photo = await TelegramPhoto.objects.aget(flower=self.rose)
+
+        self.rose.image = await sync_to_async(self.save_image)('rose-new.png', 'white')
+        await self.rose.asave()
+        api = FakeBotAPI()
+        stats = await self.send(api)
+
+        self.assertEqual((stats['uploaded'], stats['reused']), (1, 1))
+        photo = await TelegramPhoto.objects.aget(flower=self.rose)
+        self.assertNotEqual(photo.image_hash, old_photo.image_hash)
+        self.assertEqual(await TelegramPhoto.objects.acount(), 2)
+
+    async def test_albums_sent_with_bounded_concurrency(self):
+        image = self.rose.image.name
+        await Flower.objects.abulk_create([Flower(name=f"Букет {i}", price=Decimal('100'), image=image)
+                                           for i in range(40)])
+        api = FakeBotAPI(delay=0.05)
+        stats = await self.send(api, concurrency=2)
+
+        self.assertEqual(stats['albums'], 5)
+        self.assertEqual(api.calls.count('sendMediaGroup'), 5)
+        self.assertEqual(api.max_in_flight, 2)
+
+
+class BotInlineCatalogTest(TestCase):
+    BOT_ID = 123456
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.rose = Flower.objects.create(name="Розы красные", price=Decimal('1500'), stock=5)
+        self.tulip = Flower.objects.create(name="Тюльпаны", price=Decimal('900'), stock=1)
+        Review.objects.create(flower=self.rose, user=self.user, rating=5, comment="Отлично")
+        TelegramPhoto.objects.create(flower=self.tulip, bot_id=self.BOT_ID, image_hash='a' * 40, file_id='tulip-photo')
+
+    def refresh(self, force=True):
+        return async_to_sync(catalog.refresh)(self.BOT_ID, force=force)
+
+    def test_inline_results_come_from_snapshot_without_queries(self):
+        snapshot = self.refresh()
+        with self.assertNumQueries(0):
+            results, next_offset = snapshot.inline_results("роз")
+            photos, _ = snapshot.inline_results("тюльп")
+
+        self.assertEqual(next_offset, '')
+        self.assertIsInstance(results[0], InlineQueryResultArticle)
+        self.assertEqual(results[0].title, "Розы красные")
+        self.assertIn("★ 5.0", results[0].description)
+        self.assertIsInstance(photos[0], InlineQueryResultCachedPhoto)
+        self.assertEqual(photos[0].photo_file_id, 'tulip-photo')
+
+    def test_results_are_paginated(self):
+        Flower.objects.bulk_create([Flower(name=f"Букет {i}", price=Decimal('100')) for i in range(60)])
+        snapshot = self.refresh()
+        results, next_offset = snapshot.inline_results("", '')
+        self.assertEqual((len(results), next_offset), (50, '50'))
+        results, next_offset = snapshot.inline_results("", next_offset)
+        self.assertEqual((len(results), next_offset), (12, ''))
+
+    def test_snapshot_follows_catalog_version(self):
+        self.refresh()
+        self.rose.price = Decimal('1700')
+        self.rose.save()
+        self.assertTrue(catalog.stale)
+        self.assertEqual(self.refresh(force=False).by_id[self.rose.id]['price'], Decimal('1700'))
+
+        # Изменение из другого процесса видно только по счетчику версии в базе
+        Flower.objects.filter(id=self.tulip.id).update(name="Тюльпаны желтые")
+        self.assertEqual(self.refresh(force=False).by_id[self.tulip.id]['name'], "Тюльпаны")
+        CatalogVersion.objects.update(version=F('version') + 1)
+        self.assertEqual(self.refresh(force=False).by_id[self.tulip.id]['name'], "Тюльпаны желтые")
+
+    @override_settings(TELEGRAM_BOT_TOKEN=f"{BOT_ID}:TEST")
+    def test_bot_handlers_read_the_snapshot_store(self):
+        bot = importlib.import_module('bot')
+        self.refresh()
+        query = mock.AsyncMock(query="роз", offset='')
+
+        async_to_sync(bot.inline_catalog)(query)
+        flower = async_to_sync(bot.get_flower_by_id)(self.rose.id)
+
+        results = query.answer.await_args.args[0]
+        self.assertEqual([result.title for result in results], ["Розы красные"])
+        self.assertEqual(flower['name'], "Розы красные")
+
+    def _command(self, text, user_id):
+        return mock.AsyncMock(text=text, from_user=mock.Mock(id=user_id), chat=mock.Mock(id=user_id))
+
+    @override_settings(TELEGRAM_STAFF_IDS=[42])
+    def test_staff_commands_are_refused_to_customers(self):
+        bot = importlib.import_module('bot')
+        for handler, text in ((bot.find, "/find Ленина"), (bot.routes, "/routes"), (bot.forecast, "/forecast")):
+            message = self._command(text, user_id=777)
+            with mock.patch('bot.find_orders') as find_orders:
+                async_to_sync(handler)(message)
+            find_orders.assert_not_called()
+            self.assertEqual(message.answer.await_args.args[0], "Команда доступна только сотрудникам.")
+
+        message = self._command("/find Ленина", user_id=42)
+        with mock.patch('bot.find_orders', mock.AsyncMock(return_value=[])):
+            async_to_sync(bot.find)(message)
+        self.assertEqual(message.answer.await_args.args[0], "Заказы не найдены.")
+
+    def test_help_is_sent_without_markdown(self):
+        bot = importlib.import_module('bot')
+        message = mock.AsyncMock()
+        async_to_sync(bot.send_help)(message)
+        text = message.answer.await_args.args[0]
+        self.assertIn("/repeat_order", text)
+        self.assertIsNone(message.answer.await_args.kwargs.get('parse_mode'))
+
+    @mock.patch('orders.checkout.notify_new_order', return_value=True)
+    def test_add_to_cart_and_checkout(self, notify_new_order):
+        add_to_telegram_cart(777, self.rose.id)
+        summary = add_to_telegram_cart(777, self.rose.id)
+        self.assertEqual((summary['total_items'], summary['total_price']), (2, '3000.00'))
+        with self.assertRaises(CartError):
+            add_to_telegram_cart(777, self.tulip.id, quantity=2)
+
+        order = checkout_telegram_cart(777, date(2030, 3, 8), time(12, 0), "Москва, ул. Тверская, д. 1")
+
+        self.assertEqual(order.total_price, Decimal('3000.00'))
+        self.assertIsNone(order.user)
+        self.assertEqual(OrderHistory.objects.get(order=order).guest_token, 'tg777')
+        self.assertEqual(Flower.objects.get(id=self.rose.id).stock, 3)
+        notify_new_order.assert_called_once_with(order)
+        self.assertIsNone(telegram_cart(777))
+        with self.assertRaises(CartError):
+            checkout_telegram_cart(777, date(2030, 3, 8), time(12, 0), "Москва")
+
+    @mock.patch('orders.checkout.notify_new_order', return_value=True)
+    def test_repeat_order_is_limited_to_own_orders(self, notify_new_order):
+        bot = importlib.import_module('bot')
+        add_to_telegram_cart(777, self.rose.id)
+        order = checkout_telegram_cart(777, date(2030, 3, 8), time(12, 0), "Москва, ул. Тверская, д. 1")
+        history_id = OrderHistory.objects.get(order=order).id
+
+        message = self._command(f"/repeat_order {history_id}", user_id=888)
+        async_to_sync(bot.repeat_order)(message)
+        self.assertEqual(message.answer.await_args.args[0], "Заказ с таким ID не найден.")
+        self.assertFalse(telegram_cart(888, create=True).items.exists())
+
+        message = self._command(f"/repeat_order {history_id}", user_id=777)
+        async_to_sync(bot.repeat_order)(message)
+        self.assertTrue(message.answer.await_args.args[0].startswith(f"Заказ {history_id} добавлен в вашу корзину."))
+        self.assertEqual(telegram_cart(777).items.get().flower, self.rose)
+
+    @mock.patch('orders.checkout.notify_new_order', return_value=True)
+    def test_bot_order_is_paid_on_delivery_and_survives_reconciliation(self, notify_new_order):
+        add_to_telegram_cart(777, self.rose.id)
+        order = checkout_telegram_cart(777, date(2030, 3, 8), time(12, 0), "Москва, ул. Тверская, д. 1")
+        self.assertEqual(order.payment_method, Order.ON_DELIVERY)
+
+        later = timezone.now() + timedelta(hours=2)
+        self.assertEqual(reconcile_payments(now=later)['expired'], 0)
+        release_expired_reservations(now=later)
+
+        self.assertEqual(Order.objects.get(id=order.id).status, 'pending')
+        self.assertEqual(StockReservation.objects.get(order=order).status, StockReservation.COMMITTED)
+        self.assertEqual(Flower.objects.get(id=self.rose.id).stock, 4)
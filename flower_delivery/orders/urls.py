@@ -1,9 +1,11 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from . import views
-from django.contrib.auth.views import LogoutView
+from django.contrib.auth.views import LoginView, LogoutView
+from .assets import serve as serve_static
+from .ratelimit import ratelimit
 
 urlpatterns = [
 
@@ -11,14 +13,24 @@ urlpatterns = [
     path('add_to_cart/<int:flower_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.view_cart, name='cart'),
     path('remove_from_cart/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('api/cart/', views.cart_api, name='cart_api'),
+    path('api/cart/add/', views.cart_api_add, name='cart_api_add'),
+    path('api/cart/set/', views.cart_api_set, name='cart_api_set'),
+    path('api/cart/remove/', views.cart_api_remove, name='cart_api_remove'),
+    path('api/cart/batch/', views.cart_api_batch, name='cart_api_batch'),
     path('cart/confirm/', views.confirm_order, name='confirm_order'),
     path('payment_window/<int:order_id>/', views.payment_window, name='payment_window'),
+    path('payment/<int:order_id>/status/', views.payment_status, name='payment_status'),
+    path('payment/webhook/', views.payment_webhook, name='payment_webhook'),
+    path('telegram/webhook/', views.telegram_webhook, name='telegram_webhook'),
     path('orders/history/', views.order_history, name='order_history'),
     path('report/', views.generate_report, name='generate_report'),
     path('accounts/signup/', views.signup, name='signup'),
+    path('accounts/login/', ratelimit('login', methods=('POST',))(LoginView.as_view()), name='login'),
     path('logout/', LogoutView.as_view(next_page='index'), name='logout'),
     path('accounts/', include('django.contrib.auth.urls')),
     path('flower/<int:flower_id>/', views.flower_detail, name='flower_detail'),
+    path('metrics/cache/', views.cache_metrics, name='cache_metrics'),
     path('orders/repeat/<int:order_id>/', views.repeat_order, name='repeat_order'),
     path('flower/<int:flower_id>/reviews/', views.view_reviews, name='view_reviews'),
     path('flower/<int:flower_id>/rating/', views.add_rating, name='add_rating'),
@@ -27,3 +39,6 @@ urlpatterns = [
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if settings.SERVE_STATIC:
+    urlpatterns += [re_path(r'^%s(?P<path>.+)$' % settings.STATIC_URL.lstrip('/'), serve_static, name='static')]
@@ -1,9 +1,23 @@
+import json
 import logging
 import os
+import uuid
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Flower, Order, Cart, CartItem, Review, Rating, Report, OrderHistory
+from .models import Flower, Order, CartItem, Review, Rating, Report, OrderHistory
 from .forms import OrderForm, ReviewForm, RatingForm
+from .stock import OutOfStock
+from .checkout import place_order
+from .status import CONFIRMED
+from .payments import PaymentError, handle_callback, refresh_payment, start_payment
+from .cart import (ADD, SET, CartConflict, CartError, SessionCart, acart_summary, aget_request_cart, apply_cart_ops,
+                   cart_summary, get_request_cart, item_flower_id, promote_session_cart, user_cart)
+from .history import aget_guest_token, ahistory_page, get_guest_token
+from .reorder import ReorderError, reorder
+from .caching import aflower_detail_key, aget_or_compute, stats as cache_stats
+from .recommendations import ALSO, TOGETHER, aget_recommendations
+from .ratelimit import ratelimit
+from .replica import replica_reads
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
@@ -11,72 +25,73 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib.auth import logout
 from django.utils import timezone
-from django.db.models import Sum, Avg
+from django.db import transaction
+from django.db.models import Sum, Avg, Count
 from aiogram import Bot
 from aiogram.types import Message
 from aiogram.filters import Command
 from django.utils.timezone import now
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-# Настройка логирования
+# Настройка логирования (см. orders/log.py): аргументы передаются %-стилем и форматируются в фоновом потоке
 logger = logging.getLogger(__name__)
+# Просмотры страниц и добавления в корзину — самые частые записи, они пишутся выборочно (settings.LOG_SAMPLING)
+access_logger = logging.getLogger('orders.access')
+
+# Сколько последних отзывов показывать на странице букета
+FLOWER_DETAIL_REVIEWS = 50
 
 # Инициализация Telegram-бота
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 
-def index(request):
-    """Главная страница с каталогом товаров"""
-    flowers = Flower.objects.all()  # Получаем все товары из модели Flower
+async def _auser(request):
+    """Пользователь запроса для async-представлений.
 
-    # Инициализация переменных корзины
-    total_items = 0
-    total_price = 0
+    ``request.user`` заменяется загруженным объектом, чтобы шаблоны не
+    обращались к базе синхронно из цикла событий.
+    """
+    request.user = await request.auser()
+    return request.user
 
-    # Получаем корзину для авторизованного пользователя или гостя
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(user=None, session_key=session_key)
 
-    # Если корзина существует, получаем данные
-    if cart:
-        total_items = cart.total_items()
-        total_price = cart.total_price()
+async def index(request):
+    """Главная страница с каталогом товаров"""
+    user = await _auser(request)
+    flowers = [flower async for flower in Flower.objects.all()]  # Получаем все товары из модели Flower
+
+    # Получаем корзину для авторизованного пользователя или гостя
+    cart = await aget_request_cart(request)
+    summary = await acart_summary(cart)
+    total_items = summary['total_items']
+    total_price = summary['total_price']
 
-    logger.info(f"User {request.user} accessed the index page. Cart total items: {total_items}, total price: {total_price}")
+    access_logger.info("User %s accessed the index page. Cart total items: %s, total price: %s",
+                       user.pk, total_items, total_price)
 
     # Передаем данные в шаблон
     return render(request, 'orders/index.html', {
         'flowers': flowers,
         'total_items': total_items,
-        'total_price': total_price
+        'total_price': total_price,
+        'cart_version': cart.version,
     })
 
+@ratelimit('add_to_cart')
 def add_to_cart(request, flower_id):
     """Добавление товара в корзину"""
-    session_key = request.session.session_key
-    if not session_key:
-        request.session.create()
-        session_key = request.session.session_key
-
     flower = get_object_or_404(Flower, id=flower_id)
+    cart = get_request_cart(request)
 
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        cart, created = Cart.objects.get_or_create(user=None, session_key=session_key)
-
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, flower=flower)
-    if not created:
-        cart_item.quantity += 1
-    cart_item.save()
+    try:
+        apply_cart_ops(cart, [(ADD, flower.id, 1)])
+    except CartError as e:
+        messages.error(request, str(e))
+        return redirect('cart')
 
-    logger.info(f"Added {flower.name} (ID: {flower.id}) to cart with quantity {cart_item.quantity}")
+    access_logger.info("Added flower %s to cart %s", flower.id, cart.id)
 
     return redirect('cart')
 
@@ -104,69 +119,128 @@ def order(request, flower_id):
         return redirect('index')  # Перенаправляем на главную страницу
     return render(request, 'orders/order.html', {'flower': flower})
 
-def view_cart(request):
+async def view_cart(request):
     """Просмотр корзины"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(user=None, session_key=session_key)
-
-    cart_items = CartItem.objects.filter(cart=cart)
-    total_price = cart.total_price()
-    total_items = cart.total_items()
+    await _auser(request)
+    cart = await aget_request_cart(request)
+    summary = await acart_summary(cart)
 
     return render(request, 'orders/cart.html', {
-        'cart_items': cart_items,
-        'total_price': total_price,
-        'total_items': total_items,
+        'cart_items': summary['items'],
+        'total_price': summary['total_price'],
+        'total_items': summary['total_items'],
+        'cart_version': summary['version'],
+        'recommended': await aget_recommendations([item['flower_id'] for item in summary['items']], kind=TOGETHER),
     })
 
 @login_required(login_url='/accounts/login/')
 def remove_from_cart(request, cart_item_id):
     """Удаление элемента из корзины"""
-    cart_item = get_object_or_404(CartItem, id=cart_item_id)
-    cart_item.delete()
+    cart = get_request_cart(request)
+    cart_item = get_object_or_404(CartItem, id=cart_item_id, cart=cart)  # Только из своей корзины
+    apply_cart_ops(cart, [(SET, cart_item.flower_id, 0)])
 
-    logger.info(f"User {request.user} removed item with ID {cart_item.id} from their cart.")
+    access_logger.info("User %s removed item %s from cart %s", request.user.pk, cart_item_id, cart.id)
 
     return redirect('cart')
 
+
+def _cart_api_payload(request):
+    """Тело запроса JSON API корзины (JSON или обычная форма)"""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            raise CartError("Некорректный JSON.")
+    return request.POST.dict()
+
+
+def _cart_api_update(request, build_ops):
+    """Общая обработка изменений корзины через JSON API"""
+    cart = get_request_cart(request)
+    try:
+        payload = _cart_api_payload(request)
+        if 'version' not in payload:
+            raise CartError("Не указана версия корзины.")
+        summary = apply_cart_ops(cart, build_ops(cart, payload), version=int(payload['version']))
+    except CartConflict as e:
+        cart = get_request_cart(request)
+        return JsonResponse({'error': str(e), 'cart': cart_summary(cart)}, status=409)
+    except CartError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': "Некорректные параметры запроса."}, status=400)
+    return JsonResponse({'cart': summary})
+
+
+def cart_api(request):
+    """Текущее состояние корзины"""
+    return JsonResponse({'cart': cart_summary(get_request_cart(request))})
+
+
+@require_POST
+def cart_api_add(request):
+    """Добавление букета: {flower_id, quantity=1, version}"""
+    return _cart_api_update(request, lambda cart, data: [
+        (ADD, int(data['flower_id']), int(data.get('quantity', 1)))
+    ])
+
+
+@require_POST
+def cart_api_set(request):
+    """Установка количества: {flower_id, quantity, version}"""
+    return _cart_api_update(request, lambda cart, data: [
+        (SET, int(data['flower_id']), int(data['quantity']))
+    ])
+
+
+@require_POST
+def cart_api_remove(request):
+    """Удаление позиции своей корзины: {item_id, version}"""
+    def build_ops(cart, data):
+        flower_id = item_flower_id(cart, int(data['item_id']))
+        if flower_id is None:
+            raise CartError("Такой позиции нет в вашей корзине.")
+        return [(SET, flower_id, 0)]
+
+    return _cart_api_update(request, build_ops)
+
+
+@require_POST
+def cart_api_batch(request):
+    """Пакетное изменение: {items: [{flower_id, quantity}], version}; количество задается, 0 — удалить"""
+    return _cart_api_update(request, lambda cart, data: [
+        (SET, int(item['flower_id']), int(item['quantity'])) for item in data['items']
+    ])
+
+@ratelimit('confirm_order', methods=('POST',))
 def confirm_order(request):
     """Подтверждение заказа для авторизованных пользователей и гостей"""
     if request.user.is_authenticated:
-        cart = get_object_or_404(Cart, user=request.user)
+        cart = user_cart(request.user)
         user = request.user
     else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart = get_object_or_404(Cart, session_key=session_key)
+        cart = None  # Корзина гостя переносится из сессии в базу только при отправке формы
         user = None
 
-    logger.info("Received POST request on /cart/confirm/")
-
     # Создаем форму
     form = OrderForm(request.POST or None)
 
     if request.method == 'POST':
-        logger.info(f"Processing order confirmation for user: {request.user if request.user.is_authenticated else 'Guest'}")
-
-        # Логирование данных формы для диагностики
-        logger.info(f"Form data: {request.POST}")
+        # Данные формы (адрес, телефон) в лог не пишутся, только названия полей
+        logger.debug("Processing order confirmation for user %s, fields: %s",
+                     request.user.pk, sorted(request.POST.keys()))
 
         # Если форма не прошла валидацию
         if not form.is_valid():
-            logger.warning(f"Validation failed: invalid form data {form.errors}")
+            logger.warning("Order form is invalid: %s", form.errors.as_json())
             messages.error(request, "Форма заполнена неверно.")
             return redirect('cart')
 
         # Проверка обязательных полей
-        if not cart.items.exists():
+        if cart is None:
+            cart = promote_session_cart(request)
+        if cart is None or not cart.items.exists():
             messages.error(request, "Ваша корзина пуста.")
             return redirect('cart')
 
@@ -174,53 +248,23 @@ def confirm_order(request):
             messages.error(request, "Для этой корзины уже был оформлен заказ.")
             return redirect('cart')
 
-        flower = cart.items.first().flower  # Предполагается, что корзина не пуста
-
-        # Создание нового заказа
-        order = Order.objects.create(
-            user=user,
-            cart=cart,
-            flower=flower,
-            delivery_date=form.cleaned_data['delivery_date'],
-            delivery_time=form.cleaned_data['delivery_time'],
-            address=form.cleaned_data['address'],
-            guest_email=form.cleaned_data.get('guest_email'),
-            guest_phone=form.cleaned_data.get('guest_phone')
-        )
-
-        # Обновление общей стоимости
-        order.total_price = cart.total_price()
-        order.save()
-
-        logger.info(f"Redirecting to payment_window for order ID: {order.id}")
-
-        # Добавление записи в историю заказов
-        guest_user, _ = User.objects.get_or_create(username="guest")
-        order_user = order.user if order.user else guest_user
-
-        for item in cart.items.all():
-            OrderHistory.objects.create(
-                user=order_user,
-                flower=item.flower,
-                delivery_date=order.delivery_date,
-                delivery_time=order.delivery_time,
-                delivery_address=order.address,
-                comment=order.comment,
-                cost=item.total_price()
-            )
-
-        # Отправка заказа в Telegram
+        # Создание заказа и резервирование букетов в одной транзакции; гостевой заказ привязывается к токену из сессии
         try:
-            logger.info(f"Sending order {order.id} to Telegram")
-            order.send_to_telegram()
-        except Exception as e:
-            logger.error(f"Ошибка при отправке заказа в Telegram: {e}")
-            messages.error(request, "Ошибка при отправке заказа, попробуйте позже.")
+            order = place_order(
+                cart,
+                user=user,
+                guest_token='' if user else get_guest_token(request, create=True),
+                delivery_date=form.cleaned_data['delivery_date'],
+                delivery_time=form.cleaned_data['delivery_time'],
+                address=form.cleaned_data['address'],
+                guest_email=form.cleaned_data.get('guest_email'),
+                guest_phone=form.cleaned_data.get('guest_phone'),
+            )
+        except OutOfStock as e:
+            logger.warning("Order for cart %s rejected: %s", cart.id, e)
+            messages.error(request, "К сожалению, часть букетов закончилась. Измените корзину.")
             return redirect('cart')
 
-        # Очистка корзины
-        logger.info(f"Cart {cart.id} items before clearing: {cart.items.count()}")
-
         # Перенаправление на страницу оплаты
         return redirect('payment_window', order_id=order.id)
 
@@ -228,43 +272,70 @@ def confirm_order(request):
 
 
 
+def _get_customer_order(request, order_id):
+    """Заказ текущего покупателя; чужой заказ — 404"""
+    order = get_object_or_404(Order.objects.select_related('cart'), id=order_id)
+    if request.user.is_authenticated and order.user_id == request.user.id:
+        return order
+    guest_token = get_guest_token(request)
+    if order.user_id is None and guest_token and order.history.filter(guest_token=guest_token).exists():
+        return order
+    raise Http404("Заказ не найден")
+
+
 def payment_window(request, order_id):
-    """Окно оплаты"""
-    # Получаем заказ по ID
-    order = get_object_or_404(Order, id=order_id)
+    """Окно оплаты: POST только регистрирует платеж и сразу переходит к ожиданию результата"""
+    order = _get_customer_order(request, order_id)
 
-    # Если форма отправлена (например, при успешной оплате)
     if request.method == 'POST':
-        payment_successful = True  # Пример: если оплата прошла успешно
+        try:
+            payment = start_payment(order, request.POST.get('idempotency_key', ''))
+        except PaymentError as e:
+            logger.warning("Payment for order %s rejected: %s", order.id, e, extra={'order_id': order.id})
+            return render(request, 'orders/payment_window.html',
+                          {'order': order, 'error': str(e), 'idempotency_key': uuid.uuid4().hex})
 
-        if payment_successful:
-            # Очистка корзины после успешной оплаты
-            order.cart.items.all().delete()  # Удаляем все элементы из корзины
-            order.cart.is_completed = True  # Помечаем корзину как завершенную
-            order.cart.save()
+        logger.info("Payment %s for order %s accepted, waiting for confirmation", payment.id, order.id,
+                    extra={'order_id': order.id})
+        return redirect('payment_status', order_id=order.id)
 
-            # Логирование успешной оплаты
-            logger.info(f"Payment for order {order.id} was successful.")
+    # Ключ идемпотентности: повторная отправка той же формы не создаст второй платеж
+    return render(request, 'orders/payment_window.html',
+                  {'order': order, 'total_price': order.total_price, 'idempotency_key': uuid.uuid4().hex})
 
-            # Перенаправление на главную страницу
-            return redirect('index')
-        else:
-            # Логирование ошибки при оплате
-            logger.warning(f"Payment for order {order.id} failed.")
-            return render(request, 'orders/payment_window.html', {'order': order, 'error': 'Оплата не прошла.'})
 
-    # Если не отправлен POST-запрос (например, когда просто загружается страница)
-    return render(request, 'orders/payment_window.html', {'order': order, 'total_price': order.total_price})
+def payment_status(request, order_id):
+    """Страница ожидания результата оплаты"""
+    order = _get_customer_order(request, order_id)
+    payment = order.payments.order_by('-id').first()
+    if payment is not None and refresh_payment(payment):
+        order.refresh_from_db(fields=['status'])
+
+    if order.status == CONFIRMED and order.user is None:
+        SessionCart(request.session).clear()  # Корзина гостя в сессии больше не нужна
+    return render(request, 'orders/payment_status.html', {'order': order, 'payment': payment})
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """Уведомление платежного провайдера о результате оплаты"""
+    try:
+        handle_callback(request)
+    except PaymentError as e:
+        logger.warning("Rejected payment webhook: %s", e)
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"status": "ok"})
 
 def send_to_telegram(self):
     # Проверка обязательных данных
     if not self.delivery_date or not self.delivery_time or not self.address:
-        logger.error(f"Order {self.id} is missing required data: delivery date, time, or address")
+        logger.error("Order %s is missing required data: delivery date, time, or address", self.id)
         return False
 
     # Проверка, есть ли товары в заказе
     if not self.cart.items.exists():
-        logger.error(f"Order {self.id} has no items in the cart")
+        logger.error("Order %s has no items in the cart", self.id)
         return False
 
     # Теперь отправляем данные в Telegram
@@ -276,57 +347,65 @@ def send_to_telegram(self):
             "parse_mode": "Markdown"
         })
         response.raise_for_status()
-        logger.info(f"Order {self.id} successfully sent to Telegram.")
+        logger.info("Order %s successfully sent to Telegram", self.id)
         return True
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error sending order {self.id} to Telegram: {e}")
+        logger.error("Error sending order %s to Telegram: %s", self.id, e)
         return False
 
-def telegram_webhook(request):
-    if request.method == "POST":
-        # Обрабатывайте данные из Telegram
-        return JsonResponse({"status": "ok"})
-    return JsonResponse({"error": "invalid request"}, status=400)
+@csrf_exempt
+async def telegram_webhook(request):
+    """Обновления Telegram для бота, когда он работает в том же ASGI-процессе, что и сайт"""
+    if request.method != "POST":
+        return JsonResponse({"error": "invalid request"}, status=400)
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    if not secret or request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    from aiogram.types import Update
+    from bot import bot as telegram_bot, dp
+
+    try:
+        update = Update.model_validate(json.loads(request.body), context={'bot': telegram_bot})
+    except ValueError:
+        return JsonResponse({"error": "invalid update"}, status=400)
+    await dp.feed_update(telegram_bot, update)
+    return JsonResponse({"status": "ok"})
 
 @login_required
 def repeat_order(request, order_id):
-    """Повторное оформление заказа"""
-    # Получаем заказ из истории
-    order_history = get_object_or_404(OrderHistory, id=order_id, user=request.user)
-
-    # Создаем новую корзину для повторного заказа
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart.items.all().delete()  # Очищаем корзину, чтобы добавить элементы текущего заказа
-
-    # Добавляем элемент из истории заказа в корзину
-    CartItem.objects.create(
-        cart=cart,
-        flower=order_history.flower,
-        quantity=order_history.quantity  # Используем количество из истории заказа
-    )
+    """Повторное оформление заказа: позиции из истории добавляются в корзину по текущим ценам"""
+    try:
+        summary, added, repriced = reorder(order_id, user=request.user, cart=get_request_cart(request))
+    except ReorderError as e:
+        raise Http404(str(e))
+    except CartError as e:
+        messages.error(request, str(e))
+        return redirect('cart')
+
+    if not added:
+        messages.info(request, "Этот заказ уже добавлен в корзину.")
+    if repriced:
+        messages.info(request, f"Цены изменились: {', '.join(repriced)}. В корзине указаны актуальные цены.")
 
-    # Создаем новый заказ
-    new_order = Order.objects.create(
-        user=request.user,
-        cart=cart,
-        flower=order_history.flower,
-        quantity=order_history.quantity,
-        delivery_date=order_history.delivery_date,
-        delivery_time=order_history.delivery_time,
-        address=order_history.delivery_address,
-        comment=order_history.comment
-    )
+    return redirect('cart')
 
-    # Перенаправляем на страницу оплаты
-    return redirect('payment_window', order_id=new_order.id)
 
+async def order_history(request):
+    """Отображение истории заказов пользователя или гостя (постранично)"""
+    user = await _auser(request)
+    if user.is_authenticated:
+        rows = OrderHistory.objects.filter(user=user)
+    else:
+        guest_token = await aget_guest_token(request)
+        if not guest_token:
+            return redirect(settings.LOGIN_URL)
+        rows = OrderHistory.objects.filter(user=None, guest_token=guest_token)
 
-@login_required
-def order_history(request):
-    """Отображение истории заказов пользователя"""
-    orders = OrderHistory.objects.filter(user=request.user).order_by('-completed_at')  # Получаем заказы пользователя
-    return render(request, 'orders/order_history.html', {'orders': orders})
+    orders, next_cursor = await ahistory_page(rows, cursor=request.GET.get('after'))
+    return render(request, 'orders/order_history.html', {'orders': orders, 'next_cursor': next_cursor})
 
+@ratelimit('signup', methods=('POST',))
 def signup(request):
     """Регистрация нового пользователя"""
     if request.method == 'POST':
@@ -339,35 +418,64 @@ def signup(request):
         form = UserCreationForm()
     return render(request, 'registration/signup.html', {'form': form})
 
-def flower_detail(request, flower_id):
+async def _flower_detail_data(flower_id):
+    """Данные страницы букета для кэша: сам букет, последние отзывы и средний рейтинг"""
+    try:
+        flower = await Flower.objects.aget(id=flower_id)
+    except Flower.DoesNotExist:
+        raise Http404("Букет не найден")
+    stats = await flower.reviews.aaggregate(average_rating=Avg('rating'), review_count=Count('id'))
+    reviews = [
+        {'username': review.user.username, 'rating': review.rating, 'comment': review.comment}
+        async for review in flower.reviews.select_related('user')[:FLOWER_DETAIL_REVIEWS]
+    ]
+    return {
+        'flower': flower,
+        'reviews': reviews,
+        'review_count': stats['review_count'],
+        'average_rating': stats['average_rating'] or 0,
+        'bought_together': await aget_recommendations(flower.id, kind=TOGETHER),
+        'also_ordered': await aget_recommendations(flower.id, kind=ALSO),
+    }
+
+
+async def flower_detail(request, flower_id):
     """Детальная страница для каждого цветка с отзывами и рейтингами"""
-    flower = get_object_or_404(Flower, id=flower_id)
-    reviews = flower.reviews.all()  # Все отзывы для текущего цветка
-    average_rating = flower.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    user = await _auser(request)
+    data = await aget_or_compute(await aflower_detail_key(flower_id), lambda: _flower_detail_data(flower_id))
+    flower = data['flower']
 
     if request.method == 'POST':
+        if not user.is_authenticated:
+            return redirect(settings.LOGIN_URL)
         rating = int(request.POST.get('rating'))
         comment = request.POST.get('comment')
 
         if 1 <= rating <= 5:  # Проверка валидности рейтинга
-            review = Review.objects.create(
+            await Review.objects.acreate(
                 flower=flower,
-                user=request.user,
+                user=user,
                 rating=rating,
                 comment=comment
             )
             return redirect('flower_detail', flower_id=flower.id)
 
-    return render(request, 'orders/flower_detail.html', {
-        'flower': flower,
-        'reviews': reviews,
-        'average_rating': average_rating,
-    })
+    return render(request, 'orders/flower_detail.html', data)
+
+
+@staff_member_required
+def cache_metrics(request):
+    """Статистика попаданий в кэш страниц букетов (по текущему процессу)"""
+    return JsonResponse(cache_stats.as_dict())
 
 # Страница с отзывами
-def view_reviews(request, flower_id):
-    flower = get_object_or_404(Flower, id=flower_id)
-    reviews = Review.objects.filter(flower=flower)  # Предположим, у вас есть модель Review
+async def view_reviews(request, flower_id):
+    await _auser(request)
+    try:
+        flower = await Flower.objects.aget(id=flower_id)
+    except Flower.DoesNotExist:
+        raise Http404("Букет не найден")
+    reviews = [review async for review in Review.objects.filter(flower=flower).select_related('user')]
     return render(request, 'flower_reviews.html', {'flower': flower, 'reviews': reviews})
 
 def flower_rating(request):
@@ -388,13 +496,16 @@ def add_rating(request, flower_id):
         form = RatingForm()
 
     return render(request, 'add_rating.html', {'flower': flower, 'form': form})
+
+
 @login_required(login_url='/accounts/login/')
+@replica_reads
 def generate_report(request):
     """Генерация отчета по заказам за текущий день"""
     today = timezone.now().date()
 
     total_orders = Order.objects.filter(created_at__date=today).count()
-    total_sales = Order.objects.filter(created_at__date=today).aggregate(models.Sum('total_price'))[
+    total_sales = Order.objects.filter(created_at__date=today).aggregate(Sum('total_price'))[
                       'total_price__sum'] or 0
     total_revenue = total_sales
     total_expenses = 1000  # Примерные расходы на доставку или другие расходы
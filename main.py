@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 # Добавляем путь к Django проекту
@@ -10,31 +11,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "flower_delivery.settings")
 import django
 django.setup()
 
-from orders.models import Flower, Order
-from aiogram import Bot, Dispatcher, types
-from aiogram.types import ParseMode
-from aiogram.utils import executor
-from django.conf import settings
-
-# Настройка логирования
-import logging
-logging.basicConfig(level=logging.INFO)
-
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-dp = Dispatcher(bot)
-
-@dp.message_handler(commands=['start'])
-async def start(message: types.Message):
-    await message.reply("Здравствуйте! Я бот для оформления заказов.")
-
-@dp.message_handler(commands=['order'])
-async def order(message: types.Message):
-    # Пример обработки заказа
-    await message.reply("Ваш заказ принят!")
-
 def start_bot():
-    """Запуск Telegram бота"""
-    executor.start_polling(dp, skip_updates=True)
+    """Запуск Telegram бота из flower_delivery/bot.py: команды, inline-каталог, корзина и оформление заказа"""
+    from bot import main as run_bot
+    asyncio.run(run_bot())
 
 def main():
     """Основная функция для запуска всех процессов"""